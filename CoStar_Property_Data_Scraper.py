@@ -1,33 +1,594 @@
 # coding: utf-8
 
-from selenium import webdriver
-from webdriver_manager.chrome import ChromeDriverManager
 import os
 import time
 import pandas as pd
 import numpy as np
 from glob import glob
-from selenium.webdriver.common.by import By
-from selenium.webdriver.common.action_chains import ActionChains
-from selenium.common.exceptions import TimeoutException
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.chrome.service import Service as ChromeService
-from selenium.webdriver.chrome.options import Options as ChromeOptions
 import datetime
-from sqlalchemy import create_engine, MetaData, update
-from sqlalchemy.types import BIGINT, INTEGER, VARCHAR, FLOAT, DATETIME
-import pyodbc  # Needs to be imported to support string connector of sql alchemy engine
 import urllib
-from tqdm import tqdm
+import re
+import hashlib
+import base64
+import zlib
+import random
+import collections
+import contextlib
+import itertools
+import mmap
+import sqlite3
 import json
-from concurrent.futures import as_completed, ProcessPoolExecutor
-from requests_futures.sessions import FuturesSession
-from requests import Session
-from dotenv import load_dotenv
+import functools
+import operator
+import queue
+import threading
+import asyncio
+import argparse
+from concurrent.futures import as_completed, wait, FIRST_COMPLETED, ProcessPoolExecutor
 
+# selenium, webdriver_manager, sqlalchemy, pyodbc, pyarrow, aiohttp, requests_futures, tqdm and
+# dotenv are imported by the functions that use them, so that re-parsing saved responses or
+# re-loading a snapshot does not pay for importing the login, fetch and database dependencies.
+
+
+def set_json_backend(backend='auto'):
+    """
+    Select the JSON library used to decode call responses.
+
+    Parameters
+    ----------
+    backend : str, optional
+        'orjson' for the orjson library, 'json' for the standard library, or 'auto' to use
+        orjson when it is installed and fall back to the standard library otherwise.
+        The default is 'auto'.
+
+    Returns
+    -------
+    backend : str
+        Name of the backend in use, 'orjson' or 'json'.
+
+    """
+    global json_loads
+    json_loads = json.loads
+    if backend in ('auto', 'orjson'):
+        try:
+            import orjson
+            json_loads = orjson.loads
+        except ImportError:
+            if backend == 'orjson':
+                raise
+            backend = 'json'
+        else:
+            backend = 'orjson'
+    # exported so worker processes started by the parallel parse stage use the same backend
+    os.environ['COSTAR_JSON_BACKEND'] = backend
+    return backend
+
+
+set_json_backend(os.getenv('COSTAR_JSON_BACKEND', 'auto'))
+
+# Headers sent with every XHR request to the CoStar API.
+REQUEST_HEADERS = {
+    "Content-Type": "application/json",
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/97.0.4692.71 Safari/537.36",
+    "Accept-Encoding": "*",
+    "Connection": "keep-alive",
+    'origin': 'https://product.costar.com',
+    'x-requested-with': 'XMLHttpRequest'
+}
+
+# GraphQL operations of the request payload, in the order their results appear in each response.
+PAYLOAD_OPERATIONS = ('Amenities_Info',
+                      'UnitMix_Detail',
+                      'About_Info',
+                      'Location_Info',
+                      'getCompsContext',
+                      'ContactsDetail',
+                      'getPropertyInfo')
+
+# Default time a cached operation result stays fresh before the section is fetched again.
+SECTION_TTLS = {'Amenities_Info': datetime.timedelta(days=7),
+                'UnitMix_Detail': datetime.timedelta(days=1),
+                'About_Info': datetime.timedelta(days=7),
+                'Location_Info': datetime.timedelta(days=7),
+                'getCompsContext': datetime.timedelta(days=7),
+                'ContactsDetail': datetime.timedelta(days=7),
+                'getPropertyInfo': datetime.timedelta(days=1)}
+
+# Root field of each payload operation with its variable definitions and root field arguments.
+PAYLOAD_OPERATION_ROOTS = {'Amenities_Info': ('amenities_Info', '$propertyId: Int!', 'propertyId: $propertyId'),
+                           'UnitMix_Detail': ('unit_mix_detail', '$propertyId: Int!, $showOnlyActual: Boolean',
+                                              'propertyId: $propertyId, showOnlyActual: $showOnlyActual'),
+                           'About_Info': ('propertyContactDetails_info', '$propertyId: Int!', 'propertyId: $propertyId'),
+                           'Location_Info': ('location_Info', '$propertyId: Int!', 'propertyId: $propertyId'),
+                           'getCompsContext': ('get_comps_context', '$propertyId: Int!', 'propertyId: $propertyId'),
+                           'ContactsDetail': ('propertyContactDetails_info', '$propertyId: Int!', 'propertyId: $propertyId'),
+                           'getPropertyInfo': ('property_info', '$propertyId: Int!, $currencyCode: String',
+                                               'propertyId: $propertyId, currencyCode: $currencyCode')}
+
+
+@functools.lru_cache()
+def get_sql_dtypes():
+    """
+    Build the SQL Server column types of the CoStarPropertyExport table.
+
+    Returns
+    -------
+    sql_dtypes : dict
+        Dictionary of column name: SQL Alchemy type, passed to DataFrame.to_sql.
+
+    """
+    from sqlalchemy.types import BIGINT, INTEGER, VARCHAR, FLOAT, DATETIME
+    return {'CoStarPropertyID': BIGINT,
+            'PropertyName': VARCHAR(250, collation="SQL_Latin1_General_CP1_CI_AS"),
+            'PropertyAddress': VARCHAR(250, collation="SQL_Latin1_General_CP1_CI_AS"),
+            'OneBedroomAskingRentUnit': INTEGER,
+            'TwoBedroomAskingRentUnit': INTEGER,
+            'ThreeBedroomAskingRentUnit': INTEGER,
+            'FourBedroomAskingRentUnit': INTEGER,
+            'StudioAskingRentUnit': INTEGER,
+            'OneBedroomAvgSF': INTEGER,
+            'TwoBedroomAvgSF': INTEGER,
+            'ThreeBedroomAvgSF': INTEGER,
+            'FourBedroomAvgSF': INTEGER,
+            'StudioAvgSF': INTEGER,
+            'OneBedroomEffectiveRentUnit': INTEGER,
+            'TwoBedroomEffectiveRentUnit': INTEGER,
+            'ThreeBedroomEffectiveRentUnit': INTEGER,
+            'FourBedroomEffectiveRentUnit': INTEGER,
+            'StudioEffectiveRentUnit': FLOAT,
+            'NumberOf1BedroomsUnits': INTEGER,
+            'NumberOf2BedroomsUnits': INTEGER,
+            'NumberOf3BedroomsUnits': INTEGER,
+            'NumberOf4BedroomsUnits': INTEGER,
+            'NumberOfStudioUnits': INTEGER,
+            'NumberOfUnits': INTEGER,
+            'OneBedroomConcessionsPercentage': FLOAT,
+            'TwoBedroomConcessionsPercentage': FLOAT,
+            'ThreeBedroomConcessionsPercentage': FLOAT,
+            'FourBedroomConcessionsPercentage': FLOAT,
+            'StudioConcessionsPercentage': FLOAT,
+            'Latitude': FLOAT,
+            'Longitude': FLOAT,
+            'OperationalStatus': FLOAT,
+            'PropertyManagerName': VARCHAR(250, collation="SQL_Latin1_General_CP1_CI_AS"),
+            'OwnerName': VARCHAR(250, collation="SQL_Latin1_General_CP1_CI_AS"),
+            'ParentCompany': FLOAT,
+            'BuildingClass': VARCHAR(250, collation="SQL_Latin1_General_CP1_CI_AS"),
+            'StarRating': BIGINT,
+            'Amenities': VARCHAR(250, collation="SQL_Latin1_General_CP1_CI_AS"),
+            'YearBuilt': FLOAT,
+            'YearRenovated': FLOAT,
+            'PercentLeased': FLOAT,
+            'City': VARCHAR(100, collation="SQL_Latin1_General_CP1_CI_AS"),
+            'State': VARCHAR(2, collation="SQL_Latin1_General_CP1_CI_AS"),
+            'Zip': VARCHAR(10, collation="SQL_Latin1_General_CP1_CI_AS"),
+            'PropertyType': VARCHAR(250, collation="SQL_Latin1_General_CP1_CI_AS"),
+            'BuildingStatus': VARCHAR(250, collation="SQL_Latin1_General_CP1_CI_AS"),
+            'ConstructionStatus': VARCHAR(250, collation="SQL_Latin1_General_CP1_CI_AS"),
+            'TrueOwnerName': VARCHAR(250, collation="SQL_Latin1_General_CP1_CI_AS"),
+            'ParkingSpaces': BIGINT,
+            'BuildingStories': BIGINT,
+            'CollectedDateStamp': DATETIME,
+            'MostRecentFlag': INTEGER}
+
+
+@functools.lru_cache()
+def get_snapshot_types():
+    """
+    Build the Arrow and nullable pandas types of each SQL column type, used for typed
+    columnar snapshots.
+
+    Returns
+    -------
+    snapshot_types : tuple
+        Tuple of (SQL Alchemy generic type, pyarrow DataType, pandas dtype name) tuples.
+
+    """
+    import pyarrow as pa
+    from sqlalchemy.types import BigInteger, Integer, Float, String, DateTime
+    return ((BigInteger, pa.int64(), 'Int64'),
+            (Integer, pa.int32(), 'Int32'),
+            (Float, pa.float64(), 'Float64'),
+            (String, pa.string(), 'string'),
+            (DateTime, pa.timestamp('us'), 'datetime64[ns]'))
+
+
+@functools.lru_cache()
+def get_snapshot_pandas_types():
+    """
+    Build the nullable pandas dtypes snapshot columns are read back as.
+
+    Returns
+    -------
+    snapshot_pandas_types : dict
+        Dictionary of pyarrow DataType: pandas extension dtype.
+
+    """
+    import pyarrow as pa
+    return {pa.int64(): pd.Int64Dtype(),
+            pa.int32(): pd.Int32Dtype(),
+            pa.float64(): pd.Float64Dtype(),
+            pa.string(): pd.StringDtype()}
+
+
+# Rows per row group in snapshot store partitions. Small row groups over property-sorted rows
+# let property ID filters skip most of each partition.
+SNAPSHOT_ROW_GROUP_SIZE = 2000
+
+# Asking and effective rent columns returned by rent time series queries on the snapshot store.
+RENT_COLUMNS = ['StudioAskingRentUnit',
+                'OneBedroomAskingRentUnit',
+                'TwoBedroomAskingRentUnit',
+                'ThreeBedroomAskingRentUnit',
+                'FourBedroomAskingRentUnit',
+                'StudioEffectiveRentUnit',
+                'OneBedroomEffectiveRentUnit',
+                'TwoBedroomEffectiveRentUnit',
+                'ThreeBedroomEffectiveRentUnit',
+                'FourBedroomEffectiveRentUnit']
+
+# Rows per fast_executemany batch when bulk loading. Large batches amortize the round trip
+# without holding excessive parameter buffers in pyodbc.
+BULK_LOAD_CHUNKSIZE = 5000
+
+# Rows loaded to SQL between work ledger checkpoints.
+LEDGER_LOAD_BATCH_SIZE = 5000
+
+# Retry scheduler limits for errored responses: attempts per property, total retries per
+# scheduler run, and the backoff delay bounds in seconds.
+RETRY_MAX_ATTEMPTS = 4
+RETRY_BUDGET = 500
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 30.0
+
+# Login and session cache limits: seconds to wait for the CoStar login to complete, maximum age
+# of cached session cookies, PBKDF2 iterations deriving the cookie cache key from the CoStar
+# password, and seconds to wait for the session validity probe.
+LOGIN_TIMEOUT = 40
+COOKIE_CACHE_MAX_AGE = datetime.timedelta(hours=12)
+COOKIE_CACHE_KDF_ITERATIONS = 200000
+SESSION_PROBE_TIMEOUT = 10
+
+# Prefix of the exported metric names, the description of each metric, and the upper bounds of
+# each histogram's buckets.
+METRIC_PREFIX = 'costar'
+METRIC_HELP = {'requests_total': 'API call responses received, by HTTP status code.',
+               'response_bytes_total': 'Bytes of API call response bodies received.',
+               'connection_errors_total': 'API calls that failed with a connection error or timeout.',
+               'request_latency_seconds': 'Seconds from sending an API call to receiving its response.',
+               'stage_seconds_total': 'Seconds spent in each pipeline stage.',
+               'parsed_records_total': 'Call responses parsed into property records.',
+               'parse_failures_total': 'Call responses that failed to parse before being retried.',
+               'retry_failures_total': 'Failed retries of API calls, by failure category.',
+               'retry_recovered_total': 'Properties whose API call was recovered by a retry.',
+               'dropped_properties_total': 'Properties dropped because their API call could not be recovered.',
+               'db_rows_total': 'Rows appended to the SQL table.',
+               'db_load_seconds_total': 'Seconds spent appending rows to the SQL table.',
+               'db_rows_per_second': 'Rows appended to the SQL table per second of load time.'}
+METRIC_BUCKETS = {'request_latency_seconds': (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)}
+
+# Abbreviations applied to amenity names so the amenities list fits the 250 character SQL column.
+AMENITIES_SHRINK_DICT = {'24 Hour Access': '24Hr Access',
+                         'Air Conditioning': 'A/C',
+                         'Bicycle Storage': 'Bike Storage',
+                         'Refridgerator': 'Fridge',
+                         'Basketball Court': 'Bball Court',
+                         'Storage Space': 'Storage',
+                         'Walking/Biking Trails': 'Walk/Bike Trails',
+                         'Property Manager on Site': 'Onsite PM',
+                         'Wheelchair Accessible (Rooms)': 'Wheelchair Access Rooms',
+                         'Accessible': 'Access',
+                         'Planned Social Activities': 'Social Events',
+                         'Maintenance on site': 'Onsite Maintenance',
+                         'Furnished Units Available': 'Furnished Option',
+                         'Hardwood Floors': 'Hardwood',
+                         'Pet Washing Station': 'Pet Wash Station',
+                         'Laundry Facilities': 'Laundry Facs',
+                         'Tenant Controlled HVAC': 'Controllable HVAC',
+                         'Washer/Dryer': 'W/D'}
+
+# Nullable pandas dtypes of the currency, percentage and count columns, matching the SQL table types.
+NUMERIC_COLUMN_DTYPES = {'OneBedroomAskingRentUnit': 'Int64',
+                         'TwoBedroomAskingRentUnit': 'Int64',
+                         'ThreeBedroomAskingRentUnit': 'Int64',
+                         'FourBedroomAskingRentUnit': 'Int64',
+                         'StudioAskingRentUnit': 'Int64',
+                         'OneBedroomEffectiveRentUnit': 'Int64',
+                         'TwoBedroomEffectiveRentUnit': 'Int64',
+                         'ThreeBedroomEffectiveRentUnit': 'Int64',
+                         'FourBedroomEffectiveRentUnit': 'Int64',
+                         'StudioEffectiveRentUnit': 'Float64',
+                         'OneBedroomConcessionsPercentage': 'Float64',
+                         'TwoBedroomConcessionsPercentage': 'Float64',
+                         'ThreeBedroomConcessionsPercentage': 'Float64',
+                         'FourBedroomConcessionsPercentage': 'Float64',
+                         'StudioConcessionsPercentage': 'Float64',
+                         'OneBedroomAvgSF': 'Int64',
+                         'TwoBedroomAvgSF': 'Int64',
+                         'ThreeBedroomAvgSF': 'Int64',
+                         'FourBedroomAvgSF': 'Int64',
+                         'StudioAvgSF': 'Int64',
+                         'NumberOf1BedroomsUnits': 'Int64',
+                         'NumberOf2BedroomsUnits': 'Int64',
+                         'NumberOf3BedroomsUnits': 'Int64',
+                         'NumberOf4BedroomsUnits': 'Int64',
+                         'NumberOfStudioUnits': 'Int64',
+                         'NumberOfUnits': 'Int64'}
+
+# Output columns of the compiled property DataFrame, in the order they are written to .csv and SQL.
+PROPERTY_COLUMNS = ['CoStarPropertyID',
+                    'PropertyName',
+                    'PropertyAddress',
+                    'OneBedroomAskingRentUnit',
+                    'TwoBedroomAskingRentUnit',
+                    'ThreeBedroomAskingRentUnit',
+                    'FourBedroomAskingRentUnit',
+                    'StudioAskingRentUnit',
+                    'OneBedroomAvgSF',
+                    'TwoBedroomAvgSF',
+                    'ThreeBedroomAvgSF',
+                    'FourBedroomAvgSF',
+                    'StudioAvgSF',
+                    'OneBedroomEffectiveRentUnit',
+                    'TwoBedroomEffectiveRentUnit',
+                    'ThreeBedroomEffectiveRentUnit',
+                    'FourBedroomEffectiveRentUnit',
+                    'StudioEffectiveRentUnit',
+                    'NumberOf1BedroomsUnits',
+                    'NumberOf2BedroomsUnits',
+                    'NumberOf3BedroomsUnits',
+                    'NumberOf4BedroomsUnits',
+                    'NumberOfStudioUnits',
+                    'NumberOfUnits',
+                    'OneBedroomConcessionsPercentage',
+                    'TwoBedroomConcessionsPercentage',
+                    'ThreeBedroomConcessionsPercentage',
+                    'FourBedroomConcessionsPercentage',
+                    'StudioConcessionsPercentage',
+                    'Latitude',
+                    'Longitude',
+                    'PropertyManagerName',
+                    'TrueOwnerName',
+                    'BuildingClass',
+                    'StarRating',
+                    'Amenities',
+                    'YearBuilt',
+                    'ParkingSpaces',
+                    'BuildingStories',
+                    'PercentLeased',
+                    'City',
+                    'State',
+                    'Zip']
+
+
+class RunMetrics:
+    """
+    Stage spans, counters, gauges and histograms collected over a pipeline run, exported as
+    JSON lines or as a Prometheus textfile. Safe to update from the pipeline stage threads.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.reset()
+
+    def reset(self):
+        """Discard everything collected so far and start a new run."""
+        with self.lock:
+            self.run_started = datetime.datetime.now()
+            self.spans = []
+            self.counters = collections.defaultdict(float)
+            self.gauges = {}
+            self.histograms = {}
+
+    @contextlib.contextmanager
+    def span(self, stage):
+        """
+        Time the enclosed block as a stage of the run, recording its parent stage and whether
+        it raised.
+
+        Parameters
+        ----------
+        stage : str
+            Name of the stage, e.g. 'fetch', 'parse' or 'load'.
+
+        """
+        stack = self.local.__dict__.setdefault('stack', [])
+        span = {'type': 'span', 'stage': stage, 'parent': stack[-1] if stack else None,
+                'start': datetime.datetime.now().isoformat(), 'status': 'error'}
+        stack.append(stage)
+        start = time.perf_counter()
+        try:
+            yield span
+            span['status'] = 'ok'
+        finally:
+            span['duration_seconds'] = time.perf_counter() - start
+            stack.pop()
+            with self.lock:
+                self.spans.append(span)
+            self.increment('stage_seconds_total', span['duration_seconds'], stage=stage)
+
+    def increment(self, name, value=1, **labels):
+        """Add value to the counter name with the given labels."""
+        with self.lock:
+            self.counters[name, tuple(sorted(labels.items()))] += value
+
+    def counter_value(self, name, **labels):
+        """Return the value of the counter name with the given labels."""
+        with self.lock:
+            return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def set_gauge(self, name, value, **labels):
+        """Set the gauge name with the given labels to value."""
+        with self.lock:
+            self.gauges[name, tuple(sorted(labels.items()))] = value
+
+    def observe(self, name, value, **labels):
+        """Add value to the histogram name with the given labels, bucketed by METRIC_BUCKETS."""
+        key = name, tuple(sorted(labels.items()))
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = [[0] * len(METRIC_BUCKETS[name]), 0.0, 0]
+            histogram = self.histograms[key]
+            for i, bound in enumerate(METRIC_BUCKETS[name]):
+                if value <= bound:
+                    histogram[0][i] += 1
+                    break
+            histogram[1] += value
+            histogram[2] += 1
+
+    def record_response(self, status, size, latency):
+        """
+        Count an API call response by status and size, and record its latency.
+
+        Parameters
+        ----------
+        status : int
+            HTTP status code of the response.
+        size : int
+            Size of the response body in bytes.
+        latency : float
+            Seconds from sending the request to receiving the response.
+
+        """
+        self.increment('requests_total', status=str(status))
+        self.increment('response_bytes_total', size)
+        self.observe('request_latency_seconds', latency)
+
+    def series(self):
+        """
+        Snapshot every metric series of the run.
+
+        Returns
+        -------
+        series : list of dict
+            One dictionary per series with its type, name, labels and value. Histograms
+            carry their cumulative bucket counts, sum and count instead of a value.
+
+        """
+        with self.lock:
+            series = [{'type': 'counter', 'name': name, 'labels': dict(labels), 'value': value}
+                      for (name, labels), value in sorted(self.counters.items())]
+            series += [{'type': 'gauge', 'name': name, 'labels': dict(labels), 'value': value}
+                       for (name, labels), value in sorted(self.gauges.items())]
+            for (name, labels), (bucket_counts, total, count) in sorted(self.histograms.items()):
+                cumulative = list(itertools.accumulate(bucket_counts))
+                series.append({'type': 'histogram', 'name': name, 'labels': dict(labels),
+                               'buckets': dict(zip(map(str, METRIC_BUCKETS[name]), cumulative)),
+                               'sum': total, 'count': count})
+        return series
+
+    def write_json_lines(self, path):
+        """
+        Append the spans and metric series of the run to a JSON lines file, one object per line
+        tagged with the run start time.
+
+        Parameters
+        ----------
+        path : str
+            Full file path of the JSON lines file.
+
+        Returns
+        -------
+        None.
+
+        """
+        run = self.run_started.isoformat()
+        with self.lock:
+            spans = list(self.spans)
+        with open(path, 'a') as f:
+            for entry in spans + self.series():
+                f.write(json.dumps({'run': run, **entry}) + '\n')
+
+    def write_prometheus_textfile(self, path):
+        """
+        Write the metric series of the run in the Prometheus text exposition format, for the
+        node_exporter textfile collector. The file is replaced atomically so the collector
+        never reads a partial file.
+
+        Parameters
+        ----------
+        path : str
+            Full file path of the .prom file.
+
+        Returns
+        -------
+        None.
+
+        """
+        lines = []
+        described = set()
+        for entry in self.series():
+            name = f'{METRIC_PREFIX}_{entry["name"]}'
+            if name not in described:
+                described.add(name)
+                lines.append(f'# HELP {name} {METRIC_HELP.get(entry["name"], entry["name"])}')
+                lines.append(f'# TYPE {name} {entry["type"]}')
+            if entry['type'] != 'histogram':
+                lines.append(f'{name}{format_prometheus_labels(entry["labels"])} {float(entry["value"])!r}')
+                continue
+            for bound, count in list(entry['buckets'].items()) + [('+Inf', entry['count'])]:
+                lines.append(f'{name}_bucket{format_prometheus_labels({**entry["labels"], "le": bound})} {count}')
+            lines.append(f'{name}_sum{format_prometheus_labels(entry["labels"])} {float(entry["sum"])!r}')
+            lines.append(f'{name}_count{format_prometheus_labels(entry["labels"])} {entry["count"]}')
+        lines.append(f'# HELP {METRIC_PREFIX}_run_start_timestamp_seconds Unix time the run started.')
+        lines.append(f'# TYPE {METRIC_PREFIX}_run_start_timestamp_seconds gauge')
+        lines.append(f'{METRIC_PREFIX}_run_start_timestamp_seconds {self.run_started.timestamp():.0f}')
+        with open(path + '.tmp', 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(path + '.tmp', path)
+
+
+def format_prometheus_labels(labels):
+    """
+    Format a dictionary of labels as a Prometheus label set.
+
+    Parameters
+    ----------
+    labels : dict
+        Dictionary of label name: value.
+
+    Returns
+    -------
+    label_set : str
+        Label set such as '{status="200"}', or an empty string when there are no labels.
+
+    """
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+def traced(stage):
+    """
+    Decorator recording each call of the decorated function as a run_metrics span.
+
+    Parameters
+    ----------
+    stage : str
+        Name of the stage the function runs.
+
+    Returns
+    -------
+    decorator : function
+        Decorator wrapping a function in run_metrics.span(stage).
+
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with run_metrics.span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# Metrics of the current run, updated by each stage of the pipeline.
+run_metrics = RunMetrics()
 
-load_dotenv('.env')
 
 def launch_webdriver():
     """
@@ -35,25 +596,36 @@ def launch_webdriver():
 
     Options set webdriver to maximized window at start.
 
+    The chromedriver at the CHROMEDRIVER_PATH environment variable is used when set, skipping
+    the driver lookup of ChromeDriverManager.
+
     Returns
     -------
     driver : webdriver
         Initialized webdriver for retrieving and manipulating web pages.
     """
+    from selenium import webdriver
+    from selenium.webdriver.chrome.service import Service as ChromeService
+    from selenium.webdriver.chrome.options import Options as ChromeOptions
     options = ChromeOptions()
     options.add_argument("--log-level=3")
     options.add_argument("start-maximized")
     options.add_experimental_option('excludeSwitches', ['load-extension', 'enable-automation', 'enable-logging'])
     #options.add_argument('--user-data-dir=//aimco.com/data/Departments/Property Ops/Decision Support/CoStarPropertyExport/chromedriver_profile/')
     #options.headless = True
-    s=ChromeService(ChromeDriverManager().install())
+    driver_path = os.getenv('CHROMEDRIVER_PATH')
+    if not driver_path or not os.path.exists(driver_path):
+        from webdriver_manager.chrome import ChromeDriverManager
+        driver_path = ChromeDriverManager().install()
+    s=ChromeService(driver_path)
     driver = webdriver.Chrome(service=s, options=options)
     return driver
 
 
 def login_to_costar(driver, username_string, password_string):
     """
-    Log in to the CoStar website with the provided webdriver.
+    Log in to the CoStar website with the provided webdriver, returning once the CoStar home
+    page has loaded or LOGIN_TIMEOUT seconds have passed.
 
     Parameters
     ----------
@@ -66,11 +638,17 @@ def login_to_costar(driver, username_string, password_string):
 
     Returns
     -------
-    None.
+    logged_in : bool
+        True if the home page loaded, False if LOGIN_TIMEOUT passed without it loading.
 
     """
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.common.action_chains import ActionChains
+    from selenium.common.exceptions import TimeoutException
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
     driver.get('https://gateway.costar.com/login')
-    username = driver.find_element(By.ID, "username")
+    username = WebDriverWait(driver, LOGIN_TIMEOUT).until(EC.presence_of_element_located((By.ID, "username")))
     password = driver.find_element(By.ID, "password")
     login_button = driver.find_element(By.XPATH,
                                        '/html/body/div/div/div/div[1]/div[1]/form/div/div/div[2]/div[4]/div[2]/div/button')
@@ -85,13 +663,13 @@ def login_to_costar(driver, username_string, password_string):
     actions.perform()
     try:
         WebDriverWait(driver,
-                      20).until(EC.
-                                element_to_be_clickable((By.XPATH,
-                                                         '//*[@id="cs-gateway-home-page"]/div[2]/div[1]/div/div/div[2]/div/div[1]/input')))
+                      LOGIN_TIMEOUT).until(EC.
+                                           element_to_be_clickable((By.XPATH,
+                                                                    '//*[@id="cs-gateway-home-page"]/div[2]/div[1]/div/div/div[2]/div/div[1]/input')))
     except TimeoutException:
-        time.sleep(20)
-    time.sleep(1)
-    return
+        print(f'CoStar home page did not load within {LOGIN_TIMEOUT} seconds of logging in.')
+        return False
+    return True
 
 
 def load_properties(filepath=None):
@@ -120,728 +698,3096 @@ def load_properties(filepath=None):
     return properties_df
 
 
-def get_costar_cookies(username_string, password_string):
+def get_property_shard(prop_id, shard_count):
     """
-    Launch webdriver, login to costar account, and get a dictionary of cookies
-    assigned to the webdriver.
+    Assign a property to a shard by a hash of its CoStar Property ID. The assignment only
+    depends on the ID and the shard count, so it is the same on every host and in every run.
+
+    Parameters
+    ----------
+    prop_id : str or int
+        The unique CoStar Property ID for a single property.
+    shard_count : int
+        Number of shards the properties are partitioned into.
 
     Returns
     -------
-    cookies_dict : dict
-        Dictionary of the name: value of each cookie assigned to the webdriver post-login.
+    shard_index : int
+        Index of the property's shard, from 0 to shard_count - 1.
 
     """
-    driver = launch_webdriver()
-    login_to_costar(driver, username_string, password_string)
-    time.sleep(5)
-    cookies_list = driver.get_cookies()
-
-    cookies_dict = {}
-    for cookie in cookies_list:
-        cookies_dict[cookie['name']] = cookie['value']
-    return cookies_dict
+    digest = hashlib.blake2b(str(prop_id).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % shard_count
 
 
-def get_payload(propId):
+def select_shard(prop_ids, shard_index, shard_count):
     """
-    Generate and encode the payload for an XHR request for a single property from CoStar.
+    Select the properties of a single shard.
 
     Parameters
     ----------
-    propId : int
-        The unique CoStar Property ID for a single property.
+    prop_ids : iterable of str
+        The unique CoStar Property IDs of all properties.
+    shard_index : int
+        Index of the shard to select, from 0 to shard_count - 1.
+    shard_count : int
+        Number of shards the properties are partitioned into.
 
     Returns
     -------
-    payload : str
-        The JSON-encoded string of the payload for an XHR request for a single property.
+    list of str
+        The CoStar Property IDs assigned to the shard, in their original order.
 
     """
-    propId = int(propId)
-
-    # Amenities
-    payload_amenities = {"operationName": "Amenities_Info",
-                         "query": "query Amenities_Info($propertyId: Int!) {\n  propertyDetail {\n    amenities_Info(propertyId: $propertyId) {\n      ...amenitiesICFields\n      __typename\n    }\n    __typename\n  }\n}\n\nfragment amenitiesICFields on Amenities_Info {\n  propertyType\n  amenities\n  unitAmenities\n  roomAmenities\n  __typename\n}\n",
-                         "variables": {"propertyId": propId}}
-
-    # UnitMix
-    payload_unitmix = {"operationName": "UnitMix_Detail",
-                       "variables": {"propertyId": propId,
-                                     "showOnlyActual": False},
-                       "query": "fragment unitMixDetail on UnitMixDetailItem {\n  totals\n  bath\n  availableUnits\n  availablePercent\n  askingRentPerArea\n  askingRentPerUnit\n  averageArea\n  effectiveRentPerUnit\n  effectiveRentPerArea\n  bedroom\n  concessions\n  unitMixUnits\n  unitMixPercentage\n  isRentModeled\n  isEffectiveRentModeled\n  isAvailableModeled\n  unitMixBeds\n  unitMixBedsPercent\n  averageAskingRentPerOccupantBed\n  averageEffectiveRentPerOccupantBed\n  __typename\n}\n\nquery UnitMix_Detail($propertyId: Int!, $showOnlyActual: Boolean) {\n  propertyDetail {\n    unit_mix_detail(propertyId: $propertyId, showOnlyActual: $showOnlyActual) {\n      detailItems {\n        ...unitMixDetail\n        __typename\n      }\n      summaryItems {\n        ...unitMixDetail\n        __typename\n      }\n      updatedDate\n      __typename\n    }\n    __typename\n  }\n}\n"}
-
-    # Owners
-    payload_about_owners = {"operationName": "About_Info",
-                            "query": "query About_Info($propertyId: Int!) {\n  propertyDetail {\n    propertyContactDetails_info(propertyId: $propertyId) {\n      ...aboutICFields\n      __typename\n    }\n    __typename\n  }\n}\n\nfragment aboutICFields on PropertyContactDetails_Info {\n  trueOwner {\n    ...companyDetailFields\n    __typename\n  }\n  architect {\n    ...companyDetailFields\n    __typename\n  }\n  __typename\n}\n\nfragment companyDetailFields on PropertyContactDetails_Company {\n  companyId\n  name\n  address\n  suite\n  website {\n    uri\n    hostName\n    __typename\n  }\n  phoneNumbers\n  logoImage\n  availableInProfessionalDirectory\n  dateAssumedRole\n  bio\n  __typename\n}\n",
-                            "variables": {"propertyId": propId}}
-
-    # Location
-    payload_about_location = {"operationName": "Location_Info",
-                              "query": "query Location_Info($propertyId: Int!) {\n  propertyDetail {\n    location_Info(propertyId: $propertyId) {\n      ...locationICFields\n      __typename\n    }\n    __typename\n  }\n}\n\nfragment locationICFields on Location_Info {\n  secondaryDeliveryAddress\n  postalCode\n  submarket\n  cluster\n  locationType\n  market\n  county\n  subDivision\n  regionName\n  cbsa\n  dma\n  country\n  __typename\n}\n",
-                              "variables": {"propertyId": propId}}
-
-    # Comps
-    payload_comps = {"operationName": "getCompsContext",
-                     "query": "query getCompsContext($propertyId: Int!) {\n  propertyDetail {\n    get_comps_context(propertyId: $propertyId) {\n      compsContext {\n        Source\n        Survey {\n          DisplayName\n          SurveyId\n          SurveyName\n          __typename\n        }\n        CompanyCompSetCount\n        MapShape {\n          Radii {\n            Center {\n              coordinates\n              type\n              __typename\n            }\n            City\n            Kml\n            LookupText\n            SubdivisionCode\n            Radius {\n              Code\n              Value\n              __typename\n            }\n            SubdivisionCode\n            __typename\n          }\n          Corridors {\n            Corridor {\n              coordinates\n              __typename\n            }\n            __typename\n          }\n          __typename\n        }\n        CompEntities {\n          EntityId\n          PropertyIndex\n          __typename\n        }\n        __typename\n      }\n      isCollaborationSourceViable\n      detailPageContext {\n        CountryCode\n        Location {\n          Latitude\n          Longitude\n          __typename\n        }\n        PropertyId\n        PropertyTypeDescription\n        PropertyTypeId\n        __typename\n      }\n      __typename\n    }\n    __typename\n  }\n}\n",
-                     "variables": {"propertyId": propId}}
-
-    # Contacts
-    payload_contact_details = {"operationName": "ContactsDetail",
-                               "query": "query ContactsDetail($propertyId: Int!) {\n  propertyDetail {\n    propertyContactDetails_info(propertyId: $propertyId) {\n      ...contactDetailsICFields\n      __typename\n    }\n    propertyDetailHeader(propertyId: $propertyId) {\n      id\n      addressHeader\n      __typename\n    }\n    __typename\n  }\n}\n\nfragment contactDetailsICFields on PropertyContactDetails_Info {\n  coStarResearchContact {\n    ...propertyCompanyFields\n    __typename\n  }\n  primaryLeasingCompany {\n    ...propertyCompanyFields\n    __typename\n  }\n  leasingCompany {\n    ...propertyCompanyFields\n    __typename\n  }\n  subletCompany {\n    ...propertyCompanyFields\n    __typename\n  }\n  salesCompany {\n    ...propertyCompanyFields\n    __typename\n  }\n  recordedOwner {\n    ...propertyCompanyFields\n    __typename\n  }\n  trueOwner {\n    ...propertyCompanyFields\n    __typename\n  }\n  hotelOperator {\n    ...propertyCompanyFields\n    __typename\n  }\n  assetManager {\n    ...propertyCompanyFields\n    __typename\n  }\n  propertyManager {\n    ...propertyCompanyFields\n    __typename\n  }\n  previousRecordedOwner {\n    ...propertyCompanyFields\n    __typename\n  }\n  previousTrueOwner {\n    ...propertyCompanyFields\n    __typename\n  }\n  parentCompany {\n    ...propertyCompanyFields\n    __typename\n  }\n  developer {\n    ...propertyCompanyFields\n    __typename\n  }\n  architect {\n    ...propertyCompanyFields\n    __typename\n  }\n  coWorkingCompany {\n    ...propertyCompanyFields\n    __typename\n  }\n  deliveryAddress\n  emailSubject\n  __typename\n}\n\nfragment propertyContactFields on PropertyContactDetails_Contact {\n  personId\n  title\n  name\n  email\n  phoneNumbers\n  thumbnail\n  availableInProfessionalDirectory\n  withCompanyId\n  withCompanyName\n  withCompanyAddress\n  managerEmailAddress\n  __typename\n}\n\nfragment propertyCompanyFields on PropertyContactDetails_Company {\n  ...companyDetailFields\n  contacts {\n    ...propertyContactFields\n    __typename\n  }\n  __typename\n}\n\nfragment companyDetailFields on PropertyContactDetails_Company {\n  companyId\n  name\n  address\n  suite\n  website {\n    uri\n    hostName\n    __typename\n  }\n  phoneNumbers\n  logoImage\n  availableInProfessionalDirectory\n  dateAssumedRole\n  bio\n  __typename\n}\n",
-                               "variables": {"propertyId": propId}}
-
-    # Property details
-    payload_property_details = {"operationName": "getPropertyInfo",
-                                "query": "query getPropertyInfo($propertyId: Int!, $currencyCode: String) {\n  propertyDetail {\n    property_info(propertyId: $propertyId, currencyCode: $currencyCode) {\n      ad\n      address {\n        buildingName\n        city\n        cityId\n        county\n        deliveryAddress\n        postalCode\n        countryCode\n        regionId\n        regionName\n        state\n        stateId\n        streetDirId\n        streetName\n        streetNum\n        streetNumEnd\n        streetSuffixId\n        streetTypeId\n        __typename\n      }\n      avgAskingRentPerBed\n      bathBedRatio\n      bldgClass\n      buildingAreaTotal\n      buildingAreaUom\n      buildingName\n      buildingNumber\n      buildingRating\n      buildMonth\n      cluster\n      companies {\n        recordedOwners {\n          companyId\n          name\n          originType\n          ownerSuperTypeId\n          ownerTypeId\n          __typename\n        }\n        trueOwners {\n          companyId\n          name\n          originType\n          ownerSuperTypeId\n          ownerTypeId\n          __typename\n        }\n        __typename\n      }\n      constructionStartMonth\n      constructionStartYear\n      constructionStatus\n      currency\n      floorArea\n      forLease {\n        areaTotal\n        areaUom\n        contigArea\n        rentActMax\n        rentActMin\n        rentBasis\n        rentEstMax\n        rentEstMin\n        spaceCount\n        tmi\n        __typename\n      }\n      forSale {\n        buildingAreaUom\n        capRateMax\n        capRateMin\n        company\n        companyId\n        condoOnly\n        contactFirstName\n        contactId\n        contactLastName\n        contactPhone\n        dateOnMarket\n        itemType\n        phoneCountryCode\n        pricePerAcreMax\n        pricePerBuildingAreaMax\n        pricePerBuildingAreaMin\n        pricePerItemMax\n        pricePerItemMin\n        salePrice\n        statusId\n        __typename\n      }\n      industrial {\n        driveInsHeight\n        driveInsWidth\n        hasCranes\n        hasDriveInBay\n        hasHeavyPower\n        hasLoadingDocks\n        hasRail\n        maxColumnDepthFeet\n        maxColumnWidthFeet\n        numOfCranes\n        numOfDriveIns\n        numOfExternalLoadingDocks\n        numOfInternalLoadingDocks\n        numOfLoadingDocks\n        railLine\n        sewer\n        __typename\n      }\n      institutionName\n      isBreeam\n      isLeed\n      isOpportunityZone\n      landAreaTotal\n      landAreaUom\n      landType\n      latitude\n      longitude\n      mapBookName\n      mapPageNum\n      mapXCoordinate\n      mapYCoordinate\n      market\n      maxCeilingHt\n      metro\n      minAreaMeasure\n      minAreaPerLot\n      minCeilingHt\n      multiFamily {\n        affordabilityType\n        apartmentLifestyleType\n        apartmentRentType\n        apartmentStyleType\n        askingRentPerSqFt\n        askingRentPerUnit\n        avgUnitSize\n        concession\n        effRentPerSqFt\n        effRentPerUnit\n        numOfBuildings\n        numOfUnits\n        parkingSpacesPerUnit\n        percent1Bed\n        percent2Bed\n        percent3Bed\n        percent4Bed\n        percentStudio\n        vacancyPercent\n        __typename\n      }\n      numOfBeds\n      numOfParkingSpaces\n      numOfRooms\n      numOfStories\n      parkingRatio\n      percentLeased\n      primaryLeasingInfo {\n        company\n        companyId\n        contactFirstName\n        contactLastName\n        contactPhone\n        phoneCountryCode\n        __typename\n      }\n      primaryPhoto {\n        caption\n        url\n        __typename\n      }\n      propertyGroupName\n      propertySubtype\n      propertyGroupType\n      propertyId\n      propertySubtype\n      propertyType\n      proposedLandUse\n      renovationMonth\n      renovationYear\n      retailLoc\n      singleTenancyState\n      submarket\n      yearBuilt\n      zoning\n      __typename\n    }\n    __typename\n  }\n}\n",
-                                "variables": {"propertyId": propId, "currencyCode": "USD"}}
-
-    payload = [payload_amenities,
-               payload_unitmix,
-               payload_about_owners,
-               payload_about_location,
-               payload_comps,
-               payload_contact_details,
-               payload_property_details]
-
-    payload = json.dumps(payload)
-    return payload
+    return [prop_id for prop_id in prop_ids if get_property_shard(prop_id, shard_count) == shard_index]
 
 
-def post_to_db(sql_connection_string, sql_table_name, last_scrape_df=None):
+def get_shard_snapshot_name(shard_index, shard_count):
     """
-    Upload results from last CoStar web scrape into the SQL Server table specified
-    by the SQL connection string.
+    Build the file name, without extension, of the partial snapshot of a shard. The name does
+    not include the date, so rerunning a failed shard replaces its own partial snapshot.
 
     Parameters
     ----------
-    last_scrape_df : dataframe, optional
-        The dataframe from the last run scrape. The default is None. If a dataframe
-        is not passed in, the method searches for the last saved .csv file in
-        the shared drive.
-    sql_connection_string : str
-        The connection string used by SQL Alchemy to connect to the target table in the
-        SQL Server database into which the data is injected.
-    sql_table_name : str
-        The name of the table into which the data is injected.
+    shard_index : int
+        Index of the shard.
+    shard_count : int
+        Number of shards the properties are partitioned into.
 
     Returns
     -------
-    None.
+    str
+        File name such as 'shard_0003_of_0016_compiled_df'.
 
     """
-    if last_scrape_df is None:
-        files = glob(os.path.abspath("*.csv"))
-        files.sort(key=os.path.getmtime)
-        data_df = pd.read_csv(files[-1])
-    else:
-        data_df = last_scrape_df
+    return f'shard_{shard_index:04d}_of_{shard_count:04d}_compiled_df'
 
-    quoted = urllib.parse.quote_plus(sql_connection_string)
-    engine = create_engine('mssql+pyodbc:///?odbc_connect={}'.format(quoted))
 
-    md = MetaData(bind=engine, schema='dbo')
-    md.reflect(only=[sql_table_name])
-    CoStarPropertyExport_table = md.tables['dbo.' + sql_table_name]
-    statement = (update(CoStarPropertyExport_table).
-                 where(CoStarPropertyExport_table.c.MostRecentFlag==1).
-                 values(MostRecentFlag=0))
-    engine.execute(statement)
+class CookieCache:
+    """
+    Encrypted file holding the cookies of an authenticated CoStar session between runs. The
+    cookies are encrypted with a key derived from the CoStar password, so the file is useless
+    without the credentials in the .env file. Requires the cryptography package.
+    """
 
-    data_df = convert_df_types(data_df)
-    amenities_shrink_dict = {'24 Hour Access': '24Hr Access',
-                             'Air Conditioning': 'A/C',
-                             'Bicycle Storage': 'Bike Storage',
-                             'Refridgerator': 'Fridge',
-                             'Basketball Court': 'Bball Court',
-                             'Storage Space': 'Storage',
-                             'Walking/Biking Trails': 'Walk/Bike Trails',
-                             'Property Manager on Site': 'Onsite PM',
-                             'Wheelchair Accessible (Rooms)': 'Wheelchair Access Rooms',
-                             'Accessible': 'Access',
-                             'Planned Social Activities': 'Social Events',
-                             'Maintenance on site': 'Onsite Maintenance',
-                             'Furnished Units Available': 'Furnished Option',
-                             'Hardwood Floors': 'Hardwood',
-                             'Pet Washing Station': 'Pet Wash Station',
-                             'Laundry Facilities': 'Laundry Facs',
-                             'Tenant Controlled HVAC': 'Controllable HVAC',
-                             'Washer/Dryer': 'W/D'}
-
-    # Replace long text elements in amenities_shrink_dict with abbreviated text versions
-    for index, amenity_list in enumerate(data_df['Amenities']):
-        temp_list_record = amenity_list
-        if pd.isnull(temp_list_record):
-            temp_list_record = np.nan
-        else:
-            for key, val in amenities_shrink_dict.items():
-                temp_list_record = temp_list_record.replace(key, val)
-        data_df.at[index, 'Amenities'] = temp_list_record
-
-    # shorten amenities list string to less than 250 characters (max set by db?)
-    for index, amenities in enumerate(data_df['Amenities']):
-        if not pd.isnull(amenities):
-            if len(amenities) > 250:
-                temp_index = amenities[:250].rfind(";")
-            else:
-                temp_index = len(amenities)
-            data_df.at[index, 'Amenities'] = amenities[:temp_index]
+    def __init__(self, cache_path, password_string, max_age=COOKIE_CACHE_MAX_AGE):
+        try:
+            import cryptography
+        except ImportError as error:
+            raise ImportError('The session cookie cache requires the cryptography package; install it with '
+                              '"pip install cryptography" or run without --cookie-cache.') from error
+        self.cache_path = cache_path
+        self.password_string = password_string
+        self.max_age = max_age
 
-    data_df = data_df.assign(CollectedDateStamp=datetime.datetime.today())
-    data_df = data_df.assign(MostRecentFlag=1)
+    def get_fernet(self, salt):
+        """Return the Fernet cipher keyed by the CoStar password and the cache file salt."""
+        from cryptography.fernet import Fernet
+        key = hashlib.pbkdf2_hmac('sha256', self.password_string.encode(), salt, COOKIE_CACHE_KDF_ITERATIONS)
+        return Fernet(base64.urlsafe_b64encode(key))
 
-    print('Beginning upload to SQL Server database.')
-    start = datetime.datetime.now()
-    data_df.to_sql(name=sql_table_name,
-                   schema="dbo",
-                   con=engine,
-                   if_exists='append',
-                   index=False,
-                   chunksize=100,
-                   dtype={'CoStarPropertyID': BIGINT,
-                          'PropertyName': VARCHAR(250, collation="SQL_Latin1_General_CP1_CI_AS"),
-                          'PropertyAddress': VARCHAR(250, collation="SQL_Latin1_General_CP1_CI_AS"),
-                          'OneBedroomAskingRentUnit': INTEGER,
-                          'TwoBedroomAskingRentUnit': INTEGER,
-                          'ThreeBedroomAskingRentUnit': INTEGER,
-                          'FourBedroomAskingRentUnit': INTEGER,
-                          'StudioAskingRentUnit': INTEGER,
-                          'OneBedroomAvgSF': INTEGER,
-                          'TwoBedroomAvgSF': INTEGER,
-                          'ThreeBedroomAvgSF': INTEGER,
-                          'FourBedroomAvgSF': INTEGER,
-                          'StudioAvgSF': INTEGER,
-                          'OneBedroomEffectiveRentUnit': INTEGER,
-                          'TwoBedroomEffectiveRentUnit': INTEGER,
-                          'ThreeBedroomEffectiveRentUnit': INTEGER,
-                          'FourBedroomEffectiveRentUnit': INTEGER,
-                          'StudioEffectiveRentUnit': FLOAT,
-                          'NumberOf1BedroomsUnits': INTEGER,
-                          'NumberOf2BedroomsUnits': INTEGER,
-                          'NumberOf3BedroomsUnits': INTEGER,
-                          'NumberOf4BedroomsUnits': INTEGER,
-                          'NumberOfStudioUnits': INTEGER,
-                          'NumberOfUnits': INTEGER,
-                          'OneBedroomConcessionsPercentage': FLOAT,
-                          'TwoBedroomConcessionsPercentage': FLOAT,
-                          'ThreeBedroomConcessionsPercentage': FLOAT,
-                          'FourBedroomConcessionsPercentage': FLOAT,
-                          'StudioConcessionsPercentage': FLOAT,
-                          'Latitude': FLOAT,
-                          'Longitude': FLOAT,
-                          'OperationalStatus': FLOAT,
-                          'PropertyManagerName': VARCHAR(250, collation="SQL_Latin1_General_CP1_CI_AS"),
-                          'OwnerName': VARCHAR(250, collation="SQL_Latin1_General_CP1_CI_AS"),
-                          'ParentCompany': FLOAT,
-                          'BuildingClass': VARCHAR(250, collation="SQL_Latin1_General_CP1_CI_AS"),
-                          'StarRating': BIGINT,
-                          'Amenities': VARCHAR(250, collation="SQL_Latin1_General_CP1_CI_AS"),
-                          'YearBuilt': FLOAT,
-                          'YearRenovated': FLOAT,
-                          'PercentLeased': FLOAT,
-                          'City': VARCHAR(100, collation="SQL_Latin1_General_CP1_CI_AS"),
-                          'State': VARCHAR(2, collation="SQL_Latin1_General_CP1_CI_AS"),
-                          'Zip': VARCHAR(10, collation="SQL_Latin1_General_CP1_CI_AS"),
-                          'PropertyType': VARCHAR(250, collation="SQL_Latin1_General_CP1_CI_AS"),
-                          'BuildingStatus': VARCHAR(250, collation="SQL_Latin1_General_CP1_CI_AS"),
-                          'ConstructionStatus': VARCHAR(250, collation="SQL_Latin1_General_CP1_CI_AS"),
-                          'TrueOwnerName': VARCHAR(250, collation="SQL_Latin1_General_CP1_CI_AS"),
-                          'ParkingSpaces': BIGINT,
-                          'BuildingStories': BIGINT,
-                          'CollectedDateStamp': DATETIME,
-                          'MostRecentFlag': INTEGER})
+    def load(self):
+        """
+        Read the cached session cookies.
 
-    end = datetime.datetime.now()
-    print(f'Transfer to SQL {sql_table_name} table completed in {end-start}.')
-    return
+        Returns
+        -------
+        cookies_dict : dict or None
+            Dictionary of the name: value of each unexpired cached cookie, or None when there
+            is no cache, it was saved more than max_age ago, it cannot be decrypted with the
+            current password, or every cookie in it has expired.
+
+        """
+        from cryptography.fernet import InvalidToken
+        if not os.path.exists(self.cache_path):
+            return None
+        with open(self.cache_path, 'rb') as f:
+            salt, token = f.read(16), f.read()
+        try:
+            cookies_list = json.loads(self.get_fernet(salt).decrypt(token, ttl=int(self.max_age.total_seconds())))
+        except InvalidToken:
+            return None
+        now = time.time()
+        cookies_dict = {cookie['name']: cookie['value'] for cookie in cookies_list
+                        if cookie.get('expiry') is None or cookie['expiry'] > now}
+        return cookies_dict or None
 
+    def save(self, cookies_list):
+        """
+        Encrypt and save the cookies of a newly authenticated session, replacing the cache file.
 
-def convert_df_types(test_df=None):
+        Parameters
+        ----------
+        cookies_list : list of dict
+            Cookies as returned by the webdriver get_cookies method.
+
+        Returns
+        -------
+        None.
+
+        """
+        salt = os.urandom(16)
+        token = self.get_fernet(salt).encrypt(json.dumps(cookies_list).encode())
+        with open(self.cache_path + '.tmp', 'wb') as f:
+            f.write(salt + token)
+        os.chmod(self.cache_path + '.tmp', 0o600)
+        os.replace(self.cache_path + '.tmp', self.cache_path)
+        return
+
+    def clear(self):
+        """Delete the cache file, e.g. once its session has been rejected by CoStar."""
+        if os.path.exists(self.cache_path):
+            os.remove(self.cache_path)
+        return
+
+
+def probe_session(cookies_dict, prop_id, url=None):
     """
-    Convert the type of the dataframe to match the SQL database before injection.
+    Check whether session cookies are still accepted by the CoStar API by requesting the
+    payload of a single property, so that the request runs the resolvers requiring a login.
 
     Parameters
     ----------
-    test_df : Pandas DataFrame
-        DataFrame containing the data from the most recent CoStar web scrape.
+    cookies_dict : dict
+        Dictionary of the name: value of each session cookie.
+    prop_id : str
+        CoStar Property ID of a property known to exist, e.g. the first of the run.
+    url : str, optional
+        URL of the CoStar API endpoint. The default is None, in which case the COSTAR_DB_URL
+        environment variable is used.
 
     Returns
     -------
-    df : Pandas DataFrame
-        DataFrame containing the data from the most recent CoStar web scrape standardized
-        to match the datatypes of the CoStarPropertyExport SQL table.
+    bool
+        True if the response could be parsed, as judged by classify_response.
 
     """
-    df = test_df.copy()
-    # convert currency to integers
-    for col in ['OneBedroomAskingRentUnit',
-                'TwoBedroomAskingRentUnit',
-                'ThreeBedroomAskingRentUnit',
-                'FourBedroomAskingRentUnit',
-                'StudioAskingRentUnit',
-                'OneBedroomEffectiveRentUnit',
-                'TwoBedroomEffectiveRentUnit',
-                'ThreeBedroomEffectiveRentUnit',
-                'FourBedroomEffectiveRentUnit',
-                'StudioEffectiveRentUnit']:
-        for index, askingrentunit in enumerate(df[col]):
-            if pd.isnull(askingrentunit):
-                temp_val = np.nan
-            elif len(askingrentunit) > 3:
-                temp_val = askingrentunit[1:]
-                temp_val = temp_val.replace(',', '')
-                temp_val = int(temp_val)
-            df.at[index, col] = temp_val
-
-    # convert percentages to floats
-    for col in ['OneBedroomConcessionsPercentage',
-                'TwoBedroomConcessionsPercentage',
-                'ThreeBedroomConcessionsPercentage',
-                'FourBedroomConcessionsPercentage',
-                'StudioConcessionsPercentage']:
-        for index, concessionspercent in enumerate(df[col]):
-            if pd.isnull(concessionspercent):
-                temp_val = np.nan
-            elif len(concessionspercent) > 1:
-                temp_val = concessionspercent[:-1]
-                temp_val = float(temp_val)
-            df.at[index, col] = temp_val
-
-    # convert counts to integers
-    for col in ['OneBedroomAvgSF',
-                'TwoBedroomAvgSF',
-                'ThreeBedroomAvgSF',
-                'FourBedroomAvgSF',
-                'StudioAvgSF',
-                'NumberOf1BedroomsUnits',
-                'NumberOf2BedroomsUnits',
-                'NumberOf3BedroomsUnits',
-                'NumberOf4BedroomsUnits',
-                'NumberOfStudioUnits',
-                'NumberOfUnits']:
-        for index, count_val in enumerate(df[col]):
-            if pd.isnull(count_val):
-                temp_val = np.nan
-            elif len(count_val) > 0:
-                if count_val == '-':
-                    temp_val = np.nan
-                else:
-                    temp_val = count_val.replace(',', '')
-                    temp_val = int(temp_val)
-            df.at[index, col] = temp_val
-
-    return df
+    import requests
+    try:
+        resp = requests.post(url or os.getenv('COSTAR_DB_URL'), data=get_payload_bytes(prop_id),
+                             headers=REQUEST_HEADERS, cookies=cookies_dict, timeout=SESSION_PROBE_TIMEOUT,
+                             allow_redirects=False)
+    except requests.RequestException:
+        return False
+    return classify_response(resp.status_code, resp.text) is None
 
 
-def print_url(r, *args, **kwargs):
+@traced('login')
+def get_costar_cookies(username_string, password_string, cookie_cache_path=None, probe_prop_id=None):
     """
-    Print url of API call response as an assigned hook tagged to each call response.
+    Launch webdriver, login to costar account, and get a dictionary of cookies
+    assigned to the webdriver. When a cookie cache is given, the cached session is
+    reused instead while it is unexpired and passes the validity probe.
 
     Parameters
     ----------
-    r : API response.
-        The response from the CoStar API call.
+    username_string : str
+        String form of CoStar username for accessing the service.
+    password_string : str
+        String form of CoStar password for accessing the service.
+    cookie_cache_path : str, optional
+        Full file path of a CookieCache file the session cookies are read from and saved to.
+        The default is None, in which case the browser logs in on every call.
+    probe_prop_id : str, optional
+        CoStar Property ID requested by the session validity probe. The default is None,
+        in which case cached sessions cannot be checked and the browser logs in.
 
     Returns
     -------
-    None.
+    cookies_dict : dict
+        Dictionary of the name: value of each cookie assigned to the webdriver post-login.
 
     """
-    print(f'Request URL: {r.url}')
+    cookie_cache = None if cookie_cache_path is None else CookieCache(cookie_cache_path, password_string)
+    if cookie_cache is not None and probe_prop_id is not None:
+        cookies_dict = cookie_cache.load()
+        if cookies_dict is not None and probe_session(cookies_dict, probe_prop_id):
+            print('Reusing cached CoStar session.')
+            return cookies_dict
+        cookie_cache.clear()
+
+    driver = launch_webdriver()
+    try:
+        logged_in = login_to_costar(driver, username_string, password_string)
+        cookies_list = driver.get_cookies()
+    finally:
+        driver.quit()
+    # cookies of a login that never reached the home page may not be authenticated
+    if cookie_cache is not None and logged_in:
+        cookie_cache.save(cookies_list)
+
+    cookies_dict = {}
+    for cookie in cookies_list:
+        cookies_dict[cookie['name']] = cookie['value']
+    return cookies_dict
 
 
-def print_status(r, *args, **kwargs):
+def set_payload_query(query='minimal'):
     """
-    Print response status of API call as an assigned hook tagged to each call response.
+    Select the GraphQL queries sent in each request payload.
 
     Parameters
     ----------
-    r : API response.
-        The response from the CoStar API call.
+    query : str, optional
+        'minimal' to request only the fields read by the parser, or 'full' to request
+        every field of the queries used by the CoStar web app. The default is 'minimal'.
 
     Returns
     -------
-    None.
+    query : str
+        Name of the query selection in use.
 
     """
-    print(f'Response Status Code: {r.status_code}')
+    global payload_full_query
+    if query not in ('minimal', 'full'):
+        raise ValueError(f"query must be 'minimal' or 'full', not {query!r}")
+    payload_full_query = query == 'full'
+    # exported so worker processes reissuing calls during the parse stage send the same queries
+    os.environ['COSTAR_PAYLOAD_QUERY'] = query
+    return query
 
 
-def reissue_call_and_read_response_into_df(df, file, cookies_dict):
-    """
-    Create single XHR call, send, and save response overwriting last
-    response. Called when prior response errored/is empty.
+set_payload_query(os.getenv('COSTAR_PAYLOAD_QUERY', 'minimal'))
+
+
+def load_environment(env_path='.env', require_dotenv=True):
+    """
+    Load the credentials and settings in the .env file into the environment, and apply the
+    module settings read from it.
+
+    Parameters
+    ----------
+    env_path : str, optional
+        Path of the .env file. The default is '.env'.
+    require_dotenv : bool, optional
+        Boolean indicator of whether python-dotenv must be installed. When False and it is
+        not, the .env file is skipped and settings are read from the process environment
+        only, so stages that never log in run without it. The default is True.
+
+    Returns
+    -------
+    None.
+
+    """
+    try:
+        from dotenv import load_dotenv
+    except ImportError:
+        if require_dotenv:
+            raise
+        print('python-dotenv is not installed; reading settings from the environment only.')
+    else:
+        load_dotenv(env_path)
+    set_json_backend(os.getenv('COSTAR_JSON_BACKEND', 'auto'))
+    set_payload_query(os.getenv('COSTAR_PAYLOAD_QUERY', 'minimal'))
+    return
+
+
+def build_field_selection(columns=None):
+    """
+    Merge the response fields the given columns are read from into a field tree per operation.
+
+    Parameters
+    ----------
+    columns : list of str, optional
+        Names of the extracted columns. The default is None, in which case every column
+        in COLUMN_EXTRACTION_SPEC is included.
+
+    Returns
+    -------
+    field_selection : dict
+        Dictionary of operation name: nested dictionary of field name: sub-field tree, with
+        an entry for every operation in PAYLOAD_OPERATIONS.
+
+    """
+    if columns is None:
+        columns = list(COLUMN_EXTRACTION_SPEC)
+    field_selection = {operation: {} for operation in PAYLOAD_OPERATIONS}
+    for column in columns:
+        operation, field_paths = COLUMN_EXTRACTION_SPEC[column][:2]
+        if isinstance(field_paths, str):
+            field_paths = (field_paths,)
+        for field_path in field_paths:
+            table_path, key_field, _, field_steps = parse_field_path(field_path)
+            query_paths = [field_steps]
+            if table_path is not None:
+                query_paths = [table_path + (key_field,), table_path + field_steps]
+            for query_path in query_paths:
+                field_tree = field_selection[operation]
+                for field in query_path:
+                    # list indexes select items of the response, not fields of the query
+                    if isinstance(field, str):
+                        field_tree = field_tree.setdefault(field, {})
+    return field_selection
+
+
+def build_minimal_query(operation_name, field_tree):
+    """
+    Generate the GraphQL query of a payload operation selecting only the fields in field_tree.
+
+    Parameters
+    ----------
+    operation_name : str
+        Name of the payload operation, a key of PAYLOAD_OPERATION_ROOTS.
+    field_tree : dict
+        Nested dictionary of field name: sub-field tree below the operation's root field,
+        as built by build_field_selection. An empty tree selects only __typename, keeping
+        the operation's position in the response.
+
+    Returns
+    -------
+    query : str
+        GraphQL query text.
+
+    """
+    def render_fields(tree, depth):
+        lines = []
+        for field, sub_tree in tree.items():
+            if sub_tree:
+                lines.append('  '*depth + field + ' {')
+                lines.extend(render_fields(sub_tree, depth+1))
+                lines.append('  '*depth + '}')
+            else:
+                lines.append('  '*depth + field)
+        return lines
+
+    root_field, variable_definitions, root_arguments = PAYLOAD_OPERATION_ROOTS[operation_name]
+    selection = render_fields(field_tree, 3) if field_tree else ['      __typename']
+    lines = ([f'query {operation_name}({variable_definitions}) {{',
+              '  propertyDetail {',
+              f'    {root_field}({root_arguments}) {{']
+             + selection
+             + ['    }', '  }', '}', ''])
+    return '\n'.join(lines)
+
+
+def get_payload(propId, full_query=None):
+    """
+    Generate and encode the payload for an XHR request for a single property from CoStar.
+
+    Parameters
+    ----------
+    propId : int
+        The unique CoStar Property ID for a single property.
+    full_query : bool, optional
+        Boolean indicator of whether to request every field of the CoStar web app queries
+        rather than only the fields read by the parser. The default is None, in which case
+        the selection made with set_payload_query is used.
+
+    Returns
+    -------
+    payload : str
+        The JSON-encoded string of the payload for an XHR request for a single property.
+
+    """
+    if full_query is None:
+        full_query = payload_full_query
+    payload = json.dumps(build_payload_operations(propId, full_query))
+    return payload
+
+
+@functools.lru_cache(maxsize=None)
+def compile_payload_template(operations=None, full_query=False):
+    """
+    Serialize the payload once with a placeholder property ID and split it into the
+    static byte fragments surrounding each propertyId value.
+
+    Parameters
+    ----------
+    operations : tuple of str, optional
+        Operation names to include in the payload, in PAYLOAD_OPERATIONS order. The default
+        is None, in which case all operations are included.
+    full_query : bool, optional
+        Boolean indicator of whether to request every field of the CoStar web app queries.
+        The default is False.
+
+    Returns
+    -------
+    payload_fragments : tuple of bytes
+        Encoded payload fragments to be joined by the encoded property ID.
+
+    """
+    placeholder = 900000000000000001
+    payload_operations = build_payload_operations(placeholder, full_query)
+    if operations is not None:
+        payload_operations = [operation for operation in payload_operations if operation['operationName'] in operations]
+    payload = json.dumps(payload_operations).encode('utf-8')
+    payload_fragments = tuple(payload.split(str(placeholder).encode('ascii')))
+    return payload_fragments
+
+
+def get_payload_bytes(propId, operations=None, full_query=None):
+    """
+    Generate the encoded payload for an XHR request for a single property from the
+    precompiled payload template. Equivalent to get_payload(propId).encode('utf-8').
+
+    Parameters
+    ----------
+    propId : int
+        The unique CoStar Property ID for a single property.
+    operations : tuple of str, optional
+        Operation names to include in the payload, in PAYLOAD_OPERATIONS order. The default
+        is None, in which case all operations are included.
+    full_query : bool, optional
+        Boolean indicator of whether to request every field of the CoStar web app queries.
+        The default is None, in which case the selection made with set_payload_query is used.
+
+    Returns
+    -------
+    payload : bytes
+        The JSON-encoded payload for an XHR request for a single property, ready to send.
+
+    """
+    if full_query is None:
+        full_query = payload_full_query
+    return str(int(propId)).encode('ascii').join(compile_payload_template(operations, full_query))
+
+
+def build_payload_operations(propId, full_query=False):
+    """
+    Build the list of GraphQL operations requested for a single property from CoStar.
+
+    Parameters
+    ----------
+    propId : int
+        The unique CoStar Property ID for a single property.
+    full_query : bool, optional
+        Boolean indicator of whether to keep every field of the CoStar web app queries.
+        The default is False, in which case each query is replaced by one selecting only
+        the fields in COLUMN_EXTRACTION_SPEC.
+
+    Returns
+    -------
+    payload : list of dict
+        The GraphQL operations of the payload for an XHR request for a single property.
+
+    """
+    propId = int(propId)
+
+    # Amenities
+    payload_amenities = {"operationName": "Amenities_Info",
+                         "query": "query Amenities_Info($propertyId: Int!) {\n  propertyDetail {\n    amenities_Info(propertyId: $propertyId) {\n      ...amenitiesICFields\n      __typename\n    }\n    __typename\n  }\n}\n\nfragment amenitiesICFields on Amenities_Info {\n  propertyType\n  amenities\n  unitAmenities\n  roomAmenities\n  __typename\n}\n",
+                         "variables": {"propertyId": propId}}
+
+    # UnitMix
+    payload_unitmix = {"operationName": "UnitMix_Detail",
+                       "variables": {"propertyId": propId,
+                                     "showOnlyActual": False},
+                       "query": "fragment unitMixDetail on UnitMixDetailItem {\n  totals\n  bath\n  availableUnits\n  availablePercent\n  askingRentPerArea\n  askingRentPerUnit\n  averageArea\n  effectiveRentPerUnit\n  effectiveRentPerArea\n  bedroom\n  concessions\n  unitMixUnits\n  unitMixPercentage\n  isRentModeled\n  isEffectiveRentModeled\n  isAvailableModeled\n  unitMixBeds\n  unitMixBedsPercent\n  averageAskingRentPerOccupantBed\n  averageEffectiveRentPerOccupantBed\n  __typename\n}\n\nquery UnitMix_Detail($propertyId: Int!, $showOnlyActual: Boolean) {\n  propertyDetail {\n    unit_mix_detail(propertyId: $propertyId, showOnlyActual: $showOnlyActual) {\n      detailItems {\n        ...unitMixDetail\n        __typename\n      }\n      summaryItems {\n        ...unitMixDetail\n        __typename\n      }\n      updatedDate\n      __typename\n    }\n    __typename\n  }\n}\n"}
+
+    # Owners
+    payload_about_owners = {"operationName": "About_Info",
+                            "query": "query About_Info($propertyId: Int!) {\n  propertyDetail {\n    propertyContactDetails_info(propertyId: $propertyId) {\n      ...aboutICFields\n      __typename\n    }\n    __typename\n  }\n}\n\nfragment aboutICFields on PropertyContactDetails_Info {\n  trueOwner {\n    ...companyDetailFields\n    __typename\n  }\n  architect {\n    ...companyDetailFields\n    __typename\n  }\n  __typename\n}\n\nfragment companyDetailFields on PropertyContactDetails_Company {\n  companyId\n  name\n  address\n  suite\n  website {\n    uri\n    hostName\n    __typename\n  }\n  phoneNumbers\n  logoImage\n  availableInProfessionalDirectory\n  dateAssumedRole\n  bio\n  __typename\n}\n",
+                            "variables": {"propertyId": propId}}
+
+    # Location
+    payload_about_location = {"operationName": "Location_Info",
+                              "query": "query Location_Info($propertyId: Int!) {\n  propertyDetail {\n    location_Info(propertyId: $propertyId) {\n      ...locationICFields\n      __typename\n    }\n    __typename\n  }\n}\n\nfragment locationICFields on Location_Info {\n  secondaryDeliveryAddress\n  postalCode\n  submarket\n  cluster\n  locationType\n  market\n  county\n  subDivision\n  regionName\n  cbsa\n  dma\n  country\n  __typename\n}\n",
+                              "variables": {"propertyId": propId}}
+
+    # Comps
+    payload_comps = {"operationName": "getCompsContext",
+                     "query": "query getCompsContext($propertyId: Int!) {\n  propertyDetail {\n    get_comps_context(propertyId: $propertyId) {\n      compsContext {\n        Source\n        Survey {\n          DisplayName\n          SurveyId\n          SurveyName\n          __typename\n        }\n        CompanyCompSetCount\n        MapShape {\n          Radii {\n            Center {\n              coordinates\n              type\n              __typename\n            }\n            City\n            Kml\n            LookupText\n            SubdivisionCode\n            Radius {\n              Code\n              Value\n              __typename\n            }\n            SubdivisionCode\n            __typename\n          }\n          Corridors {\n            Corridor {\n              coordinates\n              __typename\n            }\n            __typename\n          }\n          __typename\n        }\n        CompEntities {\n          EntityId\n          PropertyIndex\n          __typename\n        }\n        __typename\n      }\n      isCollaborationSourceViable\n      detailPageContext {\n        CountryCode\n        Location {\n          Latitude\n          Longitude\n          __typename\n        }\n        PropertyId\n        PropertyTypeDescription\n        PropertyTypeId\n        __typename\n      }\n      __typename\n    }\n    __typename\n  }\n}\n",
+                     "variables": {"propertyId": propId}}
+
+    # Contacts
+    payload_contact_details = {"operationName": "ContactsDetail",
+                               "query": "query ContactsDetail($propertyId: Int!) {\n  propertyDetail {\n    propertyContactDetails_info(propertyId: $propertyId) {\n      ...contactDetailsICFields\n      __typename\n    }\n    propertyDetailHeader(propertyId: $propertyId) {\n      id\n      addressHeader\n      __typename\n    }\n    __typename\n  }\n}\n\nfragment contactDetailsICFields on PropertyContactDetails_Info {\n  coStarResearchContact {\n    ...propertyCompanyFields\n    __typename\n  }\n  primaryLeasingCompany {\n    ...propertyCompanyFields\n    __typename\n  }\n  leasingCompany {\n    ...propertyCompanyFields\n    __typename\n  }\n  subletCompany {\n    ...propertyCompanyFields\n    __typename\n  }\n  salesCompany {\n    ...propertyCompanyFields\n    __typename\n  }\n  recordedOwner {\n    ...propertyCompanyFields\n    __typename\n  }\n  trueOwner {\n    ...propertyCompanyFields\n    __typename\n  }\n  hotelOperator {\n    ...propertyCompanyFields\n    __typename\n  }\n  assetManager {\n    ...propertyCompanyFields\n    __typename\n  }\n  propertyManager {\n    ...propertyCompanyFields\n    __typename\n  }\n  previousRecordedOwner {\n    ...propertyCompanyFields\n    __typename\n  }\n  previousTrueOwner {\n    ...propertyCompanyFields\n    __typename\n  }\n  parentCompany {\n    ...propertyCompanyFields\n    __typename\n  }\n  developer {\n    ...propertyCompanyFields\n    __typename\n  }\n  architect {\n    ...propertyCompanyFields\n    __typename\n  }\n  coWorkingCompany {\n    ...propertyCompanyFields\n    __typename\n  }\n  deliveryAddress\n  emailSubject\n  __typename\n}\n\nfragment propertyContactFields on PropertyContactDetails_Contact {\n  personId\n  title\n  name\n  email\n  phoneNumbers\n  thumbnail\n  availableInProfessionalDirectory\n  withCompanyId\n  withCompanyName\n  withCompanyAddress\n  managerEmailAddress\n  __typename\n}\n\nfragment propertyCompanyFields on PropertyContactDetails_Company {\n  ...companyDetailFields\n  contacts {\n    ...propertyContactFields\n    __typename\n  }\n  __typename\n}\n\nfragment companyDetailFields on PropertyContactDetails_Company {\n  companyId\n  name\n  address\n  suite\n  website {\n    uri\n    hostName\n    __typename\n  }\n  phoneNumbers\n  logoImage\n  availableInProfessionalDirectory\n  dateAssumedRole\n  bio\n  __typename\n}\n",
+                               "variables": {"propertyId": propId}}
+
+    # Property details
+    payload_property_details = {"operationName": "getPropertyInfo",
+                                "query": "query getPropertyInfo($propertyId: Int!, $currencyCode: String) {\n  propertyDetail {\n    property_info(propertyId: $propertyId, currencyCode: $currencyCode) {\n      ad\n      address {\n        buildingName\n        city\n        cityId\n        county\n        deliveryAddress\n        postalCode\n        countryCode\n        regionId\n        regionName\n        state\n        stateId\n        streetDirId\n        streetName\n        streetNum\n        streetNumEnd\n        streetSuffixId\n        streetTypeId\n        __typename\n      }\n      avgAskingRentPerBed\n      bathBedRatio\n      bldgClass\n      buildingAreaTotal\n      buildingAreaUom\n      buildingName\n      buildingNumber\n      buildingRating\n      buildMonth\n      cluster\n      companies {\n        recordedOwners {\n          companyId\n          name\n          originType\n          ownerSuperTypeId\n          ownerTypeId\n          __typename\n        }\n        trueOwners {\n          companyId\n          name\n          originType\n          ownerSuperTypeId\n          ownerTypeId\n          __typename\n        }\n        __typename\n      }\n      constructionStartMonth\n      constructionStartYear\n      constructionStatus\n      currency\n      floorArea\n      forLease {\n        areaTotal\n        areaUom\n        contigArea\n        rentActMax\n        rentActMin\n        rentBasis\n        rentEstMax\n        rentEstMin\n        spaceCount\n        tmi\n        __typename\n      }\n      forSale {\n        buildingAreaUom\n        capRateMax\n        capRateMin\n        company\n        companyId\n        condoOnly\n        contactFirstName\n        contactId\n        contactLastName\n        contactPhone\n        dateOnMarket\n        itemType\n        phoneCountryCode\n        pricePerAcreMax\n        pricePerBuildingAreaMax\n        pricePerBuildingAreaMin\n        pricePerItemMax\n        pricePerItemMin\n        salePrice\n        statusId\n        __typename\n      }\n      industrial {\n        driveInsHeight\n        driveInsWidth\n        hasCranes\n        hasDriveInBay\n        hasHeavyPower\n        hasLoadingDocks\n        hasRail\n        maxColumnDepthFeet\n        maxColumnWidthFeet\n        numOfCranes\n        numOfDriveIns\n        numOfExternalLoadingDocks\n        numOfInternalLoadingDocks\n        numOfLoadingDocks\n        railLine\n        sewer\n        __typename\n      }\n      institutionName\n      isBreeam\n      isLeed\n      isOpportunityZone\n      landAreaTotal\n      landAreaUom\n      landType\n      latitude\n      longitude\n      mapBookName\n      mapPageNum\n      mapXCoordinate\n      mapYCoordinate\n      market\n      maxCeilingHt\n      metro\n      minAreaMeasure\n      minAreaPerLot\n      minCeilingHt\n      multiFamily {\n        affordabilityType\n        apartmentLifestyleType\n        apartmentRentType\n        apartmentStyleType\n        askingRentPerSqFt\n        askingRentPerUnit\n        avgUnitSize\n        concession\n        effRentPerSqFt\n        effRentPerUnit\n        numOfBuildings\n        numOfUnits\n        parkingSpacesPerUnit\n        percent1Bed\n        percent2Bed\n        percent3Bed\n        percent4Bed\n        percentStudio\n        vacancyPercent\n        __typename\n      }\n      numOfBeds\n      numOfParkingSpaces\n      numOfRooms\n      numOfStories\n      parkingRatio\n      percentLeased\n      primaryLeasingInfo {\n        company\n        companyId\n        contactFirstName\n        contactLastName\n        contactPhone\n        phoneCountryCode\n        __typename\n      }\n      primaryPhoto {\n        caption\n        url\n        __typename\n      }\n      propertyGroupName\n      propertySubtype\n      propertyGroupType\n      propertyId\n      propertySubtype\n      propertyType\n      proposedLandUse\n      renovationMonth\n      renovationYear\n      retailLoc\n      singleTenancyState\n      submarket\n      yearBuilt\n      zoning\n      __typename\n    }\n    __typename\n  }\n}\n",
+                                "variables": {"propertyId": propId, "currencyCode": "USD"}}
+
+    payload = [payload_amenities,
+               payload_unitmix,
+               payload_about_owners,
+               payload_about_location,
+               payload_comps,
+               payload_contact_details,
+               payload_property_details]
+    if not full_query:
+        field_selection = build_field_selection()
+        for operation in payload:
+            operation['query'] = build_minimal_query(operation['operationName'],
+                                                     field_selection[operation['operationName']])
+    return payload
+
+
+@traced('load')
+def post_to_db(sql_connection_string, sql_table_name, last_scrape_df=None, amenities_shrink_dict=None,
+               bulk_load=False, chunksize=None, schema='dbo', incremental=False, ledger_path=None):
+    """
+    Upload results from last CoStar web scrape into the SQL Server table specified
+    by the SQL connection string.
+
+    Parameters
+    ----------
+    last_scrape_df : dataframe, optional
+        The dataframe from the last run scrape. The default is None. If a dataframe
+        is not passed in, the method searches for the last saved .csv or .parquet
+        file in the shared drive, ignoring the partial snapshots of shards.
+    sql_connection_string : str
+        The connection string used by SQL Alchemy to connect to the target table in the
+        SQL Server database into which the data is injected. A SQL Alchemy URL (e.g.
+        'sqlite:///costar.db') may be passed instead to target another database.
+    sql_table_name : str
+        The name of the table into which the data is injected.
+    amenities_shrink_dict : dict, optional
+        Dictionary of the full text: abbreviated text of amenity names. The default is None,
+        in which case AMENITIES_SHRINK_DICT is used.
+    bulk_load : bool, optional
+        Boolean indicator of whether to send inserts as pyodbc fast_executemany batches.
+        The default is False.
+    chunksize : int, optional
+        Number of rows written per batch. The default is None, in which case 100 rows are
+        written per batch, or BULK_LOAD_CHUNKSIZE rows when bulk_load is True.
+    schema : str, optional
+        The schema of the target table. The default is 'dbo'. Pass None for databases
+        without schemas, such as SQLite.
+    incremental : bool, optional
+        Boolean indicator of whether to upload only properties that are new or whose
+        record differs from their most recent row in the table. MostRecentFlag is then
+        flipped only for the uploaded properties. The default is False, in which case
+        every property is uploaded and MostRecentFlag is flipped for the whole table.
+    ledger_path : str, optional
+        Full file path of the run's WorkLedger database. Properties already loaded earlier
+        in the run are skipped, MostRecentFlag is only flipped for the whole table before
+        the run's first load, and properties are marked loaded every
+        LEDGER_LOAD_BATCH_SIZE rows. The default is None, in which case no ledger is kept.
+
+    Returns
+    -------
+    None.
+
+    """
+    if last_scrape_df is None:
+        files = glob(os.path.abspath("*.csv")) + glob(os.path.abspath("*.parquet"))
+        # a shard holds only part of the properties; loading it alone would flag the rest stale
+        files = [file for file in files if not os.path.basename(file).startswith('shard_')]
+        if not files:
+            raise FileNotFoundError('No compiled snapshot to load; merge the shard snapshots first.')
+        files.sort(key=os.path.getmtime)
+        if files[-1].endswith('.parquet'):
+            data_df = read_snapshot(files[-1])
+        else:
+            data_df = pd.read_csv(files[-1])
+    else:
+        data_df = last_scrape_df
+
+    engine = create_db_engine(sql_connection_string, fast_executemany=bulk_load)
+    if chunksize is None:
+        chunksize = BULK_LOAD_CHUNKSIZE if bulk_load else 100
+
+    CoStarPropertyExport_table = reflect_table(engine, sql_table_name, schema)
+
+    ledger = None if ledger_path is None else WorkLedger(ledger_path)
+    resumed_load = False
+    if ledger is not None:
+        loaded_prop_ids = ledger.prop_ids('loaded')
+        resumed_load = len(loaded_prop_ids) > 0
+        data_df = data_df[~data_df['CoStarPropertyID'].astype(str).isin(loaded_prop_ids)]
+        if resumed_load:
+            print(f'Resuming load: {len(loaded_prop_ids)} properties already loaded this run.')
+
+    data_df = prepare_df_for_sql(data_df, amenities_shrink_dict)
+
+    if incremental:
+        data_df = get_changed_properties(data_df, engine, CoStarPropertyExport_table)
+        print(f'{len(data_df)} new or changed properties to upload.')
+        # flip MostRecentFlag only on the properties being replaced
+        clear_most_recent_flag_for_properties(engine, CoStarPropertyExport_table, data_df['CoStarPropertyID'])
+    elif not resumed_load:
+        clear_most_recent_flag(engine, CoStarPropertyExport_table)
+
+    data_df = data_df.assign(CollectedDateStamp=datetime.datetime.today())
+    data_df = data_df.assign(MostRecentFlag=1)
+
+    if ledger is None:
+        load_df_to_sql(data_df, engine, sql_table_name, schema, chunksize)
+        return
+    try:
+        for i in range(0, len(data_df), LEDGER_LOAD_BATCH_SIZE):
+            batch_df = data_df.iloc[i:i+LEDGER_LOAD_BATCH_SIZE]
+            load_df_to_sql(batch_df, engine, sql_table_name, schema, chunksize)
+            ledger.mark(batch_df['CoStarPropertyID'], 'loaded')
+    finally:
+        ledger.close()
+    return
+
+
+def create_db_engine(sql_connection_string, fast_executemany=False):
+    """
+    Create the SQL Alchemy engine for the target database.
+
+    Parameters
+    ----------
+    sql_connection_string : str
+        Either an ODBC connection string for the SQL Server database, or a SQL Alchemy
+        URL (any string containing '://') for another database.
+    fast_executemany : bool, optional
+        Boolean indicator of whether pyodbc should send each executemany batch in a
+        single round trip. Only applies to SQL Server connections. The default is False.
+
+    Returns
+    -------
+    engine : SQL Alchemy Engine
+        Engine connected to the target database.
+
+    """
+    from sqlalchemy import create_engine
+    if '://' in sql_connection_string:
+        return create_engine(sql_connection_string)
+    import pyodbc  # Needs to be imported to support string connector of sql alchemy engine
+    quoted = urllib.parse.quote_plus(sql_connection_string)
+    engine = create_engine('mssql+pyodbc:///?odbc_connect={}'.format(quoted),
+                           fast_executemany=fast_executemany)
+    return engine
+
+
+def reflect_table(engine, sql_table_name, schema='dbo'):
+    """
+    Reflect the target SQL table.
+
+    Parameters
+    ----------
+    engine : SQL Alchemy Engine
+        Engine connected to the target database.
+    sql_table_name : str
+        The name of the table into which the data is injected.
+    schema : str, optional
+        The schema of the target table. The default is 'dbo'.
+
+    Returns
+    -------
+    SQL Alchemy Table
+        Reflected target table.
+
+    """
+    from sqlalchemy import MetaData
+    md = MetaData(bind=engine, schema=schema)
+    md.reflect(only=[sql_table_name])
+    return md.tables[sql_table_name if schema is None else schema + '.' + sql_table_name]
+
+
+def clear_most_recent_flag(engine, table):
+    """
+    Set MostRecentFlag to 0 on every row of the table currently flagged as most recent.
+
+    Parameters
+    ----------
+    engine : SQL Alchemy Engine
+        Engine connected to the target database.
+    table : SQL Alchemy Table
+        Reflected target table.
+
+    Returns
+    -------
+    None.
+
+    """
+    from sqlalchemy import update
+    statement = (update(table).
+                 where(table.c.MostRecentFlag==1).
+                 values(MostRecentFlag=0))
+    engine.execute(statement)
+    return
+
+
+def clear_most_recent_flag_for_properties(connection, table, prop_ids):
+    """
+    Set MostRecentFlag to 0 on the rows currently flagged as most recent for the given
+    properties only, in batches under the SQL Server parameter limit.
+
+    Parameters
+    ----------
+    connection : SQL Alchemy Engine or Connection
+        Engine or open transaction connection to the target database.
+    table : SQL Alchemy Table
+        Reflected target table.
+    prop_ids : iterable of str or int
+        CoStar Property IDs of the properties being replaced.
+
+    Returns
+    -------
+    None.
+
+    """
+    from sqlalchemy import update
+    prop_ids = [int(prop_id) for prop_id in prop_ids]
+    for i in range(0, len(prop_ids), 1000):
+        statement = (update(table).
+                     where(table.c.MostRecentFlag==1).
+                     where(table.c.CoStarPropertyID.in_(prop_ids[i:i+1000])).
+                     values(MostRecentFlag=0))
+        connection.execute(statement)
+    return
+
+
+def clear_most_recent_flag_except(connection, table, prop_ids):
+    """
+    Set MostRecentFlag to 0 on the rows currently flagged as most recent for every property
+    except the given ones, e.g. properties dropped from the run or from the portfolio.
+
+    Parameters
+    ----------
+    connection : SQL Alchemy Engine or Connection
+        Engine or open transaction connection to the target database.
+    table : SQL Alchemy Table
+        Reflected target table.
+    prop_ids : iterable of str or int
+        CoStar Property IDs of the properties whose flagged rows are kept.
+
+    Returns
+    -------
+    None.
+
+    """
+    from sqlalchemy import select
+    kept_prop_ids = {int(prop_id) for prop_id in prop_ids}
+    flagged_prop_ids = connection.execute(select(table.c.CoStarPropertyID).
+                                          where(table.c.MostRecentFlag==1).
+                                          distinct()).scalars().all()
+    clear_most_recent_flag_for_properties(connection, table,
+                                          [prop_id for prop_id in flagged_prop_ids
+                                           if int(prop_id) not in kept_prop_ids])
+    return
+
+
+def prepare_df_for_sql(data_df, amenities_shrink_dict=None):
+    """
+    Convert column types and shrink the amenities list of a parsed DataFrame to fit the SQL table.
+
+    Parameters
+    ----------
+    data_df : Pandas DataFrame
+        DataFrame of parsed property records.
+    amenities_shrink_dict : dict, optional
+        Dictionary of the full text: abbreviated text of amenity names. The default is None,
+        in which case AMENITIES_SHRINK_DICT is used.
+
+    Returns
+    -------
+    data_df : Pandas DataFrame
+        Copy of the DataFrame ready to be appended to the SQL table.
+
+    """
+    data_df = convert_df_types(data_df)
+    data_df['Amenities'] = shrink_amenities(data_df['Amenities'], amenities_shrink_dict)
+    return data_df
+
+
+def hash_property_records(df):
+    """
+    Hash the normalized values of each property record so records can be compared
+    regardless of whether they came from a fresh scrape or were read back from SQL.
+
+    Parameters
+    ----------
+    df : Pandas DataFrame
+        DataFrame containing the PROPERTY_COLUMNS of one or more properties.
+
+    Returns
+    -------
+    Pandas Series
+        SHA-1 hex digest of each row's record, aligned to the index of df.
+
+    """
+    normalized = pd.Series('', index=df.index)
+    for col in PROPERTY_COLUMNS:
+        numeric = pd.to_numeric(df[col], errors='coerce').astype('float64').round(6)
+        text = df[col].astype('string').fillna('')
+        col_values = text.where(numeric.isna(), numeric.astype(str))
+        normalized = normalized + col_values + '\x1f'
+    return normalized.map(lambda record: hashlib.sha1(record.encode('utf-8')).hexdigest())
+
+
+def get_changed_properties(data_df, engine, table):
+    """
+    Filter the scraped properties to those that are new or have changed since their
+    most recent row in the SQL table.
+
+    Parameters
+    ----------
+    data_df : Pandas DataFrame
+        DataFrame already converted to the SQL table types.
+    engine : SQL Alchemy Engine
+        Engine connected to the target database.
+    table : SQL Alchemy Table
+        Reflected target table.
+
+    Returns
+    -------
+    Pandas DataFrame
+        The rows of data_df whose record hash does not match the latest stored snapshot.
+
+    """
+    from sqlalchemy import select
+    statement = (select(*[table.c[col] for col in PROPERTY_COLUMNS]).
+                 where(table.c.MostRecentFlag==1))
+    stored_df = pd.read_sql(statement, engine)
+    stored_hashes = dict(zip(stored_df['CoStarPropertyID'].astype('int64').astype(str),
+                             hash_property_records(stored_df)))
+    current_hashes = hash_property_records(data_df)
+    prop_ids = data_df['CoStarPropertyID'].astype('int64').astype(str)
+    changed = [stored_hashes.get(prop_id) != record_hash for prop_id, record_hash in zip(prop_ids, current_hashes)]
+    return data_df[changed].reset_index(drop=True)
+
+
+def load_df_to_sql(data_df, engine, sql_table_name, schema='dbo', chunksize=100):
+    """
+    Append a DataFrame to the target SQL table and report the load throughput.
+
+    Parameters
+    ----------
+    data_df : Pandas DataFrame
+        DataFrame already converted to the SQL table types.
+    engine : SQL Alchemy Engine or Connection
+        Engine connected to the target database, or a connection whose open transaction
+        the rows are written in.
+    sql_table_name : str
+        The name of the table into which the data is injected.
+    schema : str, optional
+        The schema of the target table. The default is 'dbo'.
+    chunksize : int, optional
+        Number of rows written per batch. The default is 100.
+
+    Returns
+    -------
+    rows_per_second : float
+        Number of rows written per second of wall-clock time.
+
+    """
+    print('Beginning upload to SQL Server database.')
+    start = datetime.datetime.now()
+    data_df.to_sql(name=sql_table_name,
+                   schema=schema,
+                   con=engine,
+                   if_exists='append',
+                   index=False,
+                   chunksize=chunksize,
+                   dtype=get_sql_dtypes())
+    end = datetime.datetime.now()
+    rows_per_second = len(data_df) / max((end-start).total_seconds(), 1e-6)
+    run_metrics.increment('db_rows_total', len(data_df), table=sql_table_name)
+    run_metrics.increment('db_load_seconds_total', (end-start).total_seconds(), table=sql_table_name)
+    run_metrics.set_gauge('db_rows_per_second',
+                          run_metrics.counter_value('db_rows_total', table=sql_table_name)
+                          / max(run_metrics.counter_value('db_load_seconds_total', table=sql_table_name), 1e-6),
+                          table=sql_table_name)
+    print(f'Transfer to SQL {sql_table_name} table completed in {end-start} ({rows_per_second:,.0f} rows/sec).')
+    return rows_per_second
+
+
+def shrink_amenities(amenities, amenities_shrink_dict=None, max_length=250):
+    """
+    Abbreviate long amenity names and shorten each amenities list string to the last
+    complete amenity under the maximum length.
+
+    Parameters
+    ----------
+    amenities : Pandas Series
+        Column of '; ' delimited amenities list strings.
+    amenities_shrink_dict : dict, optional
+        Dictionary of the full text: abbreviated text of amenity names. The default is None,
+        in which case AMENITIES_SHRINK_DICT is used.
+    max_length : int, optional
+        Maximum number of characters in an amenities list string. The default is 250, the
+        width of the Amenities column in the SQL table.
+
+    Returns
+    -------
+    amenities : Pandas Series
+        Column of abbreviated amenities list strings no longer than max_length.
+
+    """
+    if amenities_shrink_dict is None:
+        amenities_shrink_dict = AMENITIES_SHRINK_DICT
+    amenities = amenities.astype('string')
+    if amenities_shrink_dict:
+        # longest names first so an abbreviation never pre-empts a longer name containing it
+        pattern = re.compile('|'.join(re.escape(key) for key in sorted(amenities_shrink_dict, key=len, reverse=True)))
+        amenities = amenities.str.replace(pattern, lambda match: amenities_shrink_dict[match.group(0)], regex=True)
+    too_long = amenities.str.len() > max_length
+    truncated = amenities.str.slice(0, max_length).str.replace(r';[^;]*$', '', regex=True)
+    amenities = amenities.mask(too_long, truncated)
+    return amenities
+
+
+def convert_numeric_column(column, dtype):
+    """
+    Strip currency, thousands and percent formatting from a column of CoStar values
+    and cast the whole column to a nullable numeric type.
+
+    Parameters
+    ----------
+    column : Pandas Series
+        Column of string values as returned by CoStar, e.g. '$1,250', '4.5%' or '-'.
+    dtype : str
+        Nullable pandas dtype to cast the cleaned column to ('Int64' or 'Float64').
+
+    Returns
+    -------
+    Pandas Series
+        The column with '$', ',' and '%' removed, '-' placeholders set to null, and cast to dtype.
+        A column that already has a numeric dtype, e.g. read back from a parquet snapshot,
+        is only cast.
+
+    """
+    if pd.api.types.is_numeric_dtype(column):
+        return column if column.dtype == dtype else column.astype('Float64').astype(dtype)
+    text = column.astype('string').str.replace(r'[$,%]', '', regex=True).str.strip()
+    text = text.mask(text.isin(['-', '']))
+    return text.astype('Float64').astype(dtype)
+
+
+def convert_df_types(test_df=None):
+    """
+    Convert the type of the dataframe to match the SQL database before injection.
+
+    Parameters
+    ----------
+    test_df : Pandas DataFrame
+        DataFrame containing the data from the most recent CoStar web scrape.
+
+    Returns
+    -------
+    df : Pandas DataFrame
+        DataFrame containing the data from the most recent CoStar web scrape standardized
+        to match the datatypes of the CoStarPropertyExport SQL table.
+
+    """
+    df = test_df.copy()
+    for col, dtype in NUMERIC_COLUMN_DTYPES.items():
+        df[col] = convert_numeric_column(df[col], dtype)
+    return df
+
+
+class ResponseError(ValueError):
+    """
+    Call response that decoded but cannot be parsed, e.g. because an operation returned
+    GraphQL errors. The category attribute names the kind of failure.
+    """
+
+    def __init__(self, category, message):
+        super().__init__(message)
+        self.category = category
+
+
+@functools.lru_cache(maxsize=None)
+def get_checked_response_indexes():
+    """Return the response positions of the operations read by COLUMN_EXTRACTION_SPEC."""
+    return tuple(sorted({PAYLOAD_OPERATIONS.index(column_spec[0]) for column_spec in COLUMN_EXTRACTION_SPEC.values()}))
+
+
+def check_response(json_response):
+    """
+    Check a decoded call response holds a result with data and no GraphQL errors for
+    every operation read by the parser.
+
+    Parameters
+    ----------
+    json_response : JSON object
+        JSON object containing the deserialized values returned by CoStar.
+
+    Returns
+    -------
+    None.
+
+    Raises
+    ------
+    ResponseError
+        If the response is not a list of one result per operation ('unexpected_shape'),
+        or an operation read by the parser returned errors or no data ('graphql_errors').
+
+    """
+    if not isinstance(json_response, list) or len(json_response) != len(PAYLOAD_OPERATIONS):
+        raise ResponseError('unexpected_shape', 'Response is not a list of one result per payload operation.')
+    for index in get_checked_response_indexes():
+        result = json_response[index]
+        if not isinstance(result, dict) or result.get('errors') or result.get('data') is None:
+            raise ResponseError('graphql_errors', f'{PAYLOAD_OPERATIONS[index]} returned errors or no data.')
+
+
+def classify_response(status, response_text):
+    """
+    Categorize a call response as a failure or success.
+
+    Parameters
+    ----------
+    status : int
+        HTTP status code of the response.
+    response_text : str
+        Text of the CoStar API response.
+
+    Returns
+    -------
+    str or None
+        Failure category: 'http_<status>', 'empty_body', 'invalid_json', 'unexpected_shape'
+        or 'graphql_errors', or None if the response can be parsed.
+
+    """
+    if status >= 400:
+        return f'http_{status}'
+    if not response_text.strip():
+        return 'empty_body'
+    try:
+        check_response(json_loads(response_text))
+    except ResponseError as e:
+        return e.category
+    except ValueError:
+        return 'invalid_json'
+    return None
+
+
+def get_retry_delay(attempt, base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY):
+    """
+    Draw the delay before a retry with exponential backoff and full jitter.
+
+    Parameters
+    ----------
+    attempt : int
+        Number of retries of the property already made.
+    base_delay : float, optional
+        Upper bound of the first delay in seconds. The default is RETRY_BASE_DELAY.
+    max_delay : float, optional
+        Upper bound of any delay in seconds. The default is RETRY_MAX_DELAY.
+
+    Returns
+    -------
+    float
+        Delay in seconds, drawn uniformly between 0 and min(max_delay, base_delay * 2**attempt).
+
+    """
+    return random.uniform(0, min(max_delay, base_delay * 2**attempt))
+
+
+async def retry_responses_async(prop_ids, url, cookies_dict, max_attempts=RETRY_MAX_ATTEMPTS,
+                                retry_budget=RETRY_BUDGET, max_concurrency=8):
+    """
+    Retry the calls of properties whose response failed, concurrently from a single event loop,
+    backing off exponentially with jitter between the attempts for each property.
+
+    Parameters
+    ----------
+    prop_ids : list of str
+        The unique CoStar Property IDs to retry.
+    url : str
+        URL of the CoStar API endpoint.
+    cookies_dict : dict
+        Dictionary of the name: value of each cookie assigned to the webdriver post-login.
+    max_attempts : int, optional
+        Maximum number of retries per property. The default is RETRY_MAX_ATTEMPTS.
+    retry_budget : int, optional
+        Maximum number of retries across all properties, so that a systemic failure such
+        as expired cookies does not retry every property max_attempts times. The default
+        is RETRY_BUDGET.
+    max_concurrency : int, optional
+        Maximum number of retries in flight. The default is 8.
+
+    Returns
+    -------
+    responses : dict
+        Dictionary of CoStar Property ID: response text of each property recovered.
+    failures : collections.Counter
+        Number of failed retries by failure category, plus 'budget_exhausted' for
+        properties given up on because the retry budget was spent.
+
+    """
+    import aiohttp
+    semaphore = asyncio.Semaphore(max_concurrency)
+    connector = aiohttp.TCPConnector(limit=max_concurrency)
+    budget = [retry_budget]
+    responses = {}
+    failures = collections.Counter()
+
+    async def retry_property(session, prop_id):
+        for attempt in range(max_attempts):
+            if budget[0] <= 0:
+                failures['budget_exhausted'] += 1
+                return
+            budget[0] -= 1
+            await asyncio.sleep(get_retry_delay(attempt))
+            async with semaphore:
+                try:
+                    start = time.perf_counter()
+                    async with session.post(url, data=get_payload_bytes(prop_id)) as resp:
+                        body = await resp.read()
+                        response_text = body.decode(resp.get_encoding())
+                        category = classify_response(resp.status, response_text)
+                    run_metrics.record_response(resp.status, len(body), time.perf_counter() - start)
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    category = 'connection_error'
+            if category is None:
+                responses[prop_id] = response_text
+                return
+            failures[category] += 1
+
+    async with aiohttp.ClientSession(connector=connector, headers=REQUEST_HEADERS, cookies=cookies_dict) as session:
+        await asyncio.gather(*(retry_property(session, prop_id) for prop_id in prop_ids))
+    return responses, failures
+
+
+@traced('retry')
+def retry_failed_responses(prop_ids, cookies_dict, max_attempts=RETRY_MAX_ATTEMPTS, retry_budget=RETRY_BUDGET,
+                           max_concurrency=8):
+    """
+    Retry the calls of properties whose response failed and report the failures by category.
+
+    Parameters
+    ----------
+    prop_ids : list of str
+        The unique CoStar Property IDs to retry.
+    cookies_dict : dict
+        Dictionary of the name: value of each cookie assigned to the webdriver post-login.
+    max_attempts : int, optional
+        Maximum number of retries per property. The default is RETRY_MAX_ATTEMPTS.
+    retry_budget : int, optional
+        Maximum number of retries across all properties. The default is RETRY_BUDGET.
+    max_concurrency : int, optional
+        Maximum number of retries in flight. The default is 8.
+
+    Returns
+    -------
+    responses : dict
+        Dictionary of CoStar Property ID: response text of each property recovered.
+
+    """
+    start = datetime.datetime.now()
+    responses, failures = asyncio.run(retry_responses_async(prop_ids, os.getenv('COSTAR_DB_URL'), cookies_dict,
+                                                            max_attempts, retry_budget, max_concurrency))
+    end = datetime.datetime.now()
+    run_metrics.increment('retry_recovered_total', len(responses))
+    for category, count in failures.items():
+        run_metrics.increment('retry_failures_total', count, category=category)
+    failure_summary = ', '.join(f'{category}: {count}' for category, count in sorted(failures.items()))
+    print(f'Retried {len(prop_ids)} failed responses in {end-start}: {len(responses)} recovered, '
+          f'{len(prop_ids)-len(responses)} not recovered.' + (f' Failed attempts: {failure_summary}.' if failures else ''))
+    return responses
+
+
+def retry_failed_records(records, prop_ids, cookies_dict, save_response_text=None):
+    """
+    Retry the calls of the properties whose record is None and parse the recovered responses.
+
+    Parameters
+    ----------
+    records : list of dict or None
+        Parsed records, with None for each response that failed to parse. Updated in place.
+    prop_ids : list of str
+        CoStar Property ID of each record.
+    cookies_dict : dict or None
+        Dictionary of the name: value of each cookie assigned to the webdriver post-login,
+        or None to leave the failed records unretried, e.g. when re-parsing saved responses
+        without logging in.
+    save_response_text : function, optional
+        Function of (prop_id, response_text) saving each recovered response. The default
+        is None, in which case recovered responses are not saved.
+
+    Returns
+    -------
+    records : list of dict or None
+        The records, with None left for properties that were not recovered.
+
+    """
+    failed = [index for index, record in enumerate(records) if record is None]
+    if not failed:
+        return records
+    run_metrics.increment('parse_failures_total', len(failed))
+    if cookies_dict is None:
+        return records
+    responses = retry_failed_responses([prop_ids[index] for index in failed], cookies_dict)
+    for index in failed:
+        response_text = responses.get(prop_ids[index])
+        if response_text is None:
+            continue
+        if save_response_text is not None:
+            save_response_text(prop_ids[index], response_text)
+        records[index] = parse_response_into_record(prop_ids[index], json_loads(response_text))
+    return records
+
+
+def screen_nulls(data_element_val):
+    """
+    Check for a string element which cannot be cast to float.
+
+    Parameters
+    ----------
+    data_element_val : str
+        A string representation of a data element sourced from the API call response.
+
+    Returns
+    -------
+    Float/string
+        Returns np.nan (a float null value) if string is equal to '-',
+        otherwise returns the unaltered string value.
+
+    """
+    if data_element_val == '-':
+        return np.nan
+    return data_element_val
+
+
+def parse_percent_leased(available_percent):
+    """
+    Convert the percentage of units available, e.g. '5.2%', into the percentage leased.
+
+    Parameters
+    ----------
+    available_percent : str
+        Percentage of units available as returned in the unit mix summary.
+
+    Returns
+    -------
+    float
+        100 minus the available percentage, or np.nan if the value is not a percentage.
+
+    """
+    try:
+        return 100-float(available_percent[:-1])
+    except ValueError:
+        return np.nan
+
+
+def truncate_zip(postal_code):
+    """
+    Truncate a ZIP+4 postal code to its five digit ZIP code.
+
+    Parameters
+    ----------
+    postal_code : str
+        Postal code as returned in the property info.
+
+    Returns
+    -------
+    str/float
+        The five digit ZIP code, or np.nan if the postal code is null.
+
+    """
+    if pd.isna(postal_code):
+        return np.nan
+    if len(postal_code) == 9:
+        return postal_code[:5]
+    return postal_code
+
+
+def parse_parking_spaces(parking_spaces):
+    """
+    Replace the 'None' parking space count reported for properties without parking with 0.
+
+    Parameters
+    ----------
+    parking_spaces : int/str
+        Number of parking spaces as returned in the property info.
+
+    Returns
+    -------
+    int/str
+        The number of parking spaces.
+
+    """
+    if parking_spaces == 'None':
+        return 0
+    return parking_spaces
+
+
+def join_amenities(unit_amenities, amenities, room_amenities):
+    """
+    Join the unit, property and room amenity lists into a single '; '-separated string.
+
+    Parameters
+    ----------
+    unit_amenities, amenities, room_amenities : list of str
+        Amenity lists as returned in the amenities info.
+
+    Returns
+    -------
+    str/float
+        The joined amenities, or np.nan if the property has none.
+
+    """
+    amenities_string = '; '.join(unit_amenities + amenities + room_amenities)
+    if amenities_string == '':
+        return np.nan
+    return amenities_string
+
+
+# Extraction of each column from a call response: (operation, field path(s) below the operation's root field,
+# transform called with the extracted value(s) or None, whether a missing field gives np.nan instead of raising).
+# Path segments are field names, list indexes, or list[key=label] to select the list item whose key field is label.
+COLUMN_EXTRACTION_SPEC = {
+    'PropertyName': ('getPropertyInfo', 'address.buildingName', None, False),
+    'PropertyAddress': ('getPropertyInfo', 'address.deliveryAddress', None, False),
+    'OneBedroomAskingRentUnit': ('UnitMix_Detail', 'summaryItems[totals=All 1 Beds].askingRentPerUnit', screen_nulls, True),
+    'TwoBedroomAskingRentUnit': ('UnitMix_Detail', 'summaryItems[totals=All 2 Beds].askingRentPerUnit', screen_nulls, True),
+    'ThreeBedroomAskingRentUnit': ('UnitMix_Detail', 'summaryItems[totals=All 3 Beds].askingRentPerUnit', screen_nulls, True),
+    'FourBedroomAskingRentUnit': ('UnitMix_Detail', 'summaryItems[totals=All 4 Beds].askingRentPerUnit', screen_nulls, True),
+    'StudioAskingRentUnit': ('UnitMix_Detail', 'summaryItems[totals=All Studios].askingRentPerUnit', screen_nulls, True),
+    'OneBedroomAvgSF': ('UnitMix_Detail', 'summaryItems[totals=All 1 Beds].averageArea', screen_nulls, True),
+    'TwoBedroomAvgSF': ('UnitMix_Detail', 'summaryItems[totals=All 2 Beds].averageArea', screen_nulls, True),
+    'ThreeBedroomAvgSF': ('UnitMix_Detail', 'summaryItems[totals=All 3 Beds].averageArea', screen_nulls, True),
+    'FourBedroomAvgSF': ('UnitMix_Detail', 'summaryItems[totals=All 4 Beds].averageArea', screen_nulls, True),
+    'StudioAvgSF': ('UnitMix_Detail', 'summaryItems[totals=All Studios].averageArea', screen_nulls, True),
+    'OneBedroomEffectiveRentUnit': ('UnitMix_Detail', 'summaryItems[totals=All 1 Beds].effectiveRentPerUnit', screen_nulls, True),
+    'TwoBedroomEffectiveRentUnit': ('UnitMix_Detail', 'summaryItems[totals=All 2 Beds].effectiveRentPerUnit', screen_nulls, True),
+    'ThreeBedroomEffectiveRentUnit': ('UnitMix_Detail', 'summaryItems[totals=All 3 Beds].effectiveRentPerUnit', screen_nulls, True),
+    'FourBedroomEffectiveRentUnit': ('UnitMix_Detail', 'summaryItems[totals=All 4 Beds].effectiveRentPerUnit', screen_nulls, True),
+    'StudioEffectiveRentUnit': ('UnitMix_Detail', 'summaryItems[totals=All Studios].effectiveRentPerUnit', screen_nulls, True),
+    'NumberOf1BedroomsUnits': ('UnitMix_Detail', 'summaryItems[totals=All 1 Beds].unitMixBeds', screen_nulls, True),
+    'NumberOf2BedroomsUnits': ('UnitMix_Detail', 'summaryItems[totals=All 2 Beds].unitMixBeds', screen_nulls, True),
+    'NumberOf3BedroomsUnits': ('UnitMix_Detail', 'summaryItems[totals=All 3 Beds].unitMixBeds', screen_nulls, True),
+    'NumberOf4BedroomsUnits': ('UnitMix_Detail', 'summaryItems[totals=All 4 Beds].unitMixBeds', screen_nulls, True),
+    'NumberOfStudioUnits': ('UnitMix_Detail', 'summaryItems[totals=All Studios].unitMixBeds', screen_nulls, True),
+    'NumberOfUnits': ('UnitMix_Detail', 'summaryItems[totals=Totals].unitMixBeds', None, True),
+    'OneBedroomConcessionsPercentage': ('UnitMix_Detail', 'summaryItems[totals=All 1 Beds].concessions', screen_nulls, True),
+    'TwoBedroomConcessionsPercentage': ('UnitMix_Detail', 'summaryItems[totals=All 2 Beds].concessions', screen_nulls, True),
+    'ThreeBedroomConcessionsPercentage': ('UnitMix_Detail', 'summaryItems[totals=All 3 Beds].concessions', screen_nulls, True),
+    'FourBedroomConcessionsPercentage': ('UnitMix_Detail', 'summaryItems[totals=All 4 Beds].concessions', screen_nulls, True),
+    'StudioConcessionsPercentage': ('UnitMix_Detail', 'summaryItems[totals=All Studios].concessions', screen_nulls, True),
+    'Latitude': ('getPropertyInfo', 'latitude', None, False),
+    'Longitude': ('getPropertyInfo', 'longitude', None, False),
+    'PropertyManagerName': ('ContactsDetail', 'propertyManager.0.name', None, True),
+    'TrueOwnerName': ('ContactsDetail', 'trueOwner.0.name', None, True),
+    'BuildingClass': ('getPropertyInfo', 'bldgClass', None, False),
+    'StarRating': ('getPropertyInfo', 'buildingRating', None, False),
+    'Amenities': ('Amenities_Info', ('unitAmenities', 'amenities', 'roomAmenities'), join_amenities, False),
+    'YearBuilt': ('getPropertyInfo', 'yearBuilt', None, False),
+    'ParkingSpaces': ('getPropertyInfo', 'numOfParkingSpaces', parse_parking_spaces, False),
+    'BuildingStories': ('getPropertyInfo', 'numOfStories', None, False),
+    'PercentLeased': ('UnitMix_Detail', 'summaryItems[totals=Totals].availablePercent', parse_percent_leased, True),
+    'City': ('getPropertyInfo', 'address.city', None, False),
+    'State': ('getPropertyInfo', 'address.state', None, False),
+    'Zip': ('getPropertyInfo', 'address.postalCode', truncate_zip, False)}
+
+
+def parse_field_path(field_path):
+    """
+    Split a COLUMN_EXTRACTION_SPEC field path into its lookup steps.
+
+    Parameters
+    ----------
+    field_path : str
+        Dotted field path, e.g. 'address.city', 'trueOwner.0.name' or
+        'summaryItems[totals=Totals].unitMixBeds'.
+
+    Returns
+    -------
+    table_path : tuple or None
+        Steps to the list an item is selected from by key, or None if the path has no
+        list[key=label] segment.
+    key_field : str or None
+        Field of the list items holding their key.
+    label : str or None
+        Key of the selected list item.
+    field_steps : tuple
+        Field names and list indexes looked up after the selected item (or the root field).
+
+    """
+    table_path, key_field, label = None, None, None
+    steps = []
+    for segment in field_path.split('.'):
+        keyed_segment = re.fullmatch(r'(\w+)\[(\w+)=(.+)\]', segment)
+        if keyed_segment is not None:
+            table_path = tuple(steps) + (keyed_segment.group(1),)
+            key_field, label = keyed_segment.group(2), keyed_segment.group(3)
+            steps = []
+        elif segment.isdigit():
+            steps.append(int(segment))
+        else:
+            steps.append(segment)
+    return table_path, key_field, label, tuple(steps)
+
+
+def chain_getters(steps):
+    """
+    Build a function looking up a sequence of keys and list indexes in nested JSON values.
+
+    Parameters
+    ----------
+    steps : tuple
+        Field names and list indexes to look up in order.
+
+    Returns
+    -------
+    function
+        Function of a JSON value returning the value at the end of the steps.
+
+    """
+    # the usual depths are unrolled, saving a call per step
+    if len(steps) == 1:
+        return operator.itemgetter(steps[0])
+    if len(steps) == 2:
+        first, second = steps
+        return lambda value: value[first][second]
+    if len(steps) == 3:
+        first, second, third = steps
+        return lambda value: value[first][second][third]
+    getters = [operator.itemgetter(step) for step in steps]
+
+    def get(value):
+        for getter in getters:
+            value = getter(value)
+        return value
+    return get
+
+
+@functools.lru_cache(maxsize=None)
+def compile_extraction_plan():
+    """
+    Compile COLUMN_EXTRACTION_SPEC once into an extractor function. Each operation is
+    located in the response by its name's position in PAYLOAD_OPERATIONS, each operation's
+    root field is looked up once, and each keyed list (e.g. the unit mix summary items) is
+    indexed once per response; every column then reads its fields from those through a
+    chain of item getters compiled into one function per column.
+
+    Returns
+    -------
+    extract_record : function
+        Function of (prop_id, json_response) returning the dictionary record of column
+        name: value for the property.
+
+    """
+    def compose_transform(transform, getters):
+        if transform is None:
+            return getters[0]
+        if len(getters) == 1:
+            getter = getters[0]
+            return lambda values: transform(getter(values))
+        return lambda values: transform(*[getter(values) for getter in getters])
+
+    missing_field_errors = (KeyError, IndexError, TypeError)
+    roots, root_slots, tables, columns = [], {}, {}, []
+
+    def lookup_field(operation, field_path):
+        root_key = (PAYLOAD_OPERATIONS.index(operation), PAYLOAD_OPERATION_ROOTS[operation][0])
+        if root_key not in root_slots:
+            root_slots[root_key] = len(roots)
+            roots.append(root_key)
+        table_path, key_field, label, field_steps = parse_field_path(field_path)
+        if table_path is None:
+            return root_slots[root_key], field_steps
+        table_key = (root_key, table_path, key_field)
+        if table_key not in tables:
+            tables[table_key] = (root_slots[root_key], chain_getters(table_path), key_field, [])
+        labels = tables[table_key][3]
+        if label not in labels:
+            labels.append(label)
+        return (table_key, label), field_steps
+
+    for column, (operation, field_paths, transform, optional) in COLUMN_EXTRACTION_SPEC.items():
+        if isinstance(field_paths, str):
+            field_paths = (field_paths,)
+        columns.append((column, [lookup_field(operation, field_path) for field_path in field_paths],
+                        transform, optional))
+    # the root fields fill the first slots of the values looked up per response, followed by
+    # the selected item of each keyed list in the order the lists are indexed
+    item_slots = {}
+    for table_key, (_, _, _, labels) in tables.items():
+        for label in labels:
+            item_slots[table_key, label] = len(roots) + len(item_slots)
+    table_plan = list(tables.values())
+    column_plan = []
+    for column, fields, transform, optional in columns:
+        getters = [chain_getters((item_slots.get(slot, slot),) + field_steps) for slot, field_steps in fields]
+        column_plan.append((column, compose_transform(transform, getters), optional))
+
+    def extract_record(prop_id, json_response):
+        values = [json_response[index]['data']['propertyDetail'][root] for index, root in roots]
+        for root_slot, get_items, key_field, labels in table_plan:
+            table = {item[key_field]: item for item in get_items(values[root_slot]) if key_field in item}
+            values.extend(table.get(label, {}) for label in labels)
+        record = {'CoStarPropertyID': prop_id}
+        for column, extract_value, optional in column_plan:
+            try:
+                record[column] = extract_value(values)
+            except missing_field_errors:
+                if not optional:
+                    raise
+                record[column] = np.nan
+        return record
+    return extract_record
+
+
+def records_to_df(records):
+    """
+    Build the compiled property DataFrame from a list of parsed property records in a single pass.
+
+    Parameters
+    ----------
+    records : list of dict
+        Property records as returned by read_call_response_into_record.
+
+    Returns
+    -------
+    df : Pandas DataFrame
+        DataFrame with one row per record and columns ordered as PROPERTY_COLUMNS.
+
+    """
+    df = pd.DataFrame.from_records(records, columns=PROPERTY_COLUMNS)
+    return df
+
+
+def read_call_response_into_record(file):
+    """
+    Open and read call response from .txt file for a single property, pull
+    data elements of interest from response into a dictionary record.
+
+    Parameters
+    ----------
+    file : str
+        Full file path to .txt file containing CoStar API response for a single property.
+
+    Returns
+    -------
+    record : dict
+        Dictionary of column name: value for the property recorded in file.
+
+    """
+    # read call response from .txt file
+    json_response = load_json_response(file)
+    record = parse_response_into_record(file.split('\\')[1].split('_')[0], json_response)
+    return record
+
+
+def load_json_response(file):
+    """
+    Decode the call response saved in a .txt file directly from a read-only memory map
+    of the file, using the JSON backend selected with set_json_backend.
+
+    Parameters
+    ----------
+    file : str
+        Full file path to .txt file containing CoStar API response for a single property.
+
+    Returns
+    -------
+    json_response : JSON object
+        JSON object containing the deserialized values returned by CoStar.
+
+    Raises
+    ------
+    ValueError
+        If the file is empty or does not contain valid JSON.
+
+    """
+    with open(file, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if json_loads is json.loads:
+                # the standard library cannot decode from a buffer, so copy the bytes once
+                return json_loads(mapped[:])
+            with memoryview(mapped) as view:
+                return json_loads(view)
+
+
+def parse_response_into_record(prop_id, json_response):
+    """
+    Pull data elements of interest from a deserialized call response for a single
+    property into a dictionary record, with the extractor compiled from COLUMN_EXTRACTION_SPEC.
+
+    Parameters
+    ----------
+    prop_id : str
+        The unique CoStar Property ID of the property in json_response.
+    json_response : JSON object
+        JSON object containing the deserialized values returned by CoStar.
+
+    Returns
+    -------
+    record : dict
+        Dictionary of column name: value for the property.
+
+    Raises
+    ------
+    ResponseError
+        If an operation read by the parser returned GraphQL errors or no data.
+
+    """
+    check_response(json_response)
+    return compile_extraction_plan()(prop_id, json_response)
+
+
+class ResponseArchive:
+    """
+    Append-only archive of zlib-compressed call responses for a single run, with an
+    offset index keyed by CoStar Property ID.
+
+    Responses are appended to the archive file and each append writes a
+    'prop_id<TAB>offset<TAB>length' line to the index file beside it (archive_path + '.idx').
+    If a property is appended more than once, e.g. after a retried call, the latest
+    response is the one read back.
+
+    Parameters
+    ----------
+    archive_path : str
+        Full file path of the archive file.
+    mode : str, optional
+        'r' to open an existing archive for reading, or 'a' to create or append to it.
+        The default is 'r'.
+    """
+
+    def __init__(self, archive_path, mode='r'):
+        self.archive_path = archive_path
+        self.index_path = archive_path + '.idx'
+        self.mode = mode
+        self.index = {}
+        complete_length = 0
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'rb') as f:
+                index_text = f.read().decode('ascii')
+            # the text after the last newline is a partially written line left by an interrupted run
+            complete_length = index_text.rfind('\n') + 1
+            for line in index_text[:complete_length].splitlines():
+                prop_id, offset, length = line.split('\t')
+                self.index[prop_id] = (int(offset), int(length))
+        self._mapped = None
+        if mode == 'a':
+            self._archive_file = open(archive_path, 'ab+')
+            self._index_file = open(self.index_path, 'a')
+            self._index_file.truncate(complete_length)
+        else:
+            self._archive_file = open(archive_path, 'rb')
+            self._index_file = None
+            # read-only archives are memory mapped so reads decompress straight from the page cache
+            if os.path.getsize(archive_path) > 0:
+                self._mapped = mmap.mmap(self._archive_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, prop_id):
+        return str(prop_id) in self.index
+
+    def __iter__(self):
+        """Stream (prop_id, response text) tuples in archive file order."""
+        for prop_id, (offset, length) in sorted(self.index.items(), key=lambda item: item[1][0]):
+            yield prop_id, self._read_at(offset, length)
+
+    def prop_ids(self):
+        """Return the archived CoStar Property IDs in archive file order."""
+        return [prop_id for prop_id, _ in sorted(self.index.items(), key=lambda item: item[1][0])]
+
+    def append(self, prop_id, response_text):
+        """Compress and append the response for a single property, then index it."""
+        compressed = zlib.compress(response_text.encode('utf-8'))
+        self._archive_file.seek(0, os.SEEK_END)
+        offset = self._archive_file.tell()
+        self._archive_file.write(compressed)
+        self._archive_file.flush()
+        self._index_file.write(f'{prop_id}\t{offset}\t{len(compressed)}\n')
+        self._index_file.flush()
+        self.index[str(prop_id)] = (offset, len(compressed))
+
+    def read(self, prop_id):
+        """Return the latest archived response text for a single property."""
+        return self.read_bytes(prop_id).decode('utf-8')
+
+    def read_bytes(self, prop_id):
+        """Return the latest archived response for a single property as UTF-8 encoded bytes."""
+        offset, length = self.index[str(prop_id)]
+        return self._read_bytes_at(offset, length)
+
+    def _read_at(self, offset, length):
+        return self._read_bytes_at(offset, length).decode('utf-8')
+
+    def _read_bytes_at(self, offset, length):
+        if self._mapped is not None:
+            with memoryview(self._mapped) as view:
+                return zlib.decompress(view[offset:offset+length])
+        self._archive_file.seek(offset)
+        return zlib.decompress(self._archive_file.read(length))
+
+    def close(self):
+        if self._mapped is not None:
+            self._mapped.close()
+        self._archive_file.close()
+        if self._index_file is not None:
+            self._index_file.close()
+
+
+def read_archived_response_into_record(archive, prop_id):
+    """
+    Parse the archived call response for a single property into a dictionary record.
+
+    Parameters
+    ----------
+    archive : ResponseArchive
+        Archive holding the call responses of the run.
+    prop_id : str
+        The unique CoStar Property ID for a single property.
+
+    Returns
+    -------
+    record : dict
+        Dictionary of column name: value for the property.
+
+    Raises
+    ------
+    ValueError
+        If the archived response errored/is empty.
+
+    """
+    return parse_response_into_record(prop_id, json_loads(archive.read_bytes(prop_id)))
+
+
+# Archives opened once per parallel parse worker process by open_worker_archive, keyed by archive path.
+worker_archives = {}
+
+
+def open_worker_archive(archive_path):
+    """
+    Open the archive read by a parallel parse worker process once for all of its chunks,
+    instead of re-reading the archive index for every chunk. Used as the process pool initializer.
+
+    Parameters
+    ----------
+    archive_path : str
+        Full file path of the archive file.
+
+    Returns
+    -------
+    None.
+
+    """
+    worker_archives[archive_path] = ResponseArchive(archive_path)
+
+
+def read_archive_chunk_into_records(archive_path, prop_id_chunk):
+    """
+    Parse the archived call responses of a chunk of properties into dictionary records.
+    Used as the unit of work for each process in the parallel parse stage.
+
+    Parameters
+    ----------
+    archive_path : str
+        Full file path of the archive file.
+    prop_id_chunk : list of str
+        CoStar Property IDs to parse.
+
+    Returns
+    -------
+    records : list of dict or None
+        One record per property in the order of prop_id_chunk. Responses that could not be
+        parsed (ValueError) are returned as None so the parent process can retry the call.
+
+    """
+    if archive_path not in worker_archives:
+        with ResponseArchive(archive_path) as archive:
+            return read_archived_responses_into_records(archive, prop_id_chunk)
+    return read_archived_responses_into_records(worker_archives[archive_path], prop_id_chunk)
+
+
+def read_archived_responses_into_records(archive, prop_ids):
+    """
+    Parse the archived call responses of a list of properties into dictionary records.
+
+    Parameters
+    ----------
+    archive : ResponseArchive
+        Archive holding the call responses of the run.
+    prop_ids : list of str
+        CoStar Property IDs to parse.
+
+    Returns
+    -------
+    records : list of dict or None
+        One record per property in the order of prop_ids, with None for responses that
+        could not be parsed (ValueError).
+
+    """
+    records = []
+    for prop_id in prop_ids:
+        try:
+            records.append(read_archived_response_into_record(archive, prop_id))
+        except ValueError:
+            records.append(None)
+    return records
+
+
+def read_call_response_chunk_into_records(file_chunk):
+    """
+    Parse a chunk of call response .txt files into dictionary records. Used as the
+    unit of work for each process in the parallel parse stage.
+
+    Parameters
+    ----------
+    file_chunk : list of strings
+        Full file paths to .txt files containing CoStar API responses.
+
+    Returns
+    -------
+    records : list of dict or None
+        One record per file in the order of file_chunk. Files whose response could not be
+        parsed (ValueError) are returned as None so the parent process can retry the call.
+
+    """
+    records = []
+    for file in file_chunk:
+        try:
+            records.append(read_call_response_into_record(file))
+        except ValueError:
+            records.append(None)
+    return records
+
+
+def parse_files(json_file_list, cookies_dict, parallel=False, max_workers=None, chunk_size=100):
+    """
+    Parse call response .txt files into dictionary records, then retry the calls of
+    responses that errored together and overwrite their files with the new responses.
+
+    Parameters
+    ----------
+    json_file_list : list of strings
+        Full file paths to .txt files containing CoStar API responses.
+    cookies_dict : dict
+        Dictionary of the name: value of each cookie assigned to the webdriver post-login.
+    parallel : bool, optional
+        Boolean indicator of whether to parse the files across a pool of processes.
+        The default is False.
+    max_workers : int, optional
+        Number of worker processes used when parallel is True. The default is None.
+    chunk_size : int, optional
+        Number of files handed to a worker process at a time. The default is 100.
+
+    Returns
+    -------
+    records : list of dict or None
+        One record per file, in the same order as json_file_list, or None for a property
+        whose call could not be recovered by retrying.
+
+    """
+    if parallel:
+        records = parse_files_in_parallel(json_file_list, max_workers, chunk_size)
+    else:
+        records = read_call_response_chunk_into_records(json_file_list)
+    prop_ids = [file.split('\\')[1].split('_')[0] for file in json_file_list]
+    files_by_prop_id = dict(zip(prop_ids, json_file_list))
+
+    def overwrite_response_file(prop_id, response_text):
+        with open(files_by_prop_id[prop_id], 'w+') as f:
+            f.write(response_text)
+            f.close()
+
+    return retry_failed_records(records, prop_ids, cookies_dict, overwrite_response_file)
+
+
+def parse_files_in_parallel(json_file_list, max_workers=None, chunk_size=100):
+    """
+    Parse call response .txt files across a pool of processes.
+
+    Parameters
+    ----------
+    json_file_list : list of strings
+        Full file paths to .txt files containing CoStar API responses.
+    max_workers : int, optional
+        Number of worker processes. The default is None, in which case the number of
+        processors on the machine is used.
+    chunk_size : int, optional
+        Number of files handed to a worker process at a time. The default is 100.
+
+    Returns
+    -------
+    records : list of dict or None
+        One record per file, in the same order as json_file_list, or None for a file whose
+        response could not be parsed.
+
+    """
+    file_chunks = [json_file_list[i:i+chunk_size] for i in range(0, len(json_file_list), chunk_size)]
+    records = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        # executor.map yields chunk results in submission order, keeping row order deterministic
+        for chunk_records in executor.map(read_call_response_chunk_into_records, file_chunks):
+            records.extend(chunk_records)
+    return records
+
+
+def snapshot_column_types(col):
+    """
+    Look up the Arrow and nullable pandas types of a compiled DataFrame column from its SQL type.
+
+    Parameters
+    ----------
+    col : str
+        Column name in PROPERTY_COLUMNS.
+
+    Returns
+    -------
+    arrow_type : pyarrow DataType
+        Arrow type of the column in the snapshot schema.
+    pandas_dtype : str
+        Nullable pandas dtype of the column.
+
+    """
+    sql_type = get_sql_dtypes()[col]
+    sql_type = sql_type if isinstance(sql_type, type) else type(sql_type)
+    for generic_type, arrow_type, pandas_dtype in get_snapshot_types():
+        if issubclass(sql_type, generic_type):
+            return arrow_type, pandas_dtype
+    raise TypeError(f'No snapshot type for SQL type {sql_type.__name__} of column {col}.')
+
+
+def get_snapshot_schema():
+    """
+    Build the explicit Arrow schema of a compiled DataFrame snapshot from the SQL table types.
+
+    Returns
+    -------
+    pyarrow Schema
+        Schema with one field per column in PROPERTY_COLUMNS.
+
+    """
+    import pyarrow as pa
+    return pa.schema([(col, snapshot_column_types(col)[0]) for col in PROPERTY_COLUMNS])
+
+
+def convert_snapshot_types(df):
+    """
+    Convert every column of the compiled DataFrame to the nullable pandas type matching its SQL type.
+
+    Parameters
+    ----------
+    df : Pandas DataFrame
+        DataFrame of parsed property records.
+
+    Returns
+    -------
+    df : Pandas DataFrame
+        Copy of the DataFrame with currency, percentage and count strings converted as in
+        convert_df_types and the remaining columns cast to their snapshot types.
+
+    """
+    df = convert_df_types(df[PROPERTY_COLUMNS])
+    for col in PROPERTY_COLUMNS:
+        if col in NUMERIC_COLUMN_DTYPES:
+            continue
+        pandas_dtype = snapshot_column_types(col)[1]
+        if pandas_dtype == 'string':
+            df[col] = df[col].astype('string')
+        else:
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype('Float64').astype(pandas_dtype)
+    return df
+
+
+def write_snapshot(df, path, sort_by_property=False, row_group_size=None):
+    """
+    Save the compiled DataFrame as a typed Parquet snapshot.
+
+    Parameters
+    ----------
+    df : Pandas DataFrame
+        DataFrame of parsed property records.
+    path : str
+        Full file path of the .parquet file to write.
+    sort_by_property : bool, optional
+        Boolean indicator of whether to sort the rows by CoStarPropertyID so row group
+        statistics let readers skip row groups when filtering by property. The default
+        is False.
+    row_group_size : int, optional
+        Maximum number of rows per row group. The default is None, the pyarrow default.
+
+    Returns
+    -------
+    None.
+
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    snapshot_df = convert_snapshot_types(df)
+    if sort_by_property:
+        snapshot_df = snapshot_df.sort_values('CoStarPropertyID', ignore_index=True)
+    table = pa.Table.from_pandas(snapshot_df, schema=get_snapshot_schema(), preserve_index=False)
+    pq.write_table(table, path, row_group_size=row_group_size)
+    return
+
+
+def read_snapshot(path, columns=None, filters=None):
+    """
+    Read a typed Parquet snapshot written by write_snapshot.
+
+    Parameters
+    ----------
+    path : str
+        Full file path of the .parquet file.
+    columns : list of str, optional
+        Columns to read. The default is None, in which case all columns are read.
+    filters : list of tuple, optional
+        Row filters in pyarrow.parquet.read_table format, e.g. [('State', '=', 'CO')].
+        The default is None.
+
+    Returns
+    -------
+    Pandas DataFrame
+        Snapshot data with nullable pandas dtypes.
+
+    """
+    import pyarrow.parquet as pq
+    table = pq.read_table(path, columns=columns, filters=filters)
+    return table.to_pandas(types_mapper=get_snapshot_pandas_types().get)
+
+
+def get_snapshot_partition_path(store_dir, collected_date):
+    """
+    Build the path of the snapshot store partition for a single collection date.
+
+    Parameters
+    ----------
+    store_dir : str
+        Root directory of the snapshot store.
+    collected_date : datetime.date
+        Date the snapshot was collected.
+
+    Returns
+    -------
+    str
+        Full file path of the partition's .parquet file.
+
+    """
+    return os.path.join(store_dir, f'collected_date={collected_date.isoformat()}', 'snapshot.parquet')
+
+
+def list_snapshot_dates(store_dir):
+    """
+    List the collection dates held in the snapshot store from the partition directory names.
+
+    Parameters
+    ----------
+    store_dir : str
+        Root directory of the snapshot store.
+
+    Returns
+    -------
+    list of datetime.date
+        Collection dates of every stored snapshot in ascending order.
+
+    """
+    if not os.path.isdir(store_dir):
+        return []
+    dates = []
+    for name in os.listdir(store_dir):
+        if name.startswith('collected_date=') and os.path.exists(os.path.join(store_dir, name, 'snapshot.parquet')):
+            dates.append(datetime.date.fromisoformat(name[len('collected_date='):]))
+    return sorted(dates)
+
+
+def store_snapshot(df, store_dir, collected_date=None):
+    """
+    Save the compiled DataFrame of a run as the snapshot store partition for its collection
+    date, replacing any snapshot already stored for that date.
 
     Parameters
     ----------
     df : Pandas DataFrame
-        DataFrame containing target data element values for all property API responses already
-        processed from the current scrape. The single property whose call is recorded in the
-        .txt file specified by the file variable will be appended to this dataframe.
-    file : str
-        Full file path to .txt file containing CoStar API response for a single property.
+        DataFrame of parsed property records.
+    store_dir : str
+        Root directory of the snapshot store.
+    collected_date : datetime.date, optional
+        Date the snapshot was collected. The default is None, in which case today's date is used.
+
+    Returns
+    -------
+    path : str
+        Full file path of the partition's .parquet file.
+
+    """
+    if collected_date is None:
+        collected_date = datetime.date.today()
+    path = get_snapshot_partition_path(store_dir, collected_date)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_snapshot(df, path, sort_by_property=True, row_group_size=SNAPSHOT_ROW_GROUP_SIZE)
+    return path
+
+
+def merge_shard_snapshots(snapshot_dir, shard_count):
+    """
+    Combine the partial snapshots of every shard of a sharded run into one DataFrame.
+
+    Parameters
+    ----------
+    snapshot_dir : str
+        Directory holding the partial snapshot of each shard, named by
+        get_shard_snapshot_name. The Parquet snapshot is read when a shard has both.
+    shard_count : int
+        Number of shards the properties were partitioned into.
+
+    Raises
+    ------
+    FileNotFoundError
+        If any shard has no partial snapshot, listing the shards to rerun.
+    ValueError
+        If a partial snapshot holds properties assigned to another shard, e.g. one left
+        over from a run with a different shard count.
+
+    Returns
+    -------
+    df : Pandas DataFrame
+        The records of every shard, sorted by CoStarPropertyID.
+
+    """
+    frames = []
+    missing_shards = []
+    for shard_index in range(shard_count):
+        path = os.path.join(snapshot_dir, get_shard_snapshot_name(shard_index, shard_count))
+        if os.path.exists(path + '.parquet'):
+            shard_df = read_snapshot(path + '.parquet')
+        elif os.path.exists(path + '.csv'):
+            shard_df = pd.read_csv(path + '.csv')
+        else:
+            missing_shards.append(shard_index)
+            continue
+        misplaced = sum(get_property_shard(prop_id, shard_count) != shard_index
+                        for prop_id in shard_df['CoStarPropertyID'])
+        if misplaced:
+            raise ValueError(f'Snapshot of shard {shard_index} holds {misplaced} properties of other shards.')
+        frames.append(shard_df)
+    if missing_shards:
+        raise FileNotFoundError(f'No snapshot of shards {missing_shards} of {shard_count} in {snapshot_dir}. '
+                                'Rerun them before merging.')
+    df = pd.concat(frames, ignore_index=True).sort_values('CoStarPropertyID', ignore_index=True)
+    print(f'Merged {len(df)} properties from {shard_count} shard snapshots.')
+    return df
+
+
+def property_id_filters(prop_ids):
+    """
+    Build a Parquet row filter selecting a list of properties.
+
+    Parameters
+    ----------
+    prop_ids : iterable of int or str, optional
+        CoStar Property IDs to select, or None to select every property.
+
+    Returns
+    -------
+    list of tuple or None
+        Filter in pyarrow.parquet.read_table format.
+
+    """
+    if prop_ids is None:
+        return None
+    return [('CoStarPropertyID', 'in', [int(prop_id) for prop_id in prop_ids])]
+
+
+def read_snapshot_as_of(store_dir, as_of_date, columns=None, prop_ids=None):
+    """
+    Read the most recent stored snapshot collected on or before a date.
+
+    Parameters
+    ----------
+    store_dir : str
+        Root directory of the snapshot store.
+    as_of_date : datetime.date
+        Latest collection date to return.
+    columns : list of str, optional
+        Columns to read. The default is None, in which case all columns are read.
+    prop_ids : iterable of int or str, optional
+        CoStar Property IDs to read. The default is None, in which case every property is read.
+
+    Returns
+    -------
+    Pandas DataFrame
+        Snapshot data with a CollectedDate column, or None if no snapshot was collected
+        on or before as_of_date.
+
+    """
+    dates = [collected_date for collected_date in list_snapshot_dates(store_dir) if collected_date <= as_of_date]
+    if not dates:
+        return None
+    df = read_snapshot(get_snapshot_partition_path(store_dir, dates[-1]), columns, property_id_filters(prop_ids))
+    return df.assign(CollectedDate=dates[-1])
+
+
+def read_rent_time_series(store_dir, prop_ids, start_date=None, end_date=None, columns=None):
+    """
+    Read the rent history of a set of properties across the stored snapshots.
+
+    Only partitions between start_date and end_date are opened, only the requested columns
+    are read, and the property filter skips row groups that cannot contain the properties.
+
+    Parameters
+    ----------
+    store_dir : str
+        Root directory of the snapshot store.
+    prop_ids : iterable of int or str
+        CoStar Property IDs to read.
+    start_date : datetime.date, optional
+        Earliest collection date to read. The default is None, no lower bound.
+    end_date : datetime.date, optional
+        Latest collection date to read. The default is None, no upper bound.
+    columns : list of str, optional
+        Metric columns to read. The default is None, in which case RENT_COLUMNS are read.
+
+    Returns
+    -------
+    Pandas DataFrame
+        One row per property per collection date with CollectedDate, CoStarPropertyID and
+        the requested columns, sorted by property and date.
+
+    """
+    if columns is None:
+        columns = RENT_COLUMNS
+    columns = ['CoStarPropertyID'] + [col for col in columns if col != 'CoStarPropertyID']
+    filters = property_id_filters(prop_ids)
+    frames = []
+    for collected_date in list_snapshot_dates(store_dir):
+        if (start_date is not None and collected_date < start_date) or (end_date is not None and collected_date > end_date):
+            continue
+        df = read_snapshot(get_snapshot_partition_path(store_dir, collected_date), columns, filters)
+        frames.append(df.assign(CollectedDate=collected_date))
+    if not frames:
+        return pd.DataFrame(columns=['CollectedDate'] + columns)
+    df = pd.concat(frames, ignore_index=True)
+    df = df[['CollectedDate'] + columns].sort_values(['CoStarPropertyID', 'CollectedDate'], ignore_index=True)
+    return df
+
+
+def parse_archive(archive_path, cookies_dict, parallel=False, max_workers=None, chunk_size=100, prop_ids=None):
+    """
+    Parse every response in a ResponseArchive into dictionary records in archive order.
+
+    Parameters
+    ----------
+    archive_path : str
+        Full file path of the archive file.
+    cookies_dict : dict
+        Dictionary of the name: value of each cookie assigned to the webdriver post-login.
+    parallel : bool, optional
+        Boolean indicator of whether to parse the responses across a pool of processes.
+        The default is False.
+    max_workers : int, optional
+        Number of worker processes used when parallel is True. The default is None.
+    chunk_size : int, optional
+        Number of responses handed to a worker process at a time. The default is 100.
+    prop_ids : list of str, optional
+        CoStar Property IDs to parse. The default is None, in which case every archived
+        property is parsed.
+
+    Returns
+    -------
+    records : list of dict or None
+        One record per archived property, in archive order or the order of prop_ids, or
+        None for a property whose call could not be recovered by retrying.
+
+    """
+    if prop_ids is None:
+        with ResponseArchive(archive_path) as archive:
+            prop_ids = archive.prop_ids()
+    if parallel:
+        prop_id_chunks = [prop_ids[i:i+chunk_size] for i in range(0, len(prop_ids), chunk_size)]
+        records = []
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=open_worker_archive,
+                                 initargs=(archive_path,)) as executor:
+            for chunk_records in executor.map(read_archive_chunk_into_records,
+                                              [archive_path] * len(prop_id_chunks), prop_id_chunks):
+                records.extend(chunk_records)
+    else:
+        records = read_archive_chunk_into_records(archive_path, prop_ids)
+    if any(record is None for record in records):
+        with ResponseArchive(archive_path, mode='a') as archive:
+            retry_failed_records(records, prop_ids, cookies_dict, archive.append)
+    return records
+
+
+class ParseCache:
+    """
+    Persistent SQLite cache of parsed property records keyed by CoStar Property ID and a
+    hash of the response body the record was parsed from.
+
+    Entries older than max_age_days are evicted, then the least recently used entries
+    beyond max_entries, when the cache is closed. The cache stores a hash of the extraction
+    schema and is emptied when it is opened under a different COLUMN_EXTRACTION_SPEC,
+    transform code or PROPERTY_COLUMNS, so records parsed by an older schema are never returned.
+
+    Parameters
+    ----------
+    cache_path : str
+        Full file path of the SQLite cache database.
+    max_entries : int, optional
+        Maximum number of cached records. The default is None, no limit.
+    max_age_days : float, optional
+        Maximum age in days of a cached record. The default is 30.
+    """
+
+    def __init__(self, cache_path, max_entries=None, max_age_days=30):
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.hits = 0
+        self._used = []
+        self._connection = sqlite3.connect(cache_path)
+        self._connection.execute('CREATE TABLE IF NOT EXISTS parse_cache ('
+                                 'prop_id TEXT PRIMARY KEY, body_hash TEXT, record TEXT, '
+                                 'cached_at REAL, last_used REAL)')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS parse_cache_meta (key TEXT PRIMARY KEY, value TEXT)')
+        schema_hash = hash_extraction_schema()
+        row = self._connection.execute("SELECT value FROM parse_cache_meta WHERE key = 'schema_hash'").fetchone()
+        if row is None or row[0] != schema_hash:
+            self._connection.execute('DELETE FROM parse_cache')
+            self._connection.execute("INSERT OR REPLACE INTO parse_cache_meta VALUES ('schema_hash', ?)", (schema_hash,))
+            self._connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def get(self, prop_id, body_hash):
+        """Return the cached record if it was parsed from the same response body, otherwise None."""
+        row = self._connection.execute('SELECT record FROM parse_cache WHERE prop_id = ? AND body_hash = ?',
+                                       (str(prop_id), body_hash)).fetchone()
+        if row is None:
+            return None
+        self.hits += 1
+        self._used.append(str(prop_id))
+        return json.loads(row[0])
+
+    def put(self, prop_id, body_hash, record):
+        """Cache the record parsed from a response body, replacing the property's previous entry."""
+        now = time.time()
+        self._connection.execute('INSERT OR REPLACE INTO parse_cache VALUES (?, ?, ?, ?, ?)',
+                                 (str(prop_id), body_hash, json.dumps(record), now, now))
+
+    def evict(self):
+        """Delete expired entries, then the least recently used entries beyond max_entries."""
+        now = time.time()
+        self._connection.executemany('UPDATE parse_cache SET last_used = ? WHERE prop_id = ?',
+                                     [(now, prop_id) for prop_id in self._used])
+        self._used = []
+        if self.max_age_days is not None:
+            self._connection.execute('DELETE FROM parse_cache WHERE cached_at < ?',
+                                     (now - self.max_age_days * 86400,))
+        if self.max_entries is not None:
+            self._connection.execute('DELETE FROM parse_cache WHERE prop_id NOT IN '
+                                     '(SELECT prop_id FROM parse_cache ORDER BY last_used DESC LIMIT ?)',
+                                     (self.max_entries,))
+
+    def close(self):
+        self.evict()
+        self._connection.commit()
+        self._connection.close()
+
+
+def hash_response_body(body):
+    """
+    Hash a call response body for change detection.
+
+    Parameters
+    ----------
+    body : bytes
+        Raw call response.
+
+    Returns
+    -------
+    str
+        Hex digest of the body.
+
+    """
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+def get_code_fingerprint(code):
+    """
+    Describe the bytecode, constants and names of a compiled function body, so that a change
+    to the body of a transform changes its fingerprint.
+
+    Parameters
+    ----------
+    code : code object
+        The __code__ of a function.
+
+    Returns
+    -------
+    list
+        Hex of the bytecode, repr of each constant (nested code objects described in turn),
+        and the global and attribute names used.
+
+    """
+    consts = [get_code_fingerprint(const) if isinstance(const, type(code)) else repr(const)
+              for const in code.co_consts]
+    return [code.co_code.hex(), consts, list(code.co_names)]
+
+
+def hash_extraction_schema():
+    """
+    Hash the column extraction spec and output columns that parsed records depend on.
+
+    Returns
+    -------
+    str
+        Hex digest of COLUMN_EXTRACTION_SPEC, with transforms identified by name and code
+        fingerprint, and PROPERTY_COLUMNS.
+
+    """
+    spec = [[column, operation, path, mapped,
+             None if transform is None else [transform.__name__, get_code_fingerprint(transform.__code__)]]
+            for column, (operation, path, transform, mapped) in COLUMN_EXTRACTION_SPEC.items()]
+    schema = json.dumps([spec, PROPERTY_COLUMNS]).encode()
+    return hashlib.blake2b(schema, digest_size=16).hexdigest()
+
+
+def hash_response_files(json_file_list):
+    """
+    Hash the response body saved in each call response .txt file.
+
+    Parameters
+    ----------
+    json_file_list : list of strings
+        Full file paths to .txt files containing CoStar API responses.
+
+    Returns
+    -------
+    list of str
+        Hex digest of each file's contents, in the order of json_file_list.
+
+    """
+    hashes = []
+    for file in json_file_list:
+        with open(file, 'rb') as f:
+            hashes.append(hash_response_body(f.read()))
+    return hashes
+
+
+def hash_archived_responses(archive_path, prop_ids):
+    """
+    Hash the latest archived response body of each property in a ResponseArchive.
+
+    Parameters
+    ----------
+    archive_path : str
+        Full file path of the archive file.
+    prop_ids : list of str
+        CoStar Property IDs to hash.
+
+    Returns
+    -------
+    list of str
+        Hex digest of each property's response, in the order of prop_ids.
+
+    """
+    with ResponseArchive(archive_path) as archive:
+        return [hash_response_body(archive.read_bytes(prop_id)) for prop_id in prop_ids]
+
+
+def parse_with_cache(keys, prop_ids, hash_bodies, parse_subset, cache):
+    """
+    Reuse cached records for responses whose body is unchanged and parse the rest.
+
+    Parameters
+    ----------
+    keys : list
+        Locations of the responses to parse, e.g. .txt file paths or archived property IDs.
+    prop_ids : list of str
+        CoStar Property ID of each response in keys.
+    hash_bodies : function
+        Function returning the body hash of each response in a list of keys.
+    parse_subset : function
+        Function returning the parsed record of each response in a list of keys.
+    cache : ParseCache
+        Cache of previously parsed records.
+
+    Returns
+    -------
+    records : list of dict
+        One record per response, in the order of keys.
+
+    """
+    records = [cache.get(prop_id, body_hash) for prop_id, body_hash in zip(prop_ids, hash_bodies(keys))]
+    missed = [index for index, record in enumerate(records) if record is None]
+    missed_keys = [keys[index] for index in missed]
+    parsed = parse_subset(missed_keys)
+    # hash after parsing, since errored responses are replaced by their retried call
+    for index, record, body_hash in zip(missed, parsed, hash_bodies(missed_keys)):
+        records[index] = record
+        if record is not None:
+            cache.put(prop_ids[index], body_hash, record)
+    print(f'Reused {len(keys)-len(missed)} of {len(keys)} records from the parse cache.')
+    return records
+
+
+class WorkLedger:
+    """
+    Persistent SQLite ledger of the fetch, parse and load state of each property in a run,
+    so that a restarted run only does the remaining work.
+
+    Each property moves through the stages 'pending', 'fetched', 'parsed' and 'loaded'.
+    The parsed record is kept with the property so a restarted run does not parse it again.
+    Every change is committed immediately.
+
+    The id of the run in progress is stored in the ledger when the run starts and reused
+    until the run is finished, so a run restarted after midnight resumes instead of
+    starting over under a new date. Like ParseCache, the ledger stores a hash of the
+    extraction schema, and properties parsed under a different schema are moved back to
+    'fetched' so they are parsed again.
+
+    Parameters
+    ----------
+    ledger_path : str
+        Full file path of the SQLite ledger database.
+    run_id : str, optional
+        Identifier of the run. The default is None, in which case the run in progress in
+        the ledger is resumed, or a new run is started under today's date, matching the
+        date in the response file names.
+    """
+
+    def __init__(self, ledger_path, run_id=None):
+        self._connection = sqlite3.connect(ledger_path)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS work_ledger ('
+                                 'run_id TEXT, prop_id TEXT, stage TEXT, record TEXT, updated_at REAL, '
+                                 'PRIMARY KEY (run_id, prop_id))')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS ledger_runs (run_id TEXT PRIMARY KEY, started_at REAL)')
+        if run_id is None:
+            row = self._connection.execute('SELECT run_id FROM ledger_runs ORDER BY started_at DESC LIMIT 1').fetchone()
+            if row is None:
+                # ledgers written before runs were recorded
+                row = self._connection.execute('SELECT run_id FROM work_ledger ORDER BY updated_at DESC LIMIT 1').fetchone()
+            run_id = datetime.datetime.today().strftime("%m.%d.%Y") if row is None else row[0]
+        self.run_id = run_id
+        with self._connection:
+            self._connection.execute('INSERT OR IGNORE INTO ledger_runs VALUES (?, ?)', (self.run_id, time.time()))
+        self._connection.execute('CREATE TABLE IF NOT EXISTS ledger_meta (key TEXT PRIMARY KEY, value TEXT)')
+        schema_hash = hash_extraction_schema()
+        row = self._connection.execute("SELECT value FROM ledger_meta WHERE key = 'schema_hash'").fetchone()
+        if row is None or row[0] != schema_hash:
+            with self._connection:
+                self._connection.execute("UPDATE work_ledger SET stage = 'fetched', record = NULL WHERE stage = 'parsed'")
+                self._connection.execute("INSERT OR REPLACE INTO ledger_meta VALUES ('schema_hash', ?)", (schema_hash,))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def register(self, prop_ids):
+        """Add the properties of the run as pending, keeping the stage of those already registered."""
+        with self._connection:
+            self._connection.executemany('INSERT OR IGNORE INTO work_ledger VALUES (?, ?, ?, NULL, ?)',
+                                         [(self.run_id, str(prop_id), 'pending', time.time()) for prop_id in prop_ids])
+
+    def prop_ids(self, *stages):
+        """Return the set of property IDs of the run currently in any of the given stages."""
+        rows = self._connection.execute(f'SELECT prop_id FROM work_ledger WHERE run_id = ? AND stage IN '
+                                        f'({", ".join("?" * len(stages))})', (self.run_id, *stages))
+        return {prop_id for prop_id, in rows}
+
+    def mark(self, prop_ids, stage):
+        """Move the properties to a stage, registering any not yet in the ledger."""
+        now = time.time()
+        with self._connection:
+            self._connection.executemany('INSERT INTO work_ledger VALUES (?, ?, ?, NULL, ?) '
+                                         'ON CONFLICT (run_id, prop_id) DO UPDATE SET stage = excluded.stage, '
+                                         'updated_at = excluded.updated_at',
+                                         [(self.run_id, str(prop_id), stage, now) for prop_id in prop_ids])
+
+    def put_records(self, prop_ids, records):
+        """Mark the properties parsed and keep their parsed records."""
+        now = time.time()
+        with self._connection:
+            self._connection.executemany('INSERT OR REPLACE INTO work_ledger VALUES (?, ?, ?, ?, ?)',
+                                         [(self.run_id, str(prop_id), 'parsed', json.dumps(record), now)
+                                          for prop_id, record in zip(prop_ids, records)])
+
+    def get_records(self):
+        """Return a dictionary of property ID: parsed record for every parsed or loaded property of the run."""
+        rows = self._connection.execute("SELECT prop_id, record FROM work_ledger WHERE run_id = ? "
+                                        "AND stage IN ('parsed', 'loaded')", (self.run_id,))
+        return {prop_id: json.loads(record) for prop_id, record in rows}
+
+    def finish(self):
+        """Delete the run from the ledger once all of its work is done."""
+        with self._connection:
+            self._connection.execute('DELETE FROM work_ledger WHERE run_id = ?', (self.run_id,))
+            self._connection.execute('DELETE FROM ledger_runs WHERE run_id = ?', (self.run_id,))
+
+    def close(self):
+        self._connection.close()
+
+
+def parse_with_ledger(keys, prop_ids, parse_keys, ledger):
+    """
+    Reuse the records of responses already parsed earlier in the run and parse the rest,
+    recording them in the work ledger.
+
+    Parameters
+    ----------
+    keys : list
+        Locations of the responses to parse, e.g. .txt file paths or archived property IDs.
+    prop_ids : list of str
+        CoStar Property ID of each response in keys.
+    parse_keys : function
+        Function of (keys, prop_ids) returning the parsed record of each response.
+    ledger : WorkLedger
+        Work ledger of the run.
+
+    Returns
+    -------
+    records : list of dict
+        One record per response, in the order of keys.
+
+    """
+    ledger_records = ledger.get_records()
+    records = [ledger_records.get(str(prop_id)) for prop_id in prop_ids]
+    remaining = [index for index, record in enumerate(records) if record is None]
+    remaining_prop_ids = [prop_ids[index] for index in remaining]
+    parsed = parse_keys([keys[index] for index in remaining], remaining_prop_ids)
+    parsed_prop_ids = [prop_id for prop_id, record in zip(remaining_prop_ids, parsed) if record is not None]
+    ledger.put_records(parsed_prop_ids, [record for record in parsed if record is not None])
+    for index, record in zip(remaining, parsed):
+        records[index] = record
+    print(f'Reused {len(keys)-len(remaining)} of {len(keys)} records parsed earlier in the run.')
+    return records
+
+
+@traced('parse')
+def parse_responses(cookies_dict, parallel=False, max_workers=None, chunk_size=100, archive_path=None,
+                    snapshot_format='csv', parse_cache_path=None, ledger_path=None, shard_index=None,
+                    shard_count=None):
+    """
+    Collect all JSON responses logged in .txt files and collect the data into a
+    Pandas DataFrame.
+
+    Parameters
+    ----------
     cookies_dict : dict
         Dictionary of the name: value of each cookie assigned to the webdriver post-login.
+    parallel : bool, optional
+        Boolean indicator of whether to parse the files across a pool of processes.
+        The default is False.
+    max_workers : int, optional
+        Number of worker processes used when parallel is True. The default is None, in
+        which case the number of processors on the machine is used.
+    chunk_size : int, optional
+        Number of files handed to a worker process at a time when parallel is True.
+        The default is 100.
+    archive_path : str, optional
+        Full file path of a ResponseArchive to read the responses from. The default is None,
+        in which case the .txt files in the working directory are read.
+    snapshot_format : str, optional
+        Format the compiled DataFrame is saved in: 'csv', 'parquet' or 'both'. The default
+        is 'csv'.
+    parse_cache_path : str, optional
+        Full file path of a ParseCache database. Responses whose body is unchanged since
+        they were cached reuse the cached record instead of being parsed. The default is
+        None, in which case every response is parsed.
+    ledger_path : str, optional
+        Full file path of the run's WorkLedger database. Responses parsed earlier in the
+        run reuse their recorded record, and newly parsed records are recorded. The
+        default is None, in which case no ledger is kept.
+    shard_index : int, optional
+        Index of the shard to parse when the properties are split across hosts. Only the
+        responses of the shard's properties are parsed, and the partial snapshot is saved
+        under get_shard_snapshot_name instead of the date. The default is None, in which
+        case every response is parsed.
+    shard_count : int, optional
+        Number of shards the properties are partitioned into by get_property_shard. The
+        default is None.
+
+    Returns
+    -------
+    df : Pandas df
+        A dataframe containing the parsed property data, one row per response file.
+    json_file_list : list of strings
+        A list of all the .txt files read into the dataframe in the order they
+        were read, or the archive and index file paths when archive_path is given.
+    """
+
+    start = datetime.datetime.now()
+    if archive_path is not None:
+        with ResponseArchive(archive_path) as archive:
+            keys = archive.prop_ids()
+        prop_ids = keys
+        hash_bodies = functools.partial(hash_archived_responses, archive_path)
+        parse_subset = functools.partial(parse_archive, archive_path, cookies_dict, parallel, max_workers, chunk_size)
+        json_file_list = [archive_path, archive_path + '.idx']
+    else:
+        json_file_list = glob(os.path.abspath("*.txt"))
+        keys = json_file_list
+        prop_ids = [file.split('\\')[1].split('_')[0] for file in json_file_list]
+        hash_bodies = hash_response_files
+        parse_subset = functools.partial(parse_files, cookies_dict=cookies_dict, parallel=parallel,
+                                         max_workers=max_workers, chunk_size=chunk_size)
+    snapshot_name = f'{datetime.datetime.today().strftime("%m.%d.%Y")}_compiled_df'
+    if shard_count is not None:
+        shard = [index for index, prop_id in enumerate(prop_ids) if get_property_shard(prop_id, shard_count) == shard_index]
+        keys = [keys[index] for index in shard]
+        prop_ids = [prop_ids[index] for index in shard]
+        if archive_path is None:
+            json_file_list = keys
+        snapshot_name = get_shard_snapshot_name(shard_index, shard_count)
+    cache = None
+    if parse_cache_path is not None:
+        cache = ParseCache(parse_cache_path)
+        parse_keys = functools.partial(parse_with_cache, hash_bodies=hash_bodies, parse_subset=parse_subset, cache=cache)
+    else:
+        parse_keys = lambda keys, prop_ids: parse_subset(keys)
+    try:
+        if ledger_path is not None:
+            with WorkLedger(ledger_path) as ledger:
+                records = parse_with_ledger(keys, prop_ids, parse_keys, ledger)
+        else:
+            records = parse_keys(keys, prop_ids)
+    finally:
+        if cache is not None:
+            cache.close()
+    unrecovered = sum(record is None for record in records)
+    if unrecovered:
+        print(f'Dropped {unrecovered} properties whose call could not be recovered.')
+    run_metrics.increment('dropped_properties_total', unrecovered)
+    df = records_to_df([record for record in records if record is not None])
+    run_metrics.increment('parsed_records_total', len(df))
+    end = datetime.datetime.now()
+    print(f'Completed parsing into dataframe in {end-start}.')
+    if snapshot_format in ('csv', 'both'):
+        df.to_csv(os.path.abspath(f'{snapshot_name}.csv'), index=False)
+    if snapshot_format in ('parquet', 'both'):
+        write_snapshot(df, os.path.abspath(f'{snapshot_name}.parquet'))
+    return df, json_file_list
+
+
+def save_response(prop_id, response_text, archive=None, output_dir='C:/Users/RBurns/Documents'):
+    """
+    Save the call response for a single property to the run's archive or to a .txt file.
+
+    Parameters
+    ----------
+    prop_id : str
+        The unique CoStar Property ID for a single property.
+    response_text : str
+        Text of the CoStar API response.
+    archive : ResponseArchive, optional
+        Archive the response is appended to. The default is None, in which case the
+        response is written to its own .txt file.
+    output_dir : str, optional
+        Directory the .txt file is written to. The default is 'C:/Users/RBurns/Documents'.
+
+    Returns
+    -------
+    None.
+
+    """
+    if archive is not None:
+        archive.append(prop_id, response_text)
+    else:
+        with open(f'{output_dir}/{prop_id}_{datetime.datetime.today().strftime("%m.%d.%Y")}.txt', 'w+') as f:
+            f.write(response_text)
+            f.close()
+    return
+
+
+class SectionCache:
+    """
+    Persistent SQLite cache of the result of each payload operation (section) per property,
+    so only sections older than their time to live need to be requested again. Results are
+    keyed by the payload query selection as well, so results of the minimal queries are never
+    merged into a run requesting the full queries, or the reverse.
+
+    Parameters
+    ----------
+    cache_path : str
+        Full file path of the SQLite cache database.
+    ttls : dict, optional
+        Dictionary of operation name: datetime.timedelta a cached result stays fresh. The
+        default is None, in which case SECTION_TTLS is used.
+    query : str, optional
+        'minimal' or 'full', the payload query selection the cached results were requested
+        with. The default is None, in which case the selection set by set_payload_query is used.
+    """
+
+    def __init__(self, cache_path, ttls=None, query=None):
+        self.ttls = SECTION_TTLS if ttls is None else {**SECTION_TTLS, **ttls}
+        self.query = query if query is not None else 'full' if payload_full_query else 'minimal'
+        self._connection = sqlite3.connect(cache_path)
+        columns = [row[1] for row in self._connection.execute('PRAGMA table_info(section_cache)')]
+        if columns and 'query' not in columns:
+            # caches written before results were keyed by query selection cannot be attributed to one
+            self._connection.execute('DROP TABLE section_cache')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS section_cache ('
+                                 'prop_id TEXT, query TEXT, operation TEXT, result TEXT, fetched_at REAL, '
+                                 'PRIMARY KEY (prop_id, query, operation))')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def get_fresh(self, prop_id):
+        """Return a dictionary of operation name: JSON text of each cached result still within its TTL."""
+        now = time.time()
+        rows = self._connection.execute('SELECT operation, result, fetched_at FROM section_cache '
+                                        'WHERE prop_id = ? AND query = ?', (str(prop_id), self.query))
+        return {operation: result for operation, result, fetched_at in rows
+                if operation in self.ttls and now - fetched_at < self.ttls[operation].total_seconds()}
+
+    def put(self, prop_id, operation, result):
+        """Cache the JSON text of a freshly fetched operation result."""
+        self._connection.execute('INSERT OR REPLACE INTO section_cache VALUES (?, ?, ?, ?, ?)',
+                                 (str(prop_id), self.query, operation, result, time.time()))
+
+    def close(self):
+        self._connection.commit()
+        self._connection.close()
+
+
+def get_stale_operations(prop_id, section_cache):
+    """
+    Look up which payload operations need to be requested for a property.
+
+    Parameters
+    ----------
+    prop_id : str
+        The unique CoStar Property ID for a single property.
+    section_cache : SectionCache
+        Cache of previously fetched operation results.
 
     Returns
     -------
-    df : Pandas DataFrame
-        DataFrame containing the data for properties already parsed from .txt call response files
-        onto which the values in file have been concatenated.
-
-    """
-    s = Session()
-    headers = {
-        "Content-Type": "application/json",
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/97.0.4692.71 Safari/537.36",
-        "Accept-Encoding": "*",
-        "Connection": "keep-alive",
-        'origin': 'https://product.costar.com',
-        'x-requested-with': 'XMLHttpRequest'
-    }
-    s.headers.update(headers)
-    s.hooks['response'].append(print_url)
-    s.hooks['response'].append(print_status)
-    url = os.getenv('COSTAR_DB_URL')
-    prop_id = file.split('\\')[1].split('_')[0]
-    payload = get_payload(prop_id)
-    resp = s.post(url, data=payload, headers=headers, cookies=cookies_dict)
-    with open(file, 'w+') as f:
-        f.write(resp.text)
-        f.close()
-    df = read_call_response_into_df(df, file)
-    return df
+    operations : tuple of str
+        Operations without a fresh cached result, in PAYLOAD_OPERATIONS order.
+    cached_sections : dict
+        Dictionary of operation name: JSON text of each fresh cached result.
+
+    """
+    cached_sections = section_cache.get_fresh(prop_id)
+    operations = tuple(operation for operation in PAYLOAD_OPERATIONS if operation not in cached_sections)
+    return operations, cached_sections
 
 
-def set_roomtype_metric_values(unit_type, present_in_columns, prop_details_df):
+def merge_section_response(prop_id, response_text, operations, cached_sections, section_cache):
     """
-    Pack and return tuple containing metrics for a single type of apartment by number of bedrooms.
+    Cache the operation results of a partial response and merge them with the cached
+    results into a response holding every operation in PAYLOAD_OPERATIONS order.
 
     Parameters
     ----------
-    unit_type : str
-        String description of the apartment type by number of bedrooms.
-    present_in_columns : bool
-        Boolean indicator whether any metrics for the apartment bedroom type are present in prop_details_df.
-    prop_details_df : Pandas DataFrame
-        DataFrame representation of the property metrics table by apartment bedroom type and metric.
+    prop_id : str
+        The unique CoStar Property ID for a single property.
+    response_text : str
+        Text of the CoStar API response to the request for operations. Empty when every
+        operation was served from the cache.
+    operations : tuple of str
+        Operations requested, in the order of their results in response_text.
+    cached_sections : dict
+        Dictionary of operation name: JSON text of each fresh cached result.
+    section_cache : SectionCache
+        Cache the new operation results are saved to.
 
     Returns
     -------
-    unit_type_metrics_package : tuple
-        A tuple containing five average metric values measuring the specified apartment bedroom type.
+    str
+        Full response text, or response_text unchanged if it could not be decoded into one
+        result per requested operation, so that parsing retries the call.
 
     """
-    if unit_type == 'Studio':
-        if present_in_columns:
-            StudioAskingRentUnit_val = screen_nulls(prop_details_df.at['askingRentPerUnit', 'All Studios'])
-            StudioAvgSF_val = screen_nulls(prop_details_df.at['averageArea', 'All Studios'])
-            StudioEffectiveRentUnit_val = screen_nulls(prop_details_df.at['effectiveRentPerUnit', 'All Studios'])
-            NumberOfStudioUnits_val = screen_nulls(prop_details_df.at['unitMixBeds', 'All Studios'])
-            StudioConcessionsPercentage_val = screen_nulls(prop_details_df.at['concessions', 'All Studios'])
-        else:
-            StudioAskingRentUnit_val = np.nan
-            StudioAvgSF_val = np.nan
-            StudioEffectiveRentUnit_val = np.nan
-            NumberOfStudioUnits_val = np.nan
-            StudioConcessionsPercentage_val = np.nan
-        unit_type_metrics_package = (StudioAskingRentUnit_val,
-                                     StudioAvgSF_val,
-                                     StudioEffectiveRentUnit_val,
-                                     NumberOfStudioUnits_val,
-                                     StudioConcessionsPercentage_val)
-    elif unit_type == 'One Bed':
-        if present_in_columns:
-            OneBedroomAskingRentUnit_val = screen_nulls(prop_details_df.at['askingRentPerUnit', 'All 1 Beds'])
-            OneBedroomAvgSF_val = screen_nulls(prop_details_df.at['averageArea', 'All 1 Beds'])
-            OneBedroomEffectiveRentUnit_val = screen_nulls(prop_details_df.at['effectiveRentPerUnit', 'All 1 Beds'])
-            NumberOf1BedroomUnits_val = screen_nulls(prop_details_df.at['unitMixBeds', 'All 1 Beds'])
-            OneBedroomConcessionsPercentage_val = screen_nulls(prop_details_df.at['concessions', 'All 1 Beds'])
-        else:
-            OneBedroomAskingRentUnit_val = np.nan
-            OneBedroomAvgSF_val = np.nan
-            OneBedroomEffectiveRentUnit_val = np.nan
-            NumberOf1BedroomUnits_val = np.nan
-            OneBedroomConcessionsPercentage_val = np.nan
-        unit_type_metrics_package = (OneBedroomAskingRentUnit_val,
-                                     OneBedroomAvgSF_val,
-                                     OneBedroomEffectiveRentUnit_val,
-                                     NumberOf1BedroomUnits_val,
-                                     OneBedroomConcessionsPercentage_val)
-    elif unit_type == 'Two Bed':
-        if present_in_columns:
-            TwoBedroomAskingRentUnit_val = screen_nulls(prop_details_df.at['askingRentPerUnit', 'All 2 Beds'])
-            TwoBedroomAvgSF_val = screen_nulls(prop_details_df.at['averageArea', 'All 2 Beds'])
-            TwoBedroomEffectiveRentUnit_val = screen_nulls(prop_details_df.at['effectiveRentPerUnit', 'All 2 Beds'])
-            NumberOf2BedroomUnits_val = screen_nulls(prop_details_df.at['unitMixBeds', 'All 2 Beds'])
-            TwoBedroomConcessionsPercentage_val = screen_nulls(prop_details_df.at['concessions', 'All 2 Beds'])
-        else:
-            TwoBedroomAskingRentUnit_val = np.nan
-            TwoBedroomAvgSF_val = np.nan
-            TwoBedroomEffectiveRentUnit_val = np.nan
-            NumberOf2BedroomUnits_val = np.nan
-            TwoBedroomConcessionsPercentage_val = np.nan
-        unit_type_metrics_package = (TwoBedroomAskingRentUnit_val,
-                                     TwoBedroomAvgSF_val,
-                                     TwoBedroomEffectiveRentUnit_val,
-                                     NumberOf2BedroomUnits_val,
-                                     TwoBedroomConcessionsPercentage_val)
-    elif unit_type == 'Three Bed':
-        if present_in_columns:
-            ThreeBedroomAskingRentUnit_val = screen_nulls(prop_details_df.at['askingRentPerUnit', 'All 3 Beds'])
-            ThreeBedroomAvgSF_val = screen_nulls(prop_details_df.at['averageArea', 'All 3 Beds'])
-            ThreeBedroomEffectiveRentUnit_val = screen_nulls(prop_details_df.at['effectiveRentPerUnit', 'All 3 Beds'])
-            NumberOf3BedroomUnits_val = screen_nulls(prop_details_df.at['unitMixBeds', 'All 3 Beds'])
-            ThreeBedroomConcessionsPercentage_val = screen_nulls(prop_details_df.at['concessions', 'All 3 Beds'])
-        else:
-            ThreeBedroomAskingRentUnit_val = np.nan
-            ThreeBedroomAvgSF_val = np.nan
-            ThreeBedroomEffectiveRentUnit_val = np.nan
-            NumberOf3BedroomUnits_val = np.nan
-            ThreeBedroomConcessionsPercentage_val = np.nan
-        unit_type_metrics_package = (ThreeBedroomAskingRentUnit_val,
-                                     ThreeBedroomAvgSF_val,
-                                     ThreeBedroomEffectiveRentUnit_val,
-                                     NumberOf3BedroomUnits_val,
-                                     ThreeBedroomConcessionsPercentage_val)
-    elif unit_type == 'Four Bed':
-        if present_in_columns:
-            FourBedroomAskingRentUnit_val = screen_nulls(prop_details_df.at['askingRentPerUnit', 'All 4 Beds'])
-            FourBedroomAvgSF_val = screen_nulls(prop_details_df.at['averageArea', 'All 4 Beds'])
-            FourBedroomEffectiveRentUnit_val = screen_nulls(prop_details_df.at['effectiveRentPerUnit', 'All 4 Beds'])
-            NumberOf4BedroomUnits_val = screen_nulls(prop_details_df.at['unitMixBeds', 'All 4 Beds'])
-            FourBedroomConcessionsPercentage_val = screen_nulls(prop_details_df.at['concessions', 'All 4 Beds'])
-        else:
-            FourBedroomAskingRentUnit_val = np.nan
-            FourBedroomAvgSF_val = np.nan
-            FourBedroomEffectiveRentUnit_val = np.nan
-            NumberOf4BedroomUnits_val = np.nan
-            FourBedroomConcessionsPercentage_val = np.nan
-        unit_type_metrics_package = (FourBedroomAskingRentUnit_val,
-                                     FourBedroomAvgSF_val,
-                                     FourBedroomEffectiveRentUnit_val,
-                                     NumberOf4BedroomUnits_val,
-                                     FourBedroomConcessionsPercentage_val)
-    return unit_type_metrics_package
+    sections = dict(cached_sections)
+    if operations:
+        try:
+            results = json.loads(response_text)
+        except ValueError:
+            return response_text
+        if not isinstance(results, list) or len(results) != len(operations):
+            return response_text
+        for operation, result in zip(operations, results):
+            result_text = json.dumps(result)
+            sections[operation] = result_text
+            # only cache results that returned data without GraphQL errors
+            if isinstance(result, dict) and result.get('data') is not None and not result.get('errors'):
+                section_cache.put(prop_id, operation, result_text)
+    return '[' + ', '.join(sections[operation] for operation in PAYLOAD_OPERATIONS) + ']'
 
 
-def assemble_single_property_df(file, json_response, nested_metrics_pack, additional_metrics_dict):
+def create_futures_session(max_workers=16):
     """
-    Create a Pandas DataFrame containing all targeted measured collected about a single property from CoStar.
+    Create the FuturesSession used to send XHR calls to the CoStar API in parallel.
 
     Parameters
     ----------
-    file : str
-        Name of the file containing the saved json_response.
-    json_response : JSON object
-        JSON object containing the deserialized values returned by CoStar.
-    nested_metrics_pack : tuple
-        A tuple of tuples containing apartment metrics by number of bedrooms.
-    additional_metrics_dict : dict
-        A dictionary containing all remaining property metric values.
-
-    Returns
-    -------
-    temp_df : Pandas DataFrame.
-        A DataFrame containng all collected metrics regarding a single property.
-
-    """
-    studio_pack, one_pack, two_pack, three_pack, four_pack = nested_metrics_pack
-    temp_df = pd.DataFrame({'CoStarPropertyID': file.split('\\')[1].split('_')[0],
-                            'PropertyName': json_response[6]['data']['propertyDetail']['property_info']['address']['buildingName'],
-                            'PropertyAddress': json_response[6]['data']['propertyDetail']['property_info']['address']['deliveryAddress'],
-                            'OneBedroomAskingRentUnit': one_pack[0],
-                            'TwoBedroomAskingRentUnit': two_pack[0],
-                            'ThreeBedroomAskingRentUnit': three_pack[0],
-                            'FourBedroomAskingRentUnit': four_pack[0],
-                            'StudioAskingRentUnit': studio_pack[0],
-                            'OneBedroomAvgSF': one_pack[1],
-                            'TwoBedroomAvgSF': two_pack[1],
-                            'ThreeBedroomAvgSF': three_pack[1],
-                            'FourBedroomAvgSF': four_pack[1],
-                            'StudioAvgSF': studio_pack[1],
-                            'OneBedroomEffectiveRentUnit': one_pack[2],
-                            'TwoBedroomEffectiveRentUnit': two_pack[2],
-                            'ThreeBedroomEffectiveRentUnit': three_pack[2],
-                            'FourBedroomEffectiveRentUnit': four_pack[2],
-                            'StudioEffectiveRentUnit': studio_pack[2],
-                            'NumberOf1BedroomsUnits': one_pack[3],
-                            'NumberOf2BedroomsUnits': two_pack[3],
-                            'NumberOf3BedroomsUnits': three_pack[3],
-                            'NumberOf4BedroomsUnits': four_pack[3],
-                            'NumberOfStudioUnits': studio_pack[3],
-                            'NumberOfUnits': additional_metrics_dict.get('unit_count'),
-                            'OneBedroomConcessionsPercentage': one_pack[4],
-                            'TwoBedroomConcessionsPercentage': two_pack[4],
-                            'ThreeBedroomConcessionsPercentage': three_pack[4],
-                            'FourBedroomConcessionsPercentage': four_pack[4],
-                            'StudioConcessionsPercentage': studio_pack[4],
-                            'Latitude': json_response[6]['data']['propertyDetail']['property_info']['latitude'],
-                            'Longitude': json_response[6]['data']['propertyDetail']['property_info']['longitude'],
-                            'PropertyManagerName': additional_metrics_dict.get('property_manager'),
-                            'TrueOwnerName': additional_metrics_dict.get('true_owner'),
-                            'BuildingClass': json_response[6]['data']['propertyDetail']['property_info']['bldgClass'],
-                            'StarRating': json_response[6]['data']['propertyDetail']['property_info']['buildingRating'],
-                            'Amenities': additional_metrics_dict.get('amenities'),
-                            'YearBuilt': json_response[6]['data']['propertyDetail']['property_info']['yearBuilt'],
-                            'ParkingSpaces': additional_metrics_dict.get('parking'),
-                            'BuildingStories': json_response[6]['data']['propertyDetail']['property_info']['numOfStories'],
-                            'PercentLeased': additional_metrics_dict.get('percent_leased'),
-                            'City': json_response[6]['data']['propertyDetail']['property_info']['address']['city'],
-                            'State': json_response[6]['data']['propertyDetail']['property_info']['address']['state'],
-                            'Zip': additional_metrics_dict.get('zipcode')},
-                          index=[0])
-    return temp_df
-
-
-def read_call_response_into_df(df, file):
+    max_workers : int, optional
+        Number of processes sending requests. The default is 16.
+
+    Returns
+    -------
+    s : FuturesSession
+        Session with the CoStar request headers assigned. Responses are counted in
+        run_metrics as they are collected rather than by response hooks, which would run
+        in the worker processes.
+
     """
-    Open and read call response from .txt file for a single property, pull
-    data elements of interest from response into Pandas DataFrame.
+    from requests import Session
+    from requests_futures.sessions import FuturesSession
+    s = FuturesSession(executor=ProcessPoolExecutor(max_workers=max_workers), session=Session())
+    s.headers.update(REQUEST_HEADERS)
+    return s
+
+
+def create_rate_limiter(max_requests_per_second=None):
+    """
+    Create a coroutine function that spaces request starts to stay under a request-rate ceiling.
 
     Parameters
     ----------
-    df : Pandas DataFrame
-        DataFrame containing target data element values for all property API responses already
-        processed from the current scrape. The single property whose call is recorded in the
-        .txt file specified by the file variable will be appended to this dataframe.
-    file : str
-        Full file path to .txt file containing CoStar API response for a single property.
+    max_requests_per_second : float, optional
+        Maximum number of requests started per second. The default is None, in which case
+        requests are not rate limited.
 
     Returns
     -------
-    df : Pandas DataFrame
-        DataFrame containing the data for properties already parsed from .txt call response files
-        onto which the values in file have been concatenated.
+    wait_for_slot : coroutine function
+        Awaitable with no arguments that returns once the caller may start its request.
 
     """
-    # read call response from .txt file
-    with open(file, 'r+') as f:
-        json_response = json.loads(f.read())
-        f.close()
-
-    prop_details_df = pd.DataFrame()
-    for i in range(len(json_response[1]['data']['propertyDetail']['unit_mix_detail']['summaryItems'])):
-        temp = pd.Series(json_response[1]['data']['propertyDetail']['unit_mix_detail']['summaryItems'][i])
-        prop_details_df = pd.concat([prop_details_df, temp.T], axis=1, ignore_index=False)
-    try:
-        prop_details_df.columns = prop_details_df.loc['totals']
-    except KeyError:
-        pass
-
-    try:
-        PercentLeased_val = 100-float(prop_details_df.at['availablePercent', 'Totals'][:-1])
-    except (ValueError, KeyError):
-        PercentLeased_val = np.nan
+    lock = asyncio.Lock()
+    next_slot = [0.0]
 
-    try:
-        NumberOfUnits_val = prop_details_df.at['unitMixBeds', 'Totals']
-    except KeyError:
-        NumberOfUnits_val = np.nan
-
-    try:
-        PropertyManagerName_val = json_response[5]['data']['propertyDetail']['propertyContactDetails_info']['propertyManager'][0]['name']
-    except (KeyError, IndexError):
-        PropertyManagerName_val = np.nan
+    async def wait_for_slot():
+        if not max_requests_per_second:
+            return
+        async with lock:
+            now = asyncio.get_running_loop().time()
+            delay = next_slot[0] - now
+            next_slot[0] = max(now, next_slot[0]) + 1 / max_requests_per_second
+        if delay > 0:
+            await asyncio.sleep(delay)
 
-    try:
-        TrueOwnerName_val = json_response[5]['data']['propertyDetail']['propertyContactDetails_info']['trueOwner'][0]['name']
-    except (KeyError, IndexError):
-        TrueOwnerName_val = np.nan
-
-    Zip_val = json_response[6]['data']['propertyDetail']['property_info']['address']['postalCode']
-    if pd.isna(Zip_val):
-        Zip_val = np.nan
-    elif len(Zip_val) == 9:
-        Zip_val = Zip_val[:5]
-
-    ParkingSpaces_val = json_response[6]['data']['propertyDetail']['property_info']['numOfParkingSpaces']
-    if ParkingSpaces_val == 'None':
-        ParkingSpaces_val = 0
-
-    amenities_string_val = '; '.join(json_response[0]['data']['propertyDetail']['amenities_Info']['unitAmenities'] +
-                                     json_response[0]['data']['propertyDetail']['amenities_Info']['amenities'] +
-                                     json_response[0]['data']['propertyDetail']['amenities_Info']['roomAmenities'])
-    if amenities_string_val == '':
-        amenities_string_val = np.nan
-    additional_metrics_dict = {'amenities': amenities_string_val,
-                               'parking': ParkingSpaces_val,
-                               'zipcode': Zip_val,
-                               'true_owner': TrueOwnerName_val,
-                               'property_manager': PropertyManagerName_val,
-                               'percent_leased': PercentLeased_val,
-                               'unit_count': NumberOfUnits_val}
-
-    studio_pack = set_roomtype_metric_values('Studio', ('All Studios' in prop_details_df.columns), prop_details_df)
-    one_bed_pack = set_roomtype_metric_values('One Bed', ('All 1 Beds' in prop_details_df.columns), prop_details_df)
-    two_bed_pack = set_roomtype_metric_values('Two Bed', ('All 2 Beds' in prop_details_df.columns), prop_details_df)
-    three_bed_pack = set_roomtype_metric_values('Three Bed', ('All 3 Beds' in prop_details_df.columns), prop_details_df)
-    four_bed_pack = set_roomtype_metric_values('Four Bed', ('All 4 Beds' in prop_details_df.columns), prop_details_df)
-    nested_metric_packs = (studio_pack,
-                           one_bed_pack,
-                           two_bed_pack,
-                           three_bed_pack,
-                           four_bed_pack)
-
-    temp_df = assemble_single_property_df(file, json_response, nested_metric_packs, additional_metrics_dict)
-    df = pd.concat([df, temp_df], axis=0, ignore_index=True)
-    return df
+    return wait_for_slot
 
 
-def screen_nulls(data_element_val):
+async def fetch_property_response(session, url, prop_id, semaphore, wait_for_slot, output_dir, archive=None,
+                                  ledger=None, section_cache=None):
     """
-    Check for a string element which cannot be cast to float.
+    Request the CoStar API response for a single property and save it to a .txt file.
+
+    A request that fails with a connection error or timeout is counted and saved with an
+    empty body, so the property is picked up by the retry pass instead of aborting the run.
 
     Parameters
     ----------
-    data_element_val : str
-        A string representation of a data element sourced from the API call response.
+    session : aiohttp ClientSession
+        Shared session holding the pooled connections, headers and cookies.
+    url : str
+        URL of the CoStar API endpoint.
+    prop_id : str
+        The unique CoStar Property ID for a single property.
+    semaphore : asyncio Semaphore
+        Semaphore bounding the number of requests in flight.
+    wait_for_slot : coroutine function
+        Rate limiter created by create_rate_limiter.
+    output_dir : str
+        Directory the response .txt file is written to.
+    archive : ResponseArchive, optional
+        Archive the response is appended to instead of a .txt file. The default is None.
+    ledger : WorkLedger, optional
+        Work ledger the property is marked fetched in once its response is saved. The
+        default is None.
+    section_cache : SectionCache, optional
+        Cache of operation results. Only the operations without a fresh cached result are
+        requested, and the saved response merges the new and cached results. The default
+        is None, in which case every operation is requested.
 
     Returns
     -------
-    Float/string
-        Returns np.nan (a float null value) if string is equal to '-',
-        otherwise returns the unaltered string value.
+    prop_id : str
+        The CoStar Property ID of the request.
+    status : int
+        HTTP status code of the response, None if the request failed to connect or every
+        operation was served from the section cache.
 
     """
-    if data_element_val == '-':
-        return np.nan
-    return data_element_val
+    import aiohttp
+    operations, cached_sections = None, {}
+    if section_cache is not None:
+        operations, cached_sections = get_stale_operations(prop_id, section_cache)
+    status = None
+    text = ''
+    if operations is None or operations:
+        async with semaphore:
+            await wait_for_slot()
+            start = time.perf_counter()
+            try:
+                async with session.post(url, data=get_payload_bytes(prop_id, operations)) as resp:
+                    body = await resp.read()
+                    status = resp.status
+                    text = body.decode(resp.get_encoding())
+                run_metrics.record_response(status, len(body), time.perf_counter() - start)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                run_metrics.increment('connection_errors_total')
+    if section_cache is not None:
+        text = merge_section_response(prop_id, text, operations, cached_sections, section_cache)
+    save_response(prop_id, text, archive, output_dir)
+    if ledger is not None:
+        ledger.mark([prop_id], 'fetched')
+    return prop_id, status
 
 
-def parse_responses(cookies_dict):
+async def fetch_responses_async(prop_ids, url, cookies_dict, output_dir, max_concurrency=16,
+                                max_requests_per_second=None, print_progress=False, archive=None, ledger=None,
+                                section_cache=None):
     """
-    Collect all JSON responses logged in .txt files and collect the data into a
-    Pandas DataFrame.
+    Request and save the CoStar API responses for all properties from a single event loop.
 
     Parameters
     ----------
+    prop_ids : iterable of str
+        The unique CoStar Property IDs to request.
+    url : str
+        URL of the CoStar API endpoint.
     cookies_dict : dict
         Dictionary of the name: value of each cookie assigned to the webdriver post-login.
+    output_dir : str
+        Directory the response .txt files are written to.
+    max_concurrency : int, optional
+        Maximum number of requests in flight, which is also the connection pool size.
+        The default is 16.
+    max_requests_per_second : float, optional
+        Maximum number of requests started per second. The default is None, in which case
+        requests are not rate limited.
+    print_progress : bool, optional
+        Boolean indicator of whether to print a progress bar. The default is False.
+    archive : ResponseArchive, optional
+        Archive the responses are appended to instead of .txt files. The default is None.
+    ledger : WorkLedger, optional
+        Work ledger each property is marked fetched in once its response is saved. The
+        default is None.
+    section_cache : SectionCache, optional
+        Cache of operation results used to request only the stale operations of each
+        property. The default is None.
 
     Returns
     -------
-    df : Pandas df
-        A dataframe containing the .
-    json_file_list : list of strings
-        A list of all the .txt files read into the dataframe in the order they
-        were read.
-    """
+    statuses : dict
+        Dictionary of CoStar Property ID: HTTP status code of its response, None if the
+        request failed to connect or was served from the section cache.
 
-    start = datetime.datetime.now()
-    json_file_list = glob(os.path.abspath("*.txt"))
-    df = pd.DataFrame()
-    for file in json_file_list:
-        try:
-            df = read_call_response_into_df(df, file)
-        except ValueError:
-            df = reissue_call_and_read_response_into_df(df, file, cookies_dict)
-    end = datetime.datetime.now()
-    print(f'Completed parsing into dataframe in {end-start}.')
-    df.to_csv(os.path.abspath(f'{datetime.datetime.today().strftime("%m.%d.%Y")}_compiled_df.csv'), index=False)
-    return df, json_file_list
+    """
+    import aiohttp
+    from tqdm import tqdm
+    semaphore = asyncio.Semaphore(max_concurrency)
+    wait_for_slot = create_rate_limiter(max_requests_per_second)
+    connector = aiohttp.TCPConnector(limit=max_concurrency)
+    statuses = {}
+    async with aiohttp.ClientSession(connector=connector, headers=REQUEST_HEADERS, cookies=cookies_dict) as session:
+        tasks = [asyncio.ensure_future(fetch_property_response(session, url, prop_id, semaphore, wait_for_slot,
+                                                                output_dir, archive, ledger, section_cache))
+                 for prop_id in prop_ids]
+        completed = asyncio.as_completed(tasks)
+        if print_progress:
+            completed = tqdm(completed, total=len(tasks), leave=True, unit='Call responses')
+        for task in completed:
+            prop_id, status = await task
+            statuses[prop_id] = status
+    return statuses
 
 
-def collect_costar_data(username_string, password_string, print_progress=False):
+@traced('fetch')
+def collect_costar_data(username_string, password_string, print_progress=False, use_asyncio=False,
+                        max_concurrency=16, max_requests_per_second=None, archive_path=None,
+                        section_cache_path=None, section_ttls=None, ledger_path=None, cookie_cache_path=None,
+                        shard_index=None, shard_count=None):
     """
     Create, request, and receive XHR calls to CoStar API.
 
@@ -853,6 +3799,38 @@ def collect_costar_data(username_string, password_string, print_progress=False):
         String form of CoStar password for accessing the service.
     print_progress : bool, optional
         Boolean indicator of whether to print a progress bar. The default is False.
+    use_asyncio : bool, optional
+        Boolean indicator of whether to send the requests from a single asyncio event loop
+        with a pooled aiohttp session instead of a FuturesSession backed by a process pool.
+        The default is False.
+    max_concurrency : int, optional
+        Maximum number of requests in flight when use_asyncio is True. The default is 16.
+    max_requests_per_second : float, optional
+        Maximum number of requests started per second when use_asyncio is True. The default
+        is None, in which case requests are not rate limited.
+    archive_path : str, optional
+        Full file path of a ResponseArchive the responses are appended to. The default is
+        None, in which case each response is saved to its own .txt file.
+    section_cache_path : str, optional
+        Full file path of a SectionCache database. Only the payload operations without a
+        fresh cached result are requested, and the saved responses merge the new and
+        cached results. The default is None, in which case every operation is requested.
+    section_ttls : dict, optional
+        Dictionary of operation name: datetime.timedelta overriding SECTION_TTLS. The
+        default is None.
+    ledger_path : str, optional
+        Full file path of the run's WorkLedger database. Only properties not yet fetched
+        in the run are requested, and each property is marked fetched once its response
+        is saved. The default is None, in which case every property is requested.
+    cookie_cache_path : str, optional
+        Full file path of a CookieCache file reused instead of logging in while its session
+        is valid. The default is None, in which case the browser logs in.
+    shard_index : int, optional
+        Index of the shard to request when the properties are split across hosts, from 0
+        to shard_count - 1. The default is None, in which case every property is requested.
+    shard_count : int, optional
+        Number of shards the properties are partitioned into by get_property_shard. The
+        default is None.
 
     Returns
     -------
@@ -860,66 +3838,382 @@ def collect_costar_data(username_string, password_string, print_progress=False):
         Dictionary of the name: value of each cookie assigned to the webdriver post-login.
 
     """
-    cookies_dict = get_costar_cookies(username_string, password_string)
-    s = FuturesSession(executor=ProcessPoolExecutor(max_workers=16), session=Session())
-    headers = {
-        "Content-Type": "application/json",
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/97.0.4692.71 Safari/537.36",
-        "Accept-Encoding": "*",
-        "Connection": "keep-alive",
-        'origin': 'https://product.costar.com',
-        'x-requested-with': 'XMLHttpRequest'
-    }
-    s.headers.update(headers)
-    s.hooks['response'].append(print_url)
-    s.hooks['response'].append(print_status)
-    url = os.getenv('COSTAR_DB_URL')
-
+    from tqdm import tqdm
     print('Loading property IDs')
     properties_df = load_properties('C:/Users/RBurns/Documents/property_id_matching.csv')
+    cookies_dict = get_costar_cookies(username_string, password_string, cookie_cache_path,
+                                      next(iter(properties_df.CoStarPropID), None))
+    prop_ids = properties_df.CoStarPropID
+    if shard_count is not None:
+        prop_ids = select_shard(prop_ids, shard_index, shard_count)
+        print(f'{len(prop_ids)} of {len(properties_df)} properties in shard {shard_index} of {shard_count}.')
+    ledger = None
+    if ledger_path is not None:
+        ledger = WorkLedger(ledger_path)
+        ledger.register(prop_ids)
+        pending_prop_ids = ledger.prop_ids('pending')
+        prop_ids = [prop_id for prop_id in prop_ids if prop_id in pending_prop_ids]
+        print(f'{len(prop_ids)} of {len(properties_df)} properties left to fetch this run.')
+    if use_asyncio:
+        print('Retrieving calls.')
+        start = datetime.datetime.now()
+        archive = None if archive_path is None else ResponseArchive(archive_path, mode='a')
+        section_cache = None if section_cache_path is None else SectionCache(section_cache_path, section_ttls)
+        try:
+            asyncio.run(fetch_responses_async(prop_ids,
+                                              os.getenv('COSTAR_DB_URL'),
+                                              cookies_dict,
+                                              'C:/Users/RBurns/Documents',
+                                              max_concurrency,
+                                              max_requests_per_second,
+                                              print_progress,
+                                              archive,
+                                              ledger,
+                                              section_cache))
+        finally:
+            if archive is not None:
+                archive.close()
+            if section_cache is not None:
+                section_cache.close()
+            if ledger is not None:
+                ledger.close()
+        end = datetime.datetime.now()
+        print(f'Completed response reading in {end-start}.')
+        return cookies_dict
+    s = create_futures_session()
+    headers = REQUEST_HEADERS
+    url = os.getenv('COSTAR_DB_URL')
 
     print('Creating requests.')
     start1 = datetime.datetime.now()
     futures = []
-    if print_progress==True:
-        for index, prop_id in tqdm(enumerate(properties_df.CoStarPropID),
-                                   unit='Request calls',
-                                   leave=True,
-                                   total=len(properties_df.CoStarPropID)):
-            payload = get_payload(prop_id)
-            future = s.post(url, data=payload, headers=headers, cookies=cookies_dict)
-            future.costar_prop_id = prop_id
-            futures.append(future)
-        end1 = datetime.datetime.now()
-        start2 = datetime.datetime.now()
-        print('Requests created. Retrieving calls.')
-        for future in tqdm(as_completed(futures), leave=True, unit='Call responses'):
-            resp = future.result()
-            with open(f'C:/Users/RBurns/Documents/{future.costar_prop_id}_{datetime.datetime.today().strftime("%m.%d.%Y")}.txt', 'w+') as f:
-                f.write(resp.text)
-                f.close()
-        end2 = datetime.datetime.now()
-        print(f'Completed request creation in {end1-start1}, completed response reading in {end2-start2}.')
-    else:
-        for index, prop_id in enumerate(properties_df.CoStarPropID):
-            payload = get_payload(prop_id)
+    archive = None if archive_path is None else ResponseArchive(archive_path, mode='a')
+    section_cache = None if section_cache_path is None else SectionCache(section_cache_path, section_ttls)
+    try:
+        for prop_id in tqdm(prop_ids, unit='Request calls', leave=True, disable=not print_progress):
+            operations, cached_sections = None, {}
+            if section_cache is not None:
+                operations, cached_sections = get_stale_operations(prop_id, section_cache)
+                if not operations:
+                    save_response(prop_id, merge_section_response(prop_id, '', operations, cached_sections,
+                                                                  section_cache), archive)
+                    if ledger is not None:
+                        ledger.mark([prop_id], 'fetched')
+                    continue
+            payload = get_payload_bytes(prop_id, operations)
             future = s.post(url, data=payload, headers=headers, cookies=cookies_dict)
             future.costar_prop_id = prop_id
+            future.costar_operations = operations
+            future.costar_cached_sections = cached_sections
             futures.append(future)
         end1 = datetime.datetime.now()
         start2 = datetime.datetime.now()
         print('Requests created. Retrieving calls.')
-        for future in as_completed(futures):
+        for future in tqdm(as_completed(futures), total=len(futures), leave=True, unit='Call responses',
+                           disable=not print_progress):
             resp = future.result()
-            with open(f'C:/Users/RBurns/Documents/{future.costar_prop_id}_{datetime.datetime.today().strftime("%m.%d.%Y")}.txt', 'w+') as f:
-                f.write(resp.text)
-                f.close()
+            run_metrics.record_response(resp.status_code, len(resp.content), resp.elapsed.total_seconds())
+            response_text = resp.text
+            if section_cache is not None:
+                response_text = merge_section_response(future.costar_prop_id, response_text,
+                                                       future.costar_operations, future.costar_cached_sections,
+                                                       section_cache)
+            save_response(future.costar_prop_id, response_text, archive)
+            if ledger is not None:
+                ledger.mark([future.costar_prop_id], 'fetched')
         end2 = datetime.datetime.now()
         print(f'Completed request creation in {end1-start1}, completed response reading in {end2-start2}.')
+    finally:
+        if archive is not None:
+            archive.close()
+        if section_cache is not None:
+            section_cache.close()
+        if ledger is not None:
+            ledger.close()
     return cookies_dict
 
 
-def main(print_progress=False):
+@traced('stream_parse')
+def parse_stage(response_queue, batch_queue, cookies_dict, batch_size, errors):
+    """
+    Pipeline stage parsing call responses as they arrive and passing them on in batches.
+
+    Parameters
+    ----------
+    response_queue : queue.Queue
+        Queue of (CoStar Property ID, response text) tuples, ended by None.
+    batch_queue : queue.Queue
+        Bounded queue receiving DataFrames of batch_size parsed records, ended by None.
+    cookies_dict : dict
+        Dictionary of the name: value of each cookie assigned to the webdriver post-login.
+    batch_size : int
+        Number of records per batch.
+    errors : list
+        Shared list of exceptions raised by any stage. Once it is not empty the stage
+        only drains its input queue.
+
+    Returns
+    -------
+    None.
+
+    """
+    batch = []
+    failed_prop_ids = []
+    while True:
+        item = response_queue.get()
+        if item is None:
+            break
+        if errors:
+            continue
+        prop_id, response_text = item
+        try:
+            try:
+                batch.append(parse_response_into_record(prop_id, json_loads(response_text)))
+            except ValueError:
+                # retried together once fetching ends rather than stalling the stage
+                failed_prop_ids.append(prop_id)
+            if len(batch) >= batch_size:
+                run_metrics.increment('parsed_records_total', len(batch))
+                batch_queue.put(records_to_df(batch))
+                batch = []
+        except Exception as e:
+            errors.append(e)
+    if failed_prop_ids and not errors:
+        try:
+            records = retry_failed_records([None] * len(failed_prop_ids), failed_prop_ids, cookies_dict)
+            batch.extend(record for record in records if record is not None)
+            run_metrics.increment('dropped_properties_total', records.count(None))
+        except Exception as e:
+            errors.append(e)
+    if batch and not errors:
+        run_metrics.increment('parsed_records_total', len(batch))
+        batch_queue.put(records_to_df(batch))
+    batch_queue.put(None)
+    return
+
+
+@traced('stream_load')
+def load_stage(batch_queue, engine, table, sql_table_name, schema, chunksize, amenities_shrink_dict,
+               collected_date_stamp, loaded_batches, errors):
+    """
+    Pipeline stage appending each batch of parsed records to the SQL table. MostRecentFlag
+    is flipped for the batch's properties in the same transaction as the batch insert, so a
+    failed run leaves every property not yet loaded with its previous most recent row. The
+    flags of properties the run did not load are cleared by run_streaming_pipeline once
+    every batch is loaded.
+
+    Parameters
+    ----------
+    batch_queue : queue.Queue
+        Bounded queue of DataFrames of parsed records, ended by None.
+    engine : SQL Alchemy Engine
+        Engine connected to the target database.
+    table : SQL Alchemy Table
+        Reflected target table.
+    sql_table_name : str
+        The name of the table into which the data is injected.
+    schema : str
+        The schema of the target table.
+    chunksize : int
+        Number of rows written per batch.
+    amenities_shrink_dict : dict
+        Dictionary of the full text: abbreviated text of amenity names, or None for
+        AMENITIES_SHRINK_DICT.
+    collected_date_stamp : datetime
+        CollectedDateStamp assigned to every row of the run.
+    loaded_batches : list
+        List the parsed DataFrame of each loaded batch is appended to.
+    errors : list
+        Shared list of exceptions raised by any stage. Once it is not empty the stage
+        only drains its input queue.
+
+    Returns
+    -------
+    None.
+
+    """
+    while True:
+        batch_df = batch_queue.get()
+        if batch_df is None:
+            break
+        if errors:
+            continue
+        try:
+            data_df = prepare_df_for_sql(batch_df, amenities_shrink_dict)
+            data_df = data_df.assign(CollectedDateStamp=collected_date_stamp)
+            data_df = data_df.assign(MostRecentFlag=1)
+            with engine.begin() as connection:
+                clear_most_recent_flag_for_properties(connection, table, data_df['CoStarPropertyID'])
+                load_df_to_sql(data_df, connection, sql_table_name, schema, chunksize)
+            loaded_batches.append(batch_df)
+        except Exception as e:
+            errors.append(e)
+    return
+
+
+def run_streaming_pipeline(prop_ids, url, cookies_dict, sql_connection_string, sql_table_name, batch_size=500,
+                           queue_size=1000, bulk_load=False, schema='dbo', amenities_shrink_dict=None,
+                           output_dir=None, print_progress=False):
+    """
+    Fetch, parse and load properties concurrently: responses are parsed as they are
+    received, and parsed records are loaded in batches while fetching continues. Once every
+    batch is loaded, MostRecentFlag is cleared for the properties the run did not load, so
+    the table ends with the same flags as a post_to_db load of the run.
+
+    Parameters
+    ----------
+    prop_ids : iterable of str
+        The unique CoStar Property IDs to request.
+    url : str
+        URL of the CoStar API endpoint.
+    cookies_dict : dict
+        Dictionary of the name: value of each cookie assigned to the webdriver post-login.
+    sql_connection_string : str
+        ODBC connection string or SQL Alchemy URL of the target database.
+    sql_table_name : str
+        The name of the table into which the data is injected.
+    batch_size : int, optional
+        Number of parsed records loaded to SQL at a time. The default is 500.
+    queue_size : int, optional
+        Maximum number of requests in flight, and of responses waiting to be parsed. The
+        parsed batch queue holds at most two batches. The default is 1000.
+    bulk_load : bool, optional
+        Boolean indicator of whether to load the SQL table with fast_executemany batches.
+        The default is False.
+    schema : str, optional
+        The schema of the target table. The default is 'dbo'.
+    amenities_shrink_dict : dict, optional
+        Dictionary of the full text: abbreviated text of amenity names. The default is None,
+        in which case AMENITIES_SHRINK_DICT is used.
+    output_dir : str, optional
+        Directory each response is also saved to as a .txt file. The default is None, in
+        which case responses are not written to disk.
+    print_progress : bool, optional
+        Boolean indicator of whether to print a progress bar. The default is False.
+
+    Returns
+    -------
+    df : Pandas DataFrame
+        DataFrame of every parsed property record loaded during the run.
+
+    """
+    from tqdm import tqdm
+    engine = create_db_engine(sql_connection_string, fast_executemany=bulk_load)
+    chunksize = BULK_LOAD_CHUNKSIZE if bulk_load else 100
+    table = reflect_table(engine, sql_table_name, schema)
+
+    response_queue = queue.Queue(maxsize=queue_size)
+    batch_queue = queue.Queue(maxsize=2)
+    errors = []
+    loaded_batches = []
+    parse_thread = threading.Thread(target=parse_stage,
+                                    args=(response_queue, batch_queue, cookies_dict, batch_size, errors))
+    load_thread = threading.Thread(target=load_stage,
+                                   args=(batch_queue, engine, table, sql_table_name, schema, chunksize,
+                                         amenities_shrink_dict, datetime.datetime.today(), loaded_batches, errors))
+    parse_thread.start()
+    load_thread.start()
+
+    s = create_futures_session()
+    prop_ids = list(prop_ids)
+    remaining_prop_ids = iter(prop_ids)
+    pending = set()
+    progress = tqdm(total=len(prop_ids), leave=True, unit='Call responses', disable=not print_progress)
+    try:
+        while not errors:
+            # at most queue_size requests are unfinished, and none are sent while the put
+            # below blocks, so fetching waits for the parse stage instead of running ahead
+            for prop_id in itertools.islice(remaining_prop_ids, queue_size - len(pending)):
+                future = s.post(url, data=get_payload_bytes(prop_id), headers=REQUEST_HEADERS, cookies=cookies_dict)
+                future.costar_prop_id = prop_id
+                pending.add(future)
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                resp = future.result()
+                run_metrics.record_response(resp.status_code, len(resp.content), resp.elapsed.total_seconds())
+                if output_dir is not None:
+                    with open(f'{output_dir}/{future.costar_prop_id}_{datetime.datetime.today().strftime("%m.%d.%Y")}.txt', 'w+') as f:
+                        f.write(resp.text)
+                        f.close()
+                # blocks while the parse stage is queue_size responses behind
+                response_queue.put((future.costar_prop_id, resp.text))
+                progress.update()
+    finally:
+        for future in pending:
+            future.cancel()
+        progress.close()
+        response_queue.put(None)
+        parse_thread.join()
+        load_thread.join()
+        s.close()
+    if errors:
+        raise errors[0]
+    loaded_prop_ids = itertools.chain.from_iterable(batch_df['CoStarPropertyID'] for batch_df in loaded_batches)
+    with engine.begin() as connection:
+        clear_most_recent_flag_except(connection, table, loaded_prop_ids)
+    return pd.concat(loaded_batches, ignore_index=True) if loaded_batches else records_to_df([])
+
+
+@traced('pipeline')
+def stream_costar_data(username_string, password_string, sql_connection_string, sql_table_name,
+                       print_progress=False, batch_size=500, bulk_load=False, cookie_cache_path=None):
+    """
+    Log in to CoStar and run the streaming fetch, parse and load pipeline over all properties.
+
+    Parameters
+    ----------
+    username_string : str
+        String form of CoStar username for accessing the service.
+    password_string : str
+        String form of CoStar password for accessing the service.
+    sql_connection_string : str
+        ODBC connection string or SQL Alchemy URL of the target database.
+    sql_table_name : str
+        The name of the table into which the data is injected.
+    print_progress : bool, optional
+        Boolean indicator of whether to print a progress bar. The default is False.
+    batch_size : int, optional
+        Number of parsed records loaded to SQL at a time. The default is 500.
+    bulk_load : bool, optional
+        Boolean indicator of whether to load the SQL table with fast_executemany batches.
+        The default is False.
+    cookie_cache_path : str, optional
+        Full file path of a CookieCache file reused instead of logging in while its session
+        is valid. The default is None, in which case the browser logs in.
+
+    Returns
+    -------
+    df : Pandas DataFrame
+        DataFrame of every parsed property record loaded during the run.
+
+    """
+    print('Loading property IDs')
+    properties_df = load_properties('C:/Users/RBurns/Documents/property_id_matching.csv')
+    cookies_dict = get_costar_cookies(username_string, password_string, cookie_cache_path,
+                                      next(iter(properties_df.CoStarPropID), None))
+    print('Streaming requests, parsing and upload.')
+    start = datetime.datetime.now()
+    df = run_streaming_pipeline(properties_df.CoStarPropID,
+                                os.getenv('COSTAR_DB_URL'),
+                                cookies_dict,
+                                sql_connection_string,
+                                sql_table_name,
+                                batch_size=batch_size,
+                                bulk_load=bulk_load,
+                                print_progress=print_progress)
+    end = datetime.datetime.now()
+    print(f'Completed streaming pipeline in {end-start}.')
+    df.to_csv(os.path.abspath(f'{datetime.datetime.today().strftime("%m.%d.%Y")}_compiled_df.csv'), index=False)
+    return df
+
+
+def main(print_progress=False, parallel_parse=False, parse_workers=None, bulk_load=False, pipelined=False,
+         use_archive=False, snapshot_format='csv', snapshot_store_dir=None, parse_cache_path=None,
+         section_cache_path=None, full_payload_query=False, ledger_path=None, metrics_path=None,
+         prometheus_path=None, cookie_cache_path=None, use_asyncio=False, max_concurrency=16,
+         max_requests_per_second=None):
     """
     Run full program to send/receive API calls from CoStar, parse the call responses,
     save the responses to a .csv file for backup, and append the latest data from
@@ -932,6 +4226,68 @@ def main(print_progress=False):
     ----------
     print_progress : bool, optional
         Boolean indicator of whether to print a progress bar. The default is False.
+    parallel_parse : bool, optional
+        Boolean indicator of whether to parse the call responses across a pool of
+        processes. The default is False.
+    parse_workers : int, optional
+        Number of worker processes used when parallel_parse is True. The default is None,
+        in which case the number of processors on the machine is used.
+    bulk_load : bool, optional
+        Boolean indicator of whether to load the SQL table with fast_executemany batches.
+        The default is False.
+    pipelined : bool, optional
+        Boolean indicator of whether to parse and load responses while fetching continues,
+        instead of running the fetch, parse and load phases one after another. The
+        pipelined run sends its requests from a FuturesSession, keeps no response archive,
+        section cache, parse cache, work ledger or snapshot store, and parses in its own
+        thread, so use_archive, snapshot_store_dir, parse_cache_path, section_cache_path,
+        ledger_path, parallel_parse, snapshot_format, use_asyncio, max_concurrency and
+        max_requests_per_second are ignored. The default is False.
+    use_archive : bool, optional
+        Boolean indicator of whether to save the responses to a single compressed
+        ResponseArchive for the run instead of one .txt file per property. The default
+        is False.
+    snapshot_format : str, optional
+        Format the compiled DataFrame backup is saved in: 'csv', 'parquet' or 'both'.
+        The default is 'csv'.
+    snapshot_store_dir : str, optional
+        Root directory of a snapshot store the run's compiled DataFrame is added to as a
+        date partition. The default is None, in which case no store is kept.
+    parse_cache_path : str, optional
+        Full file path of a ParseCache database used to skip re-parsing responses that are
+        unchanged since a previous run. The default is None, in which case every response
+        is parsed.
+    section_cache_path : str, optional
+        Full file path of a SectionCache database used to only request the sections of each
+        property whose cached result has expired. The default is None, in which case every
+        section is requested.
+    full_payload_query : bool, optional
+        Boolean indicator of whether to request every field of the CoStar web app queries
+        rather than only the fields read by the parser. The default is False.
+    ledger_path : str, optional
+        Full file path of a WorkLedger database recording the fetch, parse and load state
+        of each property, so that rerunning main after a failure only does the remaining
+        work. A resumed run reopens the response archive named after the ledger's run id.
+        Not used when pipelined is True. The default is None.
+    metrics_path : str, optional
+        Full file path of a JSON lines file the run's stage spans and metrics are appended
+        to once the run ends, including runs that fail. The default is None.
+    prometheus_path : str, optional
+        Full file path of a .prom file the run's metrics are written to for the Prometheus
+        node_exporter textfile collector once the run ends. The default is None.
+    cookie_cache_path : str, optional
+        Full file path of an encrypted CookieCache file holding the CoStar session between
+        runs, so the browser only logs in once the cached session has expired or been
+        rejected. The default is None, in which case the browser logs in on every run.
+    use_asyncio : bool, optional
+        Boolean indicator of whether to send the requests from a single asyncio event loop
+        with a pooled aiohttp session instead of a FuturesSession backed by a process pool.
+        Not used when pipelined is True. The default is False.
+    max_concurrency : int, optional
+        Maximum number of requests in flight when use_asyncio is True. The default is 16.
+    max_requests_per_second : float, optional
+        Maximum number of requests started per second when use_asyncio is True. The default
+        is None, in which case requests are not rate limited.
 
     Returns
     -------
@@ -939,15 +4295,297 @@ def main(print_progress=False):
 
     """
     start = datetime.datetime.now()
-    cookies_dict = collect_costar_data(os.getenv('COSTAR_USERNAME'), os.getenv('COSTAR_PASSWORD'), print_progress)
-    total_day_df, json_file_list = parse_responses(cookies_dict)
-    post_to_db(os.getenv('SQL_CONNECTION_STRING'), os.getenv('SQL_TABLE_NAME'), total_day_df)
-    for file in json_file_list:
-        os.remove(file)
-    end = datetime.datetime.now()
-    print(f'Full program run completed in {end-start}.')
+    load_environment()
+    run_metrics.reset()
+    try:
+        with run_metrics.span('run'):
+            if full_payload_query:
+                set_payload_query('full')
+            if pipelined:
+                stream_costar_data(os.getenv('COSTAR_USERNAME'), os.getenv('COSTAR_PASSWORD'),
+                                   os.getenv('SQL_CONNECTION_STRING'), os.getenv('SQL_TABLE_NAME'),
+                                   print_progress, bulk_load=bulk_load, cookie_cache_path=cookie_cache_path)
+                end = datetime.datetime.now()
+                print(f'Full program run completed in {end-start}.')
+                return
+            archive_path = None
+            if use_archive:
+                run_date = datetime.datetime.today().strftime("%m.%d.%Y")
+                if ledger_path is not None:
+                    # a resumed run reopens the archive it started in, even after midnight
+                    with WorkLedger(ledger_path) as ledger:
+                        run_date = ledger.run_id
+                archive_path = f'C:/Users/RBurns/Documents/{run_date}_responses.arc'
+            cookies_dict = collect_costar_data(os.getenv('COSTAR_USERNAME'), os.getenv('COSTAR_PASSWORD'),
+                                               print_progress, use_asyncio=use_asyncio,
+                                               max_concurrency=max_concurrency,
+                                               max_requests_per_second=max_requests_per_second,
+                                               archive_path=archive_path,
+                                               section_cache_path=section_cache_path, ledger_path=ledger_path,
+                                               cookie_cache_path=cookie_cache_path)
+            total_day_df, json_file_list = parse_responses(cookies_dict, parallel=parallel_parse,
+                                                           max_workers=parse_workers, archive_path=archive_path,
+                                                           snapshot_format=snapshot_format,
+                                                           parse_cache_path=parse_cache_path, ledger_path=ledger_path)
+            if snapshot_store_dir is not None:
+                store_snapshot(total_day_df, snapshot_store_dir)
+            post_to_db(os.getenv('SQL_CONNECTION_STRING'), os.getenv('SQL_TABLE_NAME'), total_day_df,
+                       bulk_load=bulk_load, ledger_path=ledger_path)
+            for file in json_file_list:
+                os.remove(file)
+            if ledger_path is not None:
+                with WorkLedger(ledger_path) as ledger:
+                    ledger.finish()
+            end = datetime.datetime.now()
+            print(f'Full program run completed in {end-start}.')
+    finally:
+        export_run_metrics(metrics_path, prometheus_path)
+    return
+
+
+def export_run_metrics(metrics_path=None, prometheus_path=None):
+    """
+    Write the metrics of the run to the requested exports.
+
+    Parameters
+    ----------
+    metrics_path : str, optional
+        Full file path of a JSON lines file the spans and metrics are appended to. The
+        default is None.
+    prometheus_path : str, optional
+        Full file path of a .prom file the metrics are written to. The default is None.
+
+    Returns
+    -------
+    None.
+
+    """
+    if metrics_path is not None:
+        run_metrics.write_json_lines(metrics_path)
+    if prometheus_path is not None:
+        run_metrics.write_prometheus_textfile(prometheus_path)
+    return
+
+
+def fetch_command(args):
+    """
+    Log in and save the call response of every property, for the fetch subcommand.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        Parsed command line arguments.
+
+    Returns
+    -------
+    None.
+
+    """
+    if args.full_query:
+        set_payload_query('full')
+    collect_costar_data(os.getenv('COSTAR_USERNAME'), os.getenv('COSTAR_PASSWORD'), args.progress,
+                        use_asyncio=args.use_asyncio, max_concurrency=args.max_concurrency,
+                        max_requests_per_second=args.max_requests_per_second, archive_path=args.archive,
+                        section_cache_path=args.section_cache, ledger_path=args.ledger,
+                        cookie_cache_path=args.cookie_cache, shard_index=args.shard_index,
+                        shard_count=args.shard_count)
+    return
+
+
+def parse_command(args):
+    """
+    Parse the saved call responses into the compiled snapshot, for the parse subcommand.
+    Responses that fail to parse are dropped rather than retried, since retrying requires
+    logging in.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        Parsed command line arguments.
+
+    Returns
+    -------
+    None.
+
+    """
+    total_day_df, _ = parse_responses(None, parallel=args.parallel, max_workers=args.workers,
+                                      archive_path=args.archive, snapshot_format=args.snapshot_format,
+                                      parse_cache_path=args.parse_cache, ledger_path=args.ledger,
+                                      shard_index=args.shard_index, shard_count=args.shard_count)
+    if args.snapshot_store is not None:
+        store_snapshot(total_day_df, args.snapshot_store)
+    return
+
+
+def load_command(args):
+    """
+    Load a compiled snapshot into the SQL table, for the load subcommand.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        Parsed command line arguments.
+
+    Returns
+    -------
+    None.
+
+    """
+    last_scrape_df = None
+    if args.snapshot is not None:
+        if args.snapshot.endswith('.parquet'):
+            last_scrape_df = read_snapshot(args.snapshot)
+        else:
+            last_scrape_df = pd.read_csv(args.snapshot)
+    post_to_db(os.getenv('SQL_CONNECTION_STRING'), os.getenv('SQL_TABLE_NAME'), last_scrape_df,
+               bulk_load=args.bulk_load, incremental=args.incremental, ledger_path=args.ledger)
+    return
+
+
+def merge_command(args):
+    """
+    Merge the partial snapshots of a sharded run and load them in a single upload, for the
+    merge subcommand.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        Parsed command line arguments.
+
+    Returns
+    -------
+    None.
+
+    """
+    total_day_df = merge_shard_snapshots(args.snapshot_dir, args.shard_count)
+    if args.snapshot_store is not None:
+        store_snapshot(total_day_df, args.snapshot_store)
+    post_to_db(os.getenv('SQL_CONNECTION_STRING'), os.getenv('SQL_TABLE_NAME'), total_day_df,
+               bulk_load=args.bulk_load, incremental=args.incremental, ledger_path=args.ledger)
+    return
+
+
+def cli(argv=None):
+    """
+    Command line entry point running the fetch, parse or load stage on its own, or the full
+    run. Each subcommand only imports the dependencies of the stages it runs.
+
+    Parameters
+    ----------
+    argv : list of str, optional
+        Command line arguments. The default is None, in which case sys.argv is used.
+
+    Returns
+    -------
+    None.
+
+    """
+    parser = argparse.ArgumentParser(description='Collect CoStar property data and load it into SQL Server.')
+    parser.add_argument('--metrics', help='JSON lines file the run spans and metrics are appended to')
+    parser.add_argument('--prometheus', help='Prometheus textfile the run metrics are written to')
+    subparsers = parser.add_subparsers(dest='command')
+
+    fetch_parser = subparsers.add_parser('fetch', help='log in and save the call response of every property')
+    fetch_parser.add_argument('--progress', action='store_true', help='print a progress bar')
+    fetch_parser.add_argument('--asyncio', dest='use_asyncio', action='store_true',
+                              help='send the requests from a single asyncio event loop')
+    fetch_parser.add_argument('--max-concurrency', type=int, default=16,
+                              help='requests in flight with --asyncio (default: 16)')
+    fetch_parser.add_argument('--max-requests-per-second', type=float,
+                              help='request rate ceiling with --asyncio (default: none)')
+    fetch_parser.add_argument('--full-query', action='store_true', help='request every field of the web app queries')
+    fetch_parser.add_argument('--archive', help='response archive to save to instead of .txt files')
+    fetch_parser.add_argument('--section-cache', help='section cache database')
+    fetch_parser.add_argument('--ledger', help='work ledger database of the run')
+    fetch_parser.add_argument('--cookie-cache', help='encrypted session cookie cache file')
+    fetch_parser.add_argument('--shard-index', type=int, help='shard of the properties to request, from 0')
+    fetch_parser.add_argument('--shard-count', type=int, help='number of shards the properties are split into')
+    fetch_parser.set_defaults(command_function=fetch_command)
+
+    parse_parser = subparsers.add_parser('parse', help='parse the saved call responses into the compiled snapshot')
+    parse_parser.add_argument('--archive', help='response archive to read instead of the .txt files')
+    parse_parser.add_argument('--parallel', action='store_true', help='parse across a pool of processes')
+    parse_parser.add_argument('--workers', type=int, help='worker processes with --parallel (default: CPU count)')
+    parse_parser.add_argument('--snapshot-format', choices=['csv', 'parquet', 'both'], default='csv',
+                              help='format of the compiled snapshot (default: csv)')
+    parse_parser.add_argument('--snapshot-store', help='snapshot store directory the snapshot is added to')
+    parse_parser.add_argument('--parse-cache', help='parse cache database')
+    parse_parser.add_argument('--ledger', help='work ledger database of the run')
+    parse_parser.add_argument('--shard-index', type=int, help='shard of the properties to parse, from 0')
+    parse_parser.add_argument('--shard-count', type=int, help='number of shards the properties are split into')
+    parse_parser.set_defaults(command_function=parse_command)
+
+    load_parser = subparsers.add_parser('load', help='load a compiled snapshot into the SQL table')
+    load_parser.add_argument('--snapshot', help='.csv or .parquet snapshot to load (default: the newest in the '
+                                                'working directory)')
+    load_parser.add_argument('--bulk-load', action='store_true', help='insert in fast_executemany batches')
+    load_parser.add_argument('--incremental', action='store_true', help='only load new or changed properties')
+    load_parser.add_argument('--ledger', help='work ledger database of the run')
+    load_parser.set_defaults(command_function=load_command)
+
+    merge_parser = subparsers.add_parser('merge', help='merge the shard snapshots of a sharded run and load them')
+    merge_parser.add_argument('--shard-count', type=int, required=True,
+                              help='number of shards the properties were split into')
+    merge_parser.add_argument('--snapshot-dir', default='.',
+                              help='directory holding the shard snapshots (default: working directory)')
+    merge_parser.add_argument('--snapshot-store', help='snapshot store directory the merged snapshot is added to')
+    merge_parser.add_argument('--bulk-load', action='store_true', help='insert in fast_executemany batches')
+    merge_parser.add_argument('--incremental', action='store_true', help='only load new or changed properties')
+    merge_parser.add_argument('--ledger', help='work ledger database of the load')
+    merge_parser.set_defaults(command_function=merge_command)
+
+    run_parser = subparsers.add_parser('run', help='fetch, parse and load every property (default)')
+    run_parser.add_argument('--progress', action='store_true', help='print a progress bar')
+    run_parser.add_argument('--parallel', action='store_true', help='parse across a pool of processes')
+    run_parser.add_argument('--workers', type=int, help='worker processes with --parallel (default: CPU count)')
+    run_parser.add_argument('--bulk-load', action='store_true', help='insert in fast_executemany batches')
+    run_parser.add_argument('--pipelined', action='store_true',
+                            help='parse and load while fetching continues (ignores the asyncio, archive, cache, '
+                                 'ledger, snapshot and parse pool options)')
+    run_parser.add_argument('--asyncio', dest='use_asyncio', action='store_true',
+                            help='send the requests from a single asyncio event loop')
+    run_parser.add_argument('--max-concurrency', type=int, default=16,
+                            help='requests in flight with --asyncio (default: 16)')
+    run_parser.add_argument('--max-requests-per-second', type=float,
+                            help='request rate ceiling with --asyncio (default: none)')
+    run_parser.add_argument('--archive', action='store_true', help='save the responses to a response archive')
+    run_parser.add_argument('--snapshot-format', choices=['csv', 'parquet', 'both'], default='csv',
+                            help='format of the compiled snapshot (default: csv)')
+    run_parser.add_argument('--snapshot-store', help='snapshot store directory the snapshot is added to')
+    run_parser.add_argument('--parse-cache', help='parse cache database')
+    run_parser.add_argument('--section-cache', help='section cache database')
+    run_parser.add_argument('--full-query', action='store_true', help='request every field of the web app queries')
+    run_parser.add_argument('--ledger', help='work ledger database of the run')
+    run_parser.add_argument('--cookie-cache', help='encrypted session cookie cache file')
+
+    args = parser.parse_args(argv)
+    if args.command in ('fetch', 'parse'):
+        if (args.shard_index is None) != (args.shard_count is None):
+            parser.error('--shard-index and --shard-count must be given together')
+        if args.shard_count is not None and not 0 <= args.shard_index < args.shard_count:
+            parser.error('--shard-index must be from 0 to --shard-count - 1')
+    if args.command == 'parse' and args.shard_count is not None and args.snapshot_store is not None:
+        parser.error('--snapshot-store adds a whole run; pass it to merge for a sharded run')
+    if args.command in (None, 'run'):
+        if args.command is None:
+            args = parser.parse_args(['run'], namespace=args)
+        main(print_progress=args.progress, parallel_parse=args.parallel, parse_workers=args.workers,
+             bulk_load=args.bulk_load, pipelined=args.pipelined, use_archive=args.archive,
+             snapshot_format=args.snapshot_format, snapshot_store_dir=args.snapshot_store,
+             parse_cache_path=args.parse_cache, section_cache_path=args.section_cache,
+             full_payload_query=args.full_query, ledger_path=args.ledger, metrics_path=args.metrics,
+             prometheus_path=args.prometheus, cookie_cache_path=args.cookie_cache, use_asyncio=args.use_asyncio,
+             max_concurrency=args.max_concurrency, max_requests_per_second=args.max_requests_per_second)
+        return
+    # only fetch logs in, so the other stages can run from environment variables alone
+    load_environment(require_dotenv=args.command == 'fetch')
+    run_metrics.reset()
+    try:
+        args.command_function(args)
+    finally:
+        export_run_metrics(args.metrics, args.prometheus)
     return
 
 
 if __name__ == "__main__":
-    main(print_progress=False)
+    cli()
@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+"""
+Offline benchmarks of the parse, type conversion, amenity shrinking and load stages of
+CoStar_Property_Data_Scraper, run against deterministic synthetic call responses so no
+CoStar credentials or SQL Server are needed.
+
+Example:
+    python benchmark.py --sizes 1000 10000 100000 --output results.json
+    python benchmark.py --sizes 10000 --baseline results.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+import CoStar_Property_Data_Scraper as scraper
+
+UNIT_MIX_LABELS = ('All Studios', 'All 1 Beds', 'All 2 Beds', 'All 3 Beds', 'All 4 Beds')
+
+AMENITY_NAMES = ('24 Hour Access', 'Air Conditioning', 'Basketball Court', 'Bicycle Storage', 'Business Center',
+                 'Clubhouse', 'Controlled Access', 'Fitness Center', 'Grill', 'Laundry Facilities',
+                 'Maintenance on site', 'Package Service', 'Pet Play Area', 'Planned Social Activities', 'Pool',
+                 'Property Manager on Site', 'Storage Space', 'Walking/Biking Trails', 'Wheelchair Accessible (Rooms)')
+
+UNIT_AMENITY_NAMES = ('Air Conditioning', 'Cable Ready', 'Ceiling Fans', 'Dishwasher', 'Furnished Units Available',
+                      'Hardwood Floors', 'High Speed Internet Access', 'Refridgerator', 'Tenant Controlled HVAC',
+                      'Walk-In Closets', 'Washer/Dryer', 'Washer/Dryer Hookup')
+
+CITIES = (('Denver', 'CO', '802'), ('Austin', 'TX', '787'), ('Atlanta', 'GA', '303'), ('Phoenix', 'AZ', '850'),
+          ('Charlotte', 'NC', '282'), ('Nashville', 'TN', '372'))
+
+STAGES = ('parse', 'convert_types', 'shrink_amenities', 'load')
+
+
+def placeholder_or(rng, value, placeholder_rate=0.15):
+    """Return the '-' placeholder CoStar reports for missing metrics at the given rate, otherwise value."""
+    return '-' if rng.random() < placeholder_rate else value
+
+
+def generate_unit_mix_item(rng, label, units):
+    """Generate the unit mix summary item of a single bedroom type."""
+    area = rng.randint(400, 1600)
+    rent = rng.randint(700, 4000)
+    return {'totals': label,
+            'availablePercent': placeholder_or(rng, f'{rng.uniform(0, 20):.1f}%'),
+            'askingRentPerUnit': placeholder_or(rng, f'${rent:,}'),
+            'averageArea': placeholder_or(rng, f'{area:,}'),
+            'effectiveRentPerUnit': placeholder_or(rng, f'${int(rent * rng.uniform(0.9, 1)):,}'),
+            'concessions': placeholder_or(rng, f'{rng.uniform(0, 9):.1f}%', 0.4),
+            'unitMixBeds': placeholder_or(rng, f'{units:,}', 0.05)}
+
+
+def generate_response(prop_id, seed=0):
+    """
+    Generate a synthetic seven-operation call response for a single property.
+
+    The same prop_id and seed always give the same response. Responses vary the bedroom
+    types in the unit mix, report '-' for some metrics, and leave out optional sections
+    (unit mix totals, property manager, amenity lists, ZIP code) at realistic rates.
+
+    Parameters
+    ----------
+    prop_id : int
+        The CoStar Property ID of the synthetic property.
+    seed : int, optional
+        Seed of the generator. The default is 0.
+
+    Returns
+    -------
+    json_response : list of dict
+        One result per operation, in PAYLOAD_OPERATIONS order.
+
+    """
+    rng = random.Random(f'{seed}-{prop_id}')
+
+    labels = [label for label in UNIT_MIX_LABELS if rng.random() < 0.6]
+    unit_counts = [rng.randint(4, 300) for _ in labels]
+    summary_items = [generate_unit_mix_item(rng, label, units) for label, units in zip(labels, unit_counts)]
+    if labels and rng.random() < 0.95:
+        summary_items.append(generate_unit_mix_item(rng, 'Totals', sum(unit_counts)))
+
+    amenities_info = {'amenities': rng.sample(AMENITY_NAMES, rng.randint(0, 12)) if rng.random() < 0.9 else [],
+                      'unitAmenities': rng.sample(UNIT_AMENITY_NAMES, rng.randint(0, 8)) if rng.random() < 0.85 else [],
+                      'roomAmenities': []}
+
+    contacts_info = {'trueOwner': [{'name': f'Owner {rng.randint(1, 5000)} LLC'}]}
+    if rng.random() < 0.8:
+        contacts_info['propertyManager'] = [{'name': f'Property Management Company {rng.randint(1, 800)}'}]
+    elif rng.random() < 0.5:
+        contacts_info['propertyManager'] = []
+
+    city, state, zip_prefix = rng.choice(CITIES)
+    postal_code = f'{zip_prefix}{rng.randint(0, 99):02d}'
+    if rng.random() < 0.3:
+        postal_code += f'{rng.randint(0, 9999):04d}'
+    elif rng.random() < 0.05:
+        postal_code = None
+    property_info = {'address': {'buildingName': f'Synthetic Apartments {prop_id}',
+                                 'deliveryAddress': f'{rng.randint(1, 9999)} Main St',
+                                 'city': city,
+                                 'state': state,
+                                 'postalCode': postal_code},
+                     'latitude': round(rng.uniform(25, 48), 6),
+                     'longitude': round(rng.uniform(-122, -71), 6),
+                     'bldgClass': rng.choice(['A', 'B', 'C']),
+                     'buildingRating': rng.randint(1, 5),
+                     'yearBuilt': rng.choice([rng.randint(1950, 2024), None]),
+                     'numOfParkingSpaces': rng.choice([rng.randint(0, 900), 'None', None]),
+                     'numOfStories': rng.randint(1, 40)}
+
+    def result(root_field, value):
+        return {'data': {'propertyDetail': {root_field: value}}}
+
+    return [result('amenities_Info', amenities_info),
+            result('unit_mix_detail', {'summaryItems': summary_items}),
+            result('propertyContactDetails_info', {'__typename': 'PropertyContactDetails_Info'}),
+            result('location_Info', {'__typename': 'Location_Info'}),
+            result('get_comps_context', {'__typename': 'CompsContext'}),
+            result('propertyContactDetails_info', contacts_info),
+            result('property_info', property_info)]
+
+
+def write_response_archive(archive_path, num_properties, seed=0):
+    """
+    Write synthetic call responses for num_properties properties to a ResponseArchive.
+
+    Parameters
+    ----------
+    archive_path : str
+        Full file path of the archive file.
+    num_properties : int
+        Number of properties to generate.
+    seed : int, optional
+        Seed of the generator. The default is 0.
+
+    Returns
+    -------
+    None.
+
+    """
+    with scraper.ResponseArchive(archive_path, mode='a') as archive:
+        for prop_id in range(1000000, 1000000 + num_properties):
+            archive.append(str(prop_id), json.dumps(generate_response(prop_id, seed)))
+    return
+
+
+def create_sqlite_table(database_path, table_name):
+    """Create an empty SQLite copy of the CoStarPropertyExport table."""
+    columns = ', '.join(f'"{col}" BIGINT' if col == 'CoStarPropertyID' else f'"{col}"'
+                        for col in scraper.PROPERTY_COLUMNS)
+    connection = sqlite3.connect(database_path)
+    connection.execute(f'CREATE TABLE "{table_name}" ({columns}, CollectedDateStamp TIMESTAMP, MostRecentFlag INTEGER)')
+    connection.commit()
+    connection.close()
+    return
+
+
+def time_call(function, *args, **kwargs):
+    """Call function and return its result with the elapsed wall-clock seconds."""
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def run_benchmark(num_properties, work_dir, seed=0, parallel=False):
+    """
+    Time each stage on num_properties synthetic properties.
+
+    Parameters
+    ----------
+    num_properties : int
+        Number of properties to generate.
+    work_dir : str
+        Directory the archive and SQLite database are written to.
+    seed : int, optional
+        Seed of the generator. The default is 0.
+    parallel : bool, optional
+        Boolean indicator of whether to parse across a pool of processes. The default is False.
+
+    Returns
+    -------
+    results : list of dict
+        One result per stage with the stage name, number of properties, seconds and
+        properties per second.
+
+    """
+    archive_path = os.path.join(work_dir, f'{num_properties}_responses.arc')
+    database_path = os.path.join(work_dir, f'{num_properties}_costar.db')
+    write_response_archive(archive_path, num_properties, seed)
+    create_sqlite_table(database_path, 'CoStarPropertyExport')
+
+    timings = {}
+    # no cookies, so responses that fail to parse are dropped instead of retried over the network
+    records, timings['parse'] = time_call(scraper.parse_archive, archive_path, None, parallel=parallel)
+    df = scraper.records_to_df([record for record in records if record is not None])
+    _, timings['convert_types'] = time_call(scraper.convert_df_types, df)
+    _, timings['shrink_amenities'] = time_call(scraper.shrink_amenities, df['Amenities'])
+    _, timings['load'] = time_call(scraper.post_to_db, f'sqlite:///{database_path}', 'CoStarPropertyExport', df,
+                                   schema=None)
+    return [{'stage': stage,
+             'properties': num_properties,
+             'seconds': round(timings[stage], 6),
+             'properties_per_second': round(num_properties / max(timings[stage], 1e-9), 1)}
+            for stage in STAGES]
+
+
+def get_git_revision():
+    """Return the current git commit of the repository, or None outside a git checkout."""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def find_regressions(results, baseline_results, tolerance=0.2):
+    """
+    Compare stage timings with a previous benchmark run.
+
+    Parameters
+    ----------
+    results : list of dict
+        Stage results of this run.
+    baseline_results : list of dict
+        Stage results of the previous run.
+    tolerance : float, optional
+        Allowed fractional slowdown before a stage counts as a regression. The default is 0.2.
+
+    Returns
+    -------
+    regressions : list of dict
+        One entry per stage and size measured in both runs that is slower than the
+        baseline by more than tolerance.
+
+    """
+    baseline = {(result['stage'], result['properties']): result['seconds'] for result in baseline_results}
+    regressions = []
+    for result in results:
+        baseline_seconds = baseline.get((result['stage'], result['properties']))
+        if baseline_seconds and result['seconds'] > baseline_seconds * (1 + tolerance):
+            regressions.append({'stage': result['stage'],
+                                'properties': result['properties'],
+                                'seconds': result['seconds'],
+                                'baseline_seconds': baseline_seconds,
+                                'slowdown': round(result['seconds'] / baseline_seconds, 3)})
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the CoStar scraper stages on synthetic responses.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='numbers of properties to benchmark (default: 1000 10000 100000)')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the response generator (default: 0)')
+    parser.add_argument('--parallel', action='store_true', help='parse across a pool of processes')
+    parser.add_argument('--output', help='file the JSON results are written to (default: stdout only)')
+    parser.add_argument('--baseline', help='JSON results of a previous run to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed fractional slowdown against the baseline (default: 0.2)')
+    args = parser.parse_args(argv)
+
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for num_properties in args.sizes:
+            for result in run_benchmark(num_properties, work_dir, args.seed, args.parallel):
+                print(f"{result['stage']:>16} {result['properties']:>8,} properties: {result['seconds']:>9.3f}s "
+                      f"({result['properties_per_second']:,.0f}/s)", file=sys.stderr)
+                results.append(result)
+
+    report = {'created': datetime.datetime.now().isoformat(timespec='seconds'),
+              'git_revision': get_git_revision(),
+              'python': platform.python_version(),
+              'pandas': pd.__version__,
+              'json_backend': os.environ['COSTAR_JSON_BACKEND'],
+              'payload_query': os.environ['COSTAR_PAYLOAD_QUERY'],
+              'seed': args.seed,
+              'parallel': args.parallel,
+              'results': results}
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            report['regressions'] = find_regressions(results, json.load(f)['results'], args.tolerance)
+    report_json = json.dumps(report, indent=2)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            f.write(report_json + '\n')
+    print(report_json)
+    return 1 if report.get('regressions') else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+Shared fixtures of the CoStar_Property_Data_Scraper tests.
+"""
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmark  # noqa: E402
+import CoStar_Property_Data_Scraper as scraper  # noqa: E402
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def load_fixture(name):
+    """Load a JSON file from the fixtures directory."""
+    with open(os.path.join(FIXTURES_DIR, name)) as f:
+        return json.load(f)
+
+
+@pytest.fixture
+def call_responses():
+    """Dictionary of CoStar Property ID: synthetic call response generated by benchmark.generate_response."""
+    return load_fixture('call_responses.json')
+
+
+@pytest.fixture
+def expected_records():
+    """Dictionary of CoStar Property ID: record parsed from call_responses by the hand-written parser."""
+    return load_fixture('expected_records.json')
+
+
+@pytest.fixture
+def records_df(call_responses):
+    """DataFrame of the records parsed from call_responses."""
+    return scraper.records_to_df([scraper.parse_response_into_record(prop_id, json_response)
+                                  for prop_id, json_response in call_responses.items()])
+
+
+@pytest.fixture
+def sqlite_url(tmp_path):
+    """SQL Alchemy URL of an empty SQLite copy of the CoStarPropertyExport table."""
+    database_path = str(tmp_path / 'costar.db')
+    benchmark.create_sqlite_table(database_path, 'CoStarPropertyExport')
+    return f'sqlite:///{database_path}'
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the asyncio fetch and retry paths against a local aiohttp server standing in for
+the CoStar API.
+"""
+import asyncio
+import json
+
+import pytest
+
+import CoStar_Property_Data_Scraper as scraper
+
+web = pytest.importorskip('aiohttp.web')
+
+
+class MockCoStarAPI:
+    """
+    Local aiohttp server answering each call with the fixture response of the requested
+    property. The status of the next calls of a property can be overridden, and a property
+    can have its next calls dropped mid-response.
+    """
+
+    def __init__(self, call_responses):
+        self.call_responses = call_responses
+        self.statuses = {}
+        self.drops = {}
+        self.calls = 0
+
+    async def handle(self, request):
+        self.calls += 1
+        payload = await request.json()
+        prop_id = str(payload[0]['variables']['propertyId'])
+        if self.drops.get(prop_id, 0) > 0:
+            self.drops[prop_id] -= 1
+            # promise a longer body than is sent, then hang up
+            response = web.StreamResponse(headers={'Content-Length': '1000'})
+            await response.prepare(request)
+            await response.write(b'[{')
+            request.transport.close()
+            return response
+        statuses = self.statuses.get(prop_id, [])
+        status = statuses.pop(0) if statuses else 200
+        if status != 200:
+            return web.Response(status=status, text='Service Unavailable')
+        return web.Response(text=json.dumps(self.call_responses[prop_id]), content_type='application/json')
+
+    async def run(self, coroutine_function):
+        """Serve on a free local port while awaiting coroutine_function(url)."""
+        app = web.Application()
+        app.router.add_post('/graphql', self.handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        port = runner.addresses[0][1]
+        try:
+            return await coroutine_function(f'http://127.0.0.1:{port}/graphql')
+        finally:
+            await runner.cleanup()
+
+
+@pytest.fixture
+def api(call_responses):
+    return MockCoStarAPI(call_responses)
+
+
+@pytest.fixture(autouse=True)
+def no_retry_delay(monkeypatch):
+    monkeypatch.setattr(scraper, 'get_retry_delay', lambda attempt: 0)
+    scraper.run_metrics.reset()
+
+
+def test_fetch_responses_async_archives_every_response(api, call_responses, tmp_path):
+    archive_path = str(tmp_path / 'responses.arc')
+    with scraper.ResponseArchive(archive_path, mode='a') as archive:
+        statuses = asyncio.run(api.run(lambda url: scraper.fetch_responses_async(
+            list(call_responses), url, {}, str(tmp_path), max_concurrency=4, archive=archive)))
+    assert statuses == {prop_id: 200 for prop_id in call_responses}
+    records = scraper.parse_archive(archive_path, None)
+    assert sorted(record['CoStarPropertyID'] for record in records) == sorted(call_responses)
+
+
+def test_fetch_connection_error_saves_empty_response_for_retry(api, call_responses, tmp_path):
+    dropped_prop_id = next(iter(call_responses))
+    api.drops[dropped_prop_id] = 1
+    archive_path = str(tmp_path / 'responses.arc')
+    with scraper.ResponseArchive(archive_path, mode='a') as archive:
+        statuses = asyncio.run(api.run(lambda url: scraper.fetch_responses_async(
+            list(call_responses), url, {}, str(tmp_path), archive=archive)))
+    assert statuses[dropped_prop_id] is None
+    assert scraper.run_metrics.counter_value('connection_errors_total') == 1
+    with scraper.ResponseArchive(archive_path) as archive:
+        assert archive.read(dropped_prop_id) == ''
+
+
+def test_retry_responses_async_recovers_transient_failures(api, call_responses):
+    prop_ids = list(call_responses)[:3]
+    api.statuses[prop_ids[0]] = [503]
+    api.drops[prop_ids[1]] = 1
+    responses, failures = asyncio.run(api.run(lambda url: scraper.retry_responses_async(prop_ids, url, {})))
+    assert set(responses) == set(prop_ids)
+    assert json.loads(responses[prop_ids[0]]) == call_responses[prop_ids[0]]
+    assert failures == {'http_503': 1, 'connection_error': 1}
+
+
+def test_retry_responses_async_stops_at_the_budget(api, call_responses):
+    prop_ids = list(call_responses)[:2]
+    for prop_id in prop_ids:
+        api.statuses[prop_id] = [503] * 10
+    responses, failures = asyncio.run(api.run(lambda url: scraper.retry_responses_async(
+        prop_ids, url, {}, max_attempts=3, retry_budget=4)))
+    assert responses == {}
+    assert failures['http_503'] == 4
+    # how the four attempts split between the properties depends on scheduling
+    assert failures['budget_exhausted'] >= 1
+    assert api.calls == 4
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the SQL load stage against a SQLite copy of the export table.
+"""
+import pytest
+from sqlalchemy import create_engine
+
+import CoStar_Property_Data_Scraper as scraper
+
+TABLE = 'CoStarPropertyExport'
+
+
+def count_rows(sqlite_url):
+    """Return the number of rows, flagged rows and properties with a flagged row in the table."""
+    engine = create_engine(sqlite_url)
+    return tuple(engine.execute(f'SELECT COUNT(*), SUM(MostRecentFlag), '
+                                f'COUNT(DISTINCT CASE WHEN MostRecentFlag = 1 THEN CoStarPropertyID END) '
+                                f'FROM {TABLE}').fetchone())
+
+
+@pytest.mark.parametrize('bulk_load', [False, True])
+def test_post_to_db_flags_only_the_latest_rows(sqlite_url, records_df, bulk_load):
+    scraper.post_to_db(sqlite_url, TABLE, records_df, schema=None, bulk_load=bulk_load)
+    scraper.post_to_db(sqlite_url, TABLE, records_df, schema=None, bulk_load=bulk_load)
+    assert count_rows(sqlite_url) == (2 * len(records_df), len(records_df), len(records_df))
+
+
+def test_post_to_db_incremental_loads_changed_properties(sqlite_url, records_df):
+    scraper.post_to_db(sqlite_url, TABLE, records_df, schema=None)
+    changed_df = records_df.copy()
+    changed_df.loc[0, 'PropertyName'] = 'Renamed Apartments'
+    scraper.post_to_db(sqlite_url, TABLE, changed_df, schema=None, incremental=True)
+    assert count_rows(sqlite_url) == (len(records_df) + 1, len(records_df), len(records_df))
+    engine = create_engine(sqlite_url)
+    assert engine.execute(f'SELECT PropertyName FROM {TABLE} WHERE MostRecentFlag = 1 '
+                          f'AND CoStarPropertyID = {records_df.loc[0, "CoStarPropertyID"]}').scalar() \
+        == 'Renamed Apartments'
+
+
+def test_post_to_db_ledger_skips_loaded_properties(sqlite_url, records_df, tmp_path):
+    ledger_path = str(tmp_path / 'ledger.db')
+    with scraper.WorkLedger(ledger_path) as ledger:
+        ledger.mark(records_df['CoStarPropertyID'][:5], 'loaded')
+    scraper.post_to_db(sqlite_url, TABLE, records_df, schema=None, ledger_path=ledger_path)
+    assert count_rows(sqlite_url)[0] == len(records_df) - 5
+    with scraper.WorkLedger(ledger_path) as ledger:
+        assert ledger.prop_ids('loaded') == set(records_df['CoStarPropertyID'])
+
+
+def test_load_df_to_sql_rolls_back_with_its_transaction(sqlite_url, records_df):
+    data_df = scraper.prepare_df_for_sql(records_df).assign(MostRecentFlag=1)
+    engine = scraper.create_db_engine(sqlite_url)
+    with pytest.raises(RuntimeError):
+        with engine.begin() as connection:
+            scraper.load_df_to_sql(data_df, connection, TABLE, schema=None)
+            raise RuntimeError('load failed')
+    assert count_rows(sqlite_url)[0] == 0
+    assert scraper.load_df_to_sql(data_df, engine, TABLE, schema=None) > 0
+    assert count_rows(sqlite_url)[0] == len(records_df)
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the record extraction from call responses.
+"""
+import copy
+import math
+
+import pytest
+
+import CoStar_Property_Data_Scraper as scraper
+
+
+def same_value(value, expected):
+    """Compare two record values, treating NaN as equal to NaN."""
+    if isinstance(value, float) and isinstance(expected, float) and math.isnan(value) and math.isnan(expected):
+        return True
+    return value == expected
+
+
+def test_records_match_hand_written_parser(call_responses, expected_records):
+    # expected_records were parsed by the hand-written traversals the extraction plan replaced
+    for prop_id, json_response in call_responses.items():
+        record = scraper.parse_response_into_record(prop_id, json_response)
+        expected = expected_records[prop_id]
+        assert list(record) == list(expected)
+        mismatched = [column for column in record if not same_value(record[column], expected[column])]
+        assert not mismatched, f'{prop_id}: {mismatched}'
+
+
+def test_records_to_df_orders_property_columns(call_responses):
+    records = [scraper.parse_response_into_record(prop_id, json_response)
+               for prop_id, json_response in call_responses.items()]
+    df = scraper.records_to_df(records)
+    assert list(df.columns) == scraper.PROPERTY_COLUMNS
+    assert len(df) == len(call_responses)
+
+
+def test_graphql_errors_raise_response_error(call_responses):
+    prop_id, json_response = next(iter(call_responses.items()))
+    json_response = copy.deepcopy(json_response)
+    json_response[scraper.PAYLOAD_OPERATIONS.index('getPropertyInfo')] = {'errors': [{'message': 'boom'}],
+                                                                         'data': None}
+    with pytest.raises(scraper.ResponseError) as excinfo:
+        scraper.parse_response_into_record(prop_id, json_response)
+    assert excinfo.value.category == 'graphql_errors'
+
+
+def test_truncated_response_raises_response_error(call_responses):
+    prop_id, json_response = next(iter(call_responses.items()))
+    with pytest.raises(scraper.ResponseError) as excinfo:
+        scraper.parse_response_into_record(prop_id, json_response[:-1])
+    assert excinfo.value.category == 'unexpected_shape'
+
+
+def test_schema_hash_changes_with_transform_body(monkeypatch):
+    schema_hash = scraper.hash_extraction_schema()
+    operation, path, transform, optional = scraper.COLUMN_EXTRACTION_SPEC['Zip']
+
+    def truncate_zip(postal_code):
+        return postal_code[:4]
+    monkeypatch.setitem(scraper.COLUMN_EXTRACTION_SPEC, 'Zip', (operation, path, truncate_zip, optional))
+    assert scraper.hash_extraction_schema() != schema_hash